@@ -0,0 +1,239 @@
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+import wav_writer
+
+# Player for the converter's 16-bit PCM. Sentences are appended as they are synthesized and
+# pushed into QAudioOutput's buffer a little ahead of the playhead, so a conversion plays
+# gaplessly while it is still running. Only the newest RING_BYTES of a stream stay in
+# memory; older audio, for seeking back or when generation runs far ahead of playback, is
+# read from the WAV the converter is writing, and finished files are played from disk a
+# device buffer at a time, so memory stays flat however long the render is.
+FEED_INTERVAL_MS = 20
+# Audio queued in the device: enough to ride out a busy GUI thread, small enough to seek
+DEVICE_BUFFER_SECONDS = 0.25
+SAMPLE_WIDTH = 2
+# Larger than what the WAV writer may still hold unflushed, so audio dropped from the ring
+# is always on disk
+RING_BYTES = 2 * wav_writer.FLUSH_INTERVAL_BYTES
+
+
+class StreamPlayer(QObject):
+    # The subset of QMediaPlayer the app uses, plus a count of buffer underruns: times the
+    # device ran dry while the conversion was still producing audio
+    positionChanged = pyqtSignal(int)
+    durationChanged = pyqtSignal(int)
+    underrun = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # The newest audio, from byte ring_start of total bytes; the rest is read from path,
+        # where byte 0 is at data_offset. A stream that started file_start bytes into the
+        # file's audio plays from there
+        self.ring = bytearray()
+        self.ring_start = 0
+        self.total = 0
+        self.path = None
+        self.data_offset = 0
+        self.file_start = 0
+        self.sample_rate = None
+        self.channels = 1
+        self.output = None
+        self.device = None
+        # Byte offsets into the audio: where the device was last started and the next byte to push
+        self.start_offset = 0
+        self.offset = 0
+        self.streaming = False
+        self.playing = False
+        self.starved = False
+        self.underruns = 0
+        self.volume = 100
+        self.timer = QTimer(self)
+        self.timer.setInterval(FEED_INTERVAL_MS)
+        self.timer.timeout.connect(self._feed)
+
+    @property
+    def frame_size(self):
+        return self.channels * SAMPLE_WIDTH
+
+    def has_audio(self):
+        return bool(self.total) or self.streaming
+
+    def clear(self):
+        self.timer.stop()
+        self._stop_output()
+        self.ring = bytearray()
+        self.ring_start = self.total = 0
+        self.path = None
+        self.data_offset = self.file_start = 0
+        self.sample_rate = None
+        self.start_offset = self.offset = 0
+        self.streaming = self.playing = self.starved = False
+        self.underruns = 0
+        self.durationChanged.emit(0)
+        self.positionChanged.emit(0)
+
+    def start_stream(self, path=None, file_start=0):
+        # Audio arrives through append() until finish_stream(); path is the WAV it is being
+        # written to, and file_start the byte of its audio where the first append() starts.
+        # Without a path the whole stream has to stay in memory
+        self.clear()
+        self.streaming = True
+        self.path = path
+        self.file_start = file_start
+        self.data_offset = wav_writer.HEADER_SIZE + file_start
+
+    def append(self, pcm, sample_rate, channels=1):
+        if self.sample_rate is None:
+            self.sample_rate = sample_rate
+            self.channels = channels
+        elif (sample_rate, channels) != (self.sample_rate, self.channels):
+            # The WAV writer rejects mixed formats too, so the conversion is failing anyway
+            return False
+        self.ring += pcm
+        self.total += len(pcm)
+        if self.path and len(self.ring) > RING_BYTES:
+            drop = len(self.ring) - RING_BYTES
+            drop -= drop % self.frame_size
+            del self.ring[:drop]
+            self.ring_start += drop
+        self.durationChanged.emit(self.duration())
+        if self.playing:
+            self._feed()
+        return True
+
+    def finish_stream(self, path=None):
+        # path is where the finished WAV ended up, if it was moved
+        self.streaming = False
+        if path:
+            self.path = path
+            self.data_offset = wav_writer.read_layout(path)['data_offset'] + self.file_start
+
+    def load_file(self, path):
+        # Reads only the header; the audio is read as it is played
+        layout = wav_writer.read_layout(path)
+        if layout['sample_width'] != SAMPLE_WIDTH:
+            raise ValueError(f"{path} is not 16-bit PCM")
+        self.clear()
+        self.path = path
+        self.data_offset = layout['data_offset']
+        self.sample_rate = layout['sample_rate']
+        self.channels = layout['channels']
+        self.total = self.ring_start = layout['data_bytes'] - layout['data_bytes'] % self.frame_size
+        self.durationChanged.emit(self.duration())
+
+    def duration(self):
+        if not self.sample_rate:
+            return 0
+        return self.total // self.frame_size * 1000 // self.sample_rate
+
+    def position(self):
+        if not self.sample_rate:
+            return 0
+        position = self.start_offset // self.frame_size * 1000 // self.sample_rate
+        if self.output is not None:
+            position += self.output.processedUSecs() // 1000
+        return min(position, self.duration())
+
+    def play(self):
+        if not self.total or self.playing:
+            return
+        if self.offset >= self.total and not self.streaming:
+            # Played to the end: start over, like QMediaPlayer does
+            self._stop_output()
+            self.start_offset = self.offset = 0
+        if self.output is None:
+            self._start_output()
+        else:
+            self.output.resume()
+        self.playing = True
+        self.timer.start()
+        self._feed()
+
+    def pause(self):
+        if not self.playing:
+            return
+        self.playing = False
+        self.timer.stop()
+        if self.output is not None:
+            self.output.suspend()
+
+    def setPosition(self, position):
+        if not self.sample_rate:
+            return
+        offset = position * self.sample_rate // 1000 * self.frame_size
+        offset = max(0, min(offset, self.total))
+        # Whatever is queued in the device belongs to the old position
+        self._stop_output()
+        self.start_offset = self.offset = offset
+        self.starved = False
+        if self.playing:
+            self._start_output()
+            self._feed()
+        self.positionChanged.emit(self.position())
+
+    def setVolume(self, volume):
+        self.volume = volume
+        if self.output is not None:
+            self.output.setVolume(volume / 100)
+
+    def _start_output(self):
+        from PyQt5.QtMultimedia import QAudioFormat, QAudioOutput
+        audio_format = QAudioFormat()
+        audio_format.setSampleRate(self.sample_rate)
+        audio_format.setChannelCount(self.channels)
+        audio_format.setSampleSize(SAMPLE_WIDTH * 8)
+        audio_format.setCodec('audio/pcm')
+        audio_format.setByteOrder(QAudioFormat.LittleEndian)
+        audio_format.setSampleType(QAudioFormat.SignedInt)
+        self.output = QAudioOutput(audio_format, self)
+        self.output.setBufferSize(int(self.sample_rate * DEVICE_BUFFER_SECONDS) * self.frame_size)
+        self.output.setVolume(self.volume / 100)
+        self.device = self.output.start()
+
+    def _stop_output(self):
+        if self.output is not None:
+            self.output.stop()
+            self.output.deleteLater()
+        self.output = None
+        self.device = None
+
+    def _read(self, offset, size):
+        size = min(size, self.total - offset)
+        if offset >= self.ring_start:
+            start = offset - self.ring_start
+            return bytes(self.ring[start:start + size])
+        # Older than the ring: read from the file, up to where the ring takes over. The file
+        # is opened per read so a finished render can still be moved into place
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self.data_offset + offset)
+                return f.read(min(size, self.ring_start - offset))
+        except OSError:
+            # Being moved to its final name; finish_stream() gives the new path
+            return b''
+
+    def _feed(self):
+        if not self.playing or self.device is None:
+            return
+        from PyQt5.QtMultimedia import QAudio
+        free = self.output.bytesFree()
+        free -= free % self.frame_size
+        if free and self.offset < self.total:
+            data = self._read(self.offset, free)
+            written = self.device.write(data) if data else 0
+            if written > 0:
+                self.offset += written
+                self.starved = False
+        elif self.offset >= self.total and self.output.state() == QAudio.IdleState:
+            if self.streaming:
+                # Count each time the device runs dry once, not every tick until audio arrives
+                if not self.starved:
+                    self.starved = True
+                    self.underruns += 1
+                    self.underrun.emit(self.underruns)
+            else:
+                self.playing = False
+                self.timer.stop()
+                self.positionChanged.emit(self.duration())
+                return
+        self.positionChanged.emit(self.position())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Audio seconds rendered per second by the onnx engine at different batch sizes.
+#
+# Renders the sentences of a corpus with OnnxVoice.synthesize_batch, capping the
+# padded batches at each --sizes value (1 is one forward pass per sentence).
+# Phonemes are precomputed, so only inference and padding are measured. First it checks
+# that batched sentences come out the same as sentences rendered alone, and exits with an
+# error if any differs (real voices add random noise, use --noise-scale 0 --noise-w 0).
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure onnx engine throughput against batch size.')
+    parser.add_argument('voice', nargs='?', help='.onnx file to measure (default: a benchmark stub voice)')
+    parser.add_argument('--corpus', default='chapter', help='benchmark corpus to render (see run_benchmarks.py)')
+    parser.add_argument('--sizes', default='1,2,4,8,16,32', help='comma separated batch sizes')
+    parser.add_argument('--profile', default='throughput', help='inference profile of the session')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Write the measurements as JSON')
+    parser.add_argument('--noise-scale', type=float, default=0.667)
+    parser.add_argument('--noise-w', type=float, default=0.8)
+    parser.add_argument('--stub-lengths', action='store_true',
+                        help='give the stub voice a per-row length output, like some exports have')
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    import onnx_engine
+    import run_benchmarks
+    import tts_core
+    from phoneme_store import PhonemeStore
+    if not onnx_engine.available():
+        raise SystemExit('The onnx engine needs numpy, onnxruntime and piper-phonemize')
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    params = {'noise_scale': args.noise_scale, 'length_scale': 1.0, 'noise_w': args.noise_w}
+    results = []
+    with tempfile.TemporaryDirectory(prefix='batch-bench-') as work_dir:
+        model_path = args.voice
+        if not model_path:
+            run_benchmarks.create_stub_voices(work_dir)
+            model_path = os.path.join(work_dir, f"{run_benchmarks.DEFAULT_VOICE}.onnx")
+            if args.stub_lengths:
+                import stub_onnx_voice
+                stub_onnx_voice.write_model(model_path, lengths_output=True)
+        text = ' '.join(run_benchmarks.load_corpus(args.corpus))
+        sentences = [tts_core.filter_text_segment(sentence) for sentence in tts_core.split_sentences(text)]
+        sentences = [sentence for sentence in sentences if sentence]
+        store = PhonemeStore(os.path.join(work_dir, 'phonemes.sqlite3'))
+        voice = onnx_engine.OnnxVoice(model_path, store, args.profile)
+        if not voice.supports_batching:
+            raise SystemExit(f"{model_path} has a fixed batch size of 1")
+        voice.precompute(sentences)
+        batched = voice.synthesize_batch(sentences, params, max_size=max(sizes))
+        differing = [index for index, sentence in enumerate(sentences)
+                     if batched[index] != voice.synthesize(sentence, params)]
+        if differing:
+            raise SystemExit(f"{len(differing)} of {len(sentences)} batched sentences differ from unbatched "
+                             f"renders, first: {sentences[differing[0]]!r}")
+        print(f"batched and unbatched renders match ({len(sentences)} sentences, "
+              f"{'length output' if voice.length_output else 'trimmed'})")
+
+        for size in sizes:
+            walls = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                rendered = voice.synthesize_batch(sentences, params, max_size=size)
+                walls.append(time.perf_counter() - start)
+            audio_seconds = sum(len(pcm) / 2 / sample_rate for pcm, sample_rate in rendered)
+            wall = statistics.median(walls)
+            result = {
+                'batch_size': size,
+                'sentences': len(sentences),
+                'wall_s': round(wall, 4),
+                'audio_s': round(audio_seconds, 2),
+                'audio_s_per_s': round(audio_seconds / wall, 2) if wall else None,
+            }
+            results.append(result)
+            print(f"batch {size:>3}  wall {result['wall_s']:8.3f}s  {result['audio_s_per_s']:10.2f} audio s/s")
+        store.close()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"batch-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'cpu_count': os.cpu_count(), 'voice': os.path.basename(model_path), 'profile': args.profile,
+                   'results': results}, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# Voice load time with and without the saved ONNX Runtime optimized graph.
+#
+# Every sample loads the voice in a fresh interpreter. A cold sample removes the
+# cached graph first, so ORT optimizes the model and saves it again; a warm sample
+# loads the graph saved by the previous cold one. Voices default to the models
+# folder; --stub measures the tiny models used by run_benchmarks.py instead.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+LOAD_PROBE = '''
+import json, sys, time
+sys.path.insert(0, {repo!r})
+import onnx_engine
+if {cold!r}:
+    onnx_engine.remove_optimized_model({model!r})
+voice = onnx_engine.OnnxVoice({model!r})
+print(json.dumps({{'load_s': voice.load_seconds, 'cache': voice.load_cache}}))
+'''
+
+
+def run_probe(model_path, cold):
+    code = LOAD_PROBE.format(repo=REPO_DIR, model=model_path, cold=cold)
+    completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise SystemExit(f"Load probe failed for {model_path}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def list_voices(models_dir):
+    return sorted(os.path.join(models_dir, name) for name in os.listdir(models_dir) if name.endswith('.onnx'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare cold and warm voice load times.')
+    parser.add_argument('voices', nargs='*', help='.onnx files (default: every voice in the models folder)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stub', action='store_true', help='measure the benchmark stub voices')
+    parser.add_argument('--output', help='Write the measurements as JSON')
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    import onnx_engine
+    if not onnx_engine.available():
+        raise SystemExit('The onnx engine needs numpy, onnxruntime and piper-phonemize')
+    voices = args.voices
+    if args.stub:
+        import run_benchmarks
+        stub_dir = tempfile.TemporaryDirectory(prefix='load-bench-')
+        run_benchmarks.create_stub_voices(stub_dir.name)
+        voices = list_voices(stub_dir.name)
+    elif not voices:
+        import tts_core
+        voices = list_voices(tts_core.model_folder)
+    if not voices:
+        raise SystemExit('No voices to measure')
+
+    results = []
+    for model_path in voices:
+        cold, warm = [], []
+        for _ in range(args.repeat):
+            cold.append(run_probe(model_path, True)['load_s'])
+            sample = run_probe(model_path, False)
+            if sample['cache'] != 'warm':
+                raise SystemExit(f"Optimized graph of {model_path} was not reused")
+            warm.append(sample['load_s'])
+        result = {
+            'voice': os.path.splitext(os.path.basename(model_path))[0],
+            'model_bytes': os.path.getsize(model_path),
+            'cold_load_s': statistics.median(cold),
+            'warm_load_s': statistics.median(warm),
+        }
+        result['speedup'] = result['cold_load_s'] / result['warm_load_s'] if result['warm_load_s'] else None
+        results.append(result)
+        print(f"{result['voice']:>30}  cold {result['cold_load_s']:.3f}s  warm {result['warm_load_s']:.3f}s  "
+              f"({result['speedup']:.2f}x)")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'repeat': args.repeat, 'voices': results}, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
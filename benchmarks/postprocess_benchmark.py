@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Speed of the per-sentence post-processing stage (postprocess.py), as a multiple of
+# real time. Sentences are synthetic: speech-like modulated noise at varying levels
+# with leading and trailing silence, like piper output before trimming.
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+
+def synthetic_sentences(np, count, sample_rate, seed=0):
+    rng = np.random.default_rng(seed)
+    sentences = []
+    for _ in range(count):
+        seconds = rng.uniform(1.0, 6.0)
+        t = np.arange(int(seconds * sample_rate)) / sample_rate
+        envelope = np.abs(np.sin(2 * np.pi * rng.uniform(2.0, 5.0) * t))
+        speech = rng.standard_normal(len(t)) * envelope * rng.uniform(0.05, 0.8)
+        lead, tail = (np.zeros(int(rng.uniform(0.05, 0.4) * sample_rate)) for _ in range(2))
+        audio = np.concatenate([lead, speech, tail]) + rng.standard_normal(len(lead) + len(t) + len(tail)) * 1e-4
+        sentences.append((np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes())
+    return sentences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure per-sentence post-processing speed.')
+    parser.add_argument('--sentences', type=int, default=200)
+    parser.add_argument('--sample-rate', type=int, default=22050)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Write the measurements as JSON')
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    import postprocess
+    if not postprocess.available():
+        raise SystemExit('Post-processing needs numpy')
+    np = postprocess._np()
+    sentences = synthetic_sentences(np, args.sentences, args.sample_rate)
+    audio_seconds = sum(len(pcm) / 2 for pcm in sentences) / args.sample_rate
+
+    results = []
+    for mode in postprocess.MODES:
+        walls = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            processed = [postprocess.process_pcm(pcm, args.sample_rate, mode, 0.2) for pcm in sentences]
+            walls.append(time.perf_counter() - start)
+        wall = statistics.median(walls)
+        output_seconds = sum(len(pcm) / 2 for pcm in processed) / args.sample_rate
+        result = {
+            'mode': mode,
+            'sentences': len(sentences),
+            'audio_s': round(audio_seconds, 2),
+            'output_audio_s': round(output_seconds, 2),
+            'wall_s': round(wall, 4),
+            'times_real_time': round(audio_seconds / wall, 1) if wall else None,
+        }
+        results.append(result)
+        print(f"{mode:>9}  {result['wall_s']:.3f}s for {audio_seconds:.0f}s of audio  "
+              f"{result['times_real_time']:.0f}x real time")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"postprocess-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'sample_rate': args.sample_rate, 'results': results}, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
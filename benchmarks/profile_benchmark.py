@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# Picks the onnx engine inference profile that suits this machine best.
+#
+# Each profile runs in a fresh interpreter, so peak RSS reflects its memory settings.
+# It renders the sentences of a corpus once as a single stream (per-sentence latency)
+# and once with one thread per CPU (audio seconds per second). --save writes the pick
+# for --goal to the models folder, where the app reads it on start.
+import argparse
+import concurrent.futures
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+# goal -> (result field, True when higher is better)
+GOALS = {
+    'latency': ('sentence_latency_s', False),
+    'throughput': ('audio_s_per_s', True),
+    'memory': ('peak_rss_kb', False),
+}
+
+
+def run_probe(profile, model_path, corpus, sentence_limit):
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    import onnx_engine
+    import run_benchmarks
+    import tts_core
+    from phoneme_store import PhonemeStore
+
+    text = ' '.join(run_benchmarks.load_corpus(corpus))
+    sentences = [tts_core.filter_text_segment(sentence) for sentence in tts_core.split_sentences(text)]
+    sentences = [sentence for sentence in sentences if sentence][:sentence_limit]
+    with tempfile.TemporaryDirectory(prefix='profile-bench-') as work_dir:
+        store = PhonemeStore(os.path.join(work_dir, 'phonemes.sqlite3'))
+        start = time.perf_counter()
+        voice = onnx_engine.OnnxVoice(model_path, store, profile)
+        load_seconds = time.perf_counter() - start
+        # Phonemes and the first run are not what the profiles change
+        voice.precompute(sentences)
+        voice.synthesize(sentences[0])
+
+        latencies = []
+        for sentence in sentences:
+            start = time.perf_counter()
+            voice.synthesize(sentence)
+            latencies.append(time.perf_counter() - start)
+
+        audio_seconds = 0.0
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for pcm, sample_rate in executor.map(voice.synthesize, sentences):
+                audio_seconds += len(pcm) / 2 / sample_rate
+        wall = time.perf_counter() - start
+        store.close()
+
+    result = {
+        'profile': profile,
+        'sentences': len(sentences),
+        'load_s': round(load_seconds, 4),
+        'sentence_latency_s': round(statistics.median(latencies), 5),
+        'audio_s_per_s': round(audio_seconds / wall, 2) if wall else None,
+        'peak_rss_kb': None,
+    }
+    if resource:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        scale = 1024 if sys.platform == 'darwin' else 1
+        result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale
+    return result
+
+
+def best_profile(results, goal):
+    field, higher = GOALS[goal]
+    measured = [result for result in results if result[field] is not None]
+    if not measured:
+        return None
+    pick = max if higher else min
+    return pick(measured, key=lambda result: result[field])['profile']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare onnx engine inference profiles on this machine.')
+    parser.add_argument('voice', nargs='?', help='.onnx file to measure (default: a benchmark stub voice)')
+    parser.add_argument('--corpus', default='chapter', help='benchmark corpus to render (see run_benchmarks.py)')
+    parser.add_argument('--sentences', type=int, default=40, help='sentences rendered per pass')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--goal', choices=sorted(GOALS), default='latency')
+    parser.add_argument('--save', action='store_true', help='make the pick the default of this machine')
+    parser.add_argument('--output', help='Write the measurements as JSON')
+    parser.add_argument('--probe', help=argparse.SUPPRESS)
+    parser.add_argument('--model', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        print(json.dumps(run_probe(args.probe, args.model, args.corpus, args.sentences)))
+        return
+
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    import onnx_engine
+    import run_benchmarks
+    if not onnx_engine.available():
+        raise SystemExit('The onnx engine needs numpy, onnxruntime and piper-phonemize')
+    with tempfile.TemporaryDirectory(prefix='profile-bench-') as stub_dir:
+        model_path = args.voice
+        if not model_path:
+            run_benchmarks.create_stub_voices(stub_dir)
+            model_path = os.path.join(stub_dir, f"{run_benchmarks.DEFAULT_VOICE}.onnx")
+        results = []
+        for profile in onnx_engine.INFERENCE_PROFILES:
+            samples = []
+            for _ in range(args.repeat):
+                command = [sys.executable, os.path.abspath(__file__), '--probe', profile, '--model', model_path,
+                           '--corpus', args.corpus, '--sentences', str(args.sentences)]
+                completed = subprocess.run(command, capture_output=True, text=True)
+                if completed.returncode != 0:
+                    sys.stderr.write(completed.stderr)
+                    raise SystemExit(f"Profile {profile} failed")
+                samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+            result = dict(samples[0])
+            for field in ('load_s', 'sentence_latency_s', 'audio_s_per_s', 'peak_rss_kb'):
+                values = [sample[field] for sample in samples if sample[field] is not None]
+                result[field] = statistics.median(values) if values else None
+            results.append(result)
+            print(f"{profile:>11}  latency {result['sentence_latency_s'] * 1000:8.2f}ms  "
+                  f"throughput {result['audio_s_per_s']:8.2f} audio s/s  rss {result['peak_rss_kb']} kB")
+
+    picks = {goal: best_profile(results, goal) for goal in GOALS}
+    print(f"Best for {args.goal}: {picks[args.goal]}")
+    if args.save and picks[args.goal]:
+        import tts_core
+        with open(tts_core.inference_profile_path, 'w', encoding='utf-8') as f:
+            f.write(picks[args.goal])
+        print(f"Saved to {tts_core.inference_profile_path}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"profiles-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'cpu_count': os.cpu_count(), 'voice': os.path.basename(model_path), 'goal': args.goal,
+                   'picks': picks, 'results': results}, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# Throughput and latency benchmarks for the synthesis pipeline.
+#
+# Every (corpus, backend) case runs in a fresh interpreter so peak RSS is not
+# polluted by earlier cases. Audio comes from stub_piper.py, which makes the
+# numbers reproducible on machines without real voices or piper.exe.
+import argparse
+import concurrent.futures
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+CORPORA_DIR = os.path.join(BENCH_DIR, 'corpora')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+STUB_PIPER = os.path.join(BENCH_DIR, 'stub_piper.py')
+
+STUB_VOICES = {'bench_voice_a': 22050, 'bench_voice_b': 22050}
+# name -> number of speakers, for the speaker sweep benchmark
+STUB_MULTI_SPEAKER_VOICES = {'bench_voice_speakers': 20}
+DEFAULT_VOICE = 'bench_voice_a'
+
+# name -> (file, mode); "lines" runs one conversion per line, "document" one for the whole file
+CORPORA = {
+    'chat': ('chat.txt', 'lines'),
+    'chapter': ('chapter.txt', 'document'),
+    'multivoice': ('multivoice.txt', 'document'),
+    'dialogue': ('dialogue.txt', 'document'),
+    'ivr': ('ivr.txt', 'document'),
+}
+
+
+def load_core_module():
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    import tts_core
+    return tts_core
+
+
+def load_corpus(name):
+    file_name, mode = CORPORA[name]
+    with open(os.path.join(CORPORA_DIR, file_name), 'r', encoding='utf-8') as f:
+        text = f.read()
+    if mode == 'lines':
+        return [line for line in text.splitlines() if line.strip()]
+    return [text]
+
+
+def onnx_engine_available():
+    try:
+        import onnx
+        import onnxruntime
+        import piper_phonemize
+    except ImportError:
+        return False
+    return True
+
+
+def create_stub_voices(model_dir):
+    # stub_piper.py ignores the model file; the onnx engine gets a tiny real model
+    # when onnx and piper-phonemize are installed
+    os.makedirs(model_dir, exist_ok=True)
+    with_onnx = onnx_engine_available()
+    voices = [(name, sample_rate, 1) for name, sample_rate in STUB_VOICES.items()]
+    voices += [(name, 22050, speakers) for name, speakers in STUB_MULTI_SPEAKER_VOICES.items()]
+    for seed, (name, sample_rate, num_speakers) in enumerate(voices):
+        model_path = os.path.join(model_dir, f"{name}.onnx")
+        config = {'audio': {'sample_rate': sample_rate}, 'num_speakers': num_speakers}
+        if with_onnx:
+            import piper_phonemize
+            import stub_onnx_voice
+            stub_onnx_voice.write_model(model_path, seed, num_speakers)
+            config.update({'espeak': {'voice': 'en-us'}, 'phoneme_type': 'espeak',
+                           'phoneme_id_map': piper_phonemize.get_espeak_map()})
+        else:
+            with open(model_path, 'wb'):
+                pass
+        with open(f"{model_path}.json", 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+
+
+def wav_duration(path):
+    with wave.open(path, 'rb') as wav_file:
+        return wav_file.getnframes() / wav_file.getframerate()
+
+
+def count_child_processes():
+    pid = os.getpid()
+    count = 0
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return None
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'rb') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces, the parent pid follows the closing parenthesis
+        fields = stat[stat.rfind(b')') + 2:].split()
+        if int(fields[1]) == pid:
+            count += 1
+    return count
+
+
+class ProcessSampler(threading.Thread):
+    def __init__(self, interval=0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self.supported = count_child_processes() is not None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while self.supported and not self._stop_event.is_set():
+            self.peak = max(self.peak, count_child_processes() or 0)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def run_conversions(core, texts, voice, marks, executor=None, params=None):
+    # TextToSpeechConverter.convert_text_to_speech, what ConvertTextToSpeechThread runs
+    base_writer = core.StreamingWavWriter
+
+    class TimedWavWriter(base_writer):
+        def write_pcm(self, pcm, *args, **kwargs):
+            if pcm and 'first_audio' not in marks:
+                marks['first_audio'] = time.perf_counter()
+            return super().write_pcm(pcm, *args, **kwargs)
+
+    core.StreamingWavWriter = TimedWavWriter
+    runs = []
+    try:
+        for text in texts:
+            marks.clear()
+            converter = core.TextToSpeechConverter(executor=executor)
+            start = time.perf_counter()
+            output = converter.convert_text_to_speech(text, voice, params)
+            wall = time.perf_counter() - start
+            if not output:
+                raise RuntimeError(f"Conversion failed for: {text[:60]!r}")
+            runs.append({
+                'wall_s': wall,
+                'time_to_first_audio_s': marks.get('first_audio', start + wall) - start,
+                'audio_s': wav_duration(output),
+                'duplicates': converter.stats.get('duplicates', 0),
+                'phonemized': converter.stats.get('phonemized', 0),
+            })
+            os.remove(output)
+    finally:
+        core.StreamingWavWriter = base_writer
+    return runs
+
+
+def run_process_backend(core, texts, voice, marks):
+    # One piper process per sentence on a plain thread pool
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2 * os.cpu_count())
+    try:
+        return run_conversions(core, texts, voice, marks, executor)
+    finally:
+        executor.shutdown()
+
+
+def run_warm_backend(core, texts, voice, marks):
+    # The process backend after the GUI's warm-up on voice selection: sentences go to
+    # the idle persistent worker when it is free instead of a cold piper process
+    worker = core.PiperWorker(core.resolve_model_path(voice), core.DEFAULT_SYNTHESIS_PARAMS)
+    worker.warm_up()
+    core.worker_cache.checkin(worker)
+    try:
+        return run_process_backend(core, texts, voice, marks)
+    finally:
+        core.worker_cache.close_all()
+
+
+def run_pooled_backend(core, texts, voice, marks):
+    # The default: per-voice persistent workers behind the fair VoiceScheduler
+    try:
+        return run_conversions(core, texts, voice, marks)
+    finally:
+        core.worker_cache.close_all()
+
+
+def run_onnx_backend(core, texts, voice, marks):
+    # In-process onnxruntime engine with an empty phoneme store
+    core.synthesis_engine = 'onnx'
+    return run_conversions(core, texts, voice, marks)
+
+
+def run_onnx_tuning_backend(core, texts, voice, marks):
+    # A tuning pass: the same texts were rendered before with other settings, so every
+    # sentence is already in the phoneme store and espeak is skipped
+    core.synthesis_engine = 'onnx'
+    run_conversions(core, texts, voice, {}, params={'length_scale': 1.2, 'noise_scale': 0.5})
+    return run_conversions(core, texts, voice, marks)
+
+
+BACKENDS = {
+    'process': run_process_backend,
+    'warm': run_warm_backend,
+    'pooled': run_pooled_backend,
+    'onnx': run_onnx_backend,
+    'onnx-tuning': run_onnx_tuning_backend,
+}
+# Skipped by default when their optional dependencies are missing
+BACKEND_REQUIREMENTS = {
+    'onnx': onnx_engine_available,
+    'onnx-tuning': onnx_engine_available,
+}
+
+
+def run_case(corpus, backend, work_dir):
+    core = load_core_module()
+    model_dir = os.path.join(work_dir, 'models')
+    temp_dir = os.path.join(work_dir, 'temp_audio')
+    os.makedirs(temp_dir, exist_ok=True)
+    create_stub_voices(model_dir)
+    core.model_folder = model_dir
+    core.temp_audio_folder = temp_dir
+    core.piper_binary_path = STUB_PIPER
+    core.phoneme_store_path = os.path.join(work_dir, 'phonemes.sqlite3')
+    texts = load_corpus(corpus)
+
+    spawn_log = os.path.join(work_dir, 'spawned.log')
+    os.environ['STUB_PIPER_LOG'] = spawn_log
+    sampler = ProcessSampler()
+    sampler.start()
+    try:
+        runs = BACKENDS[backend](core, texts, DEFAULT_VOICE, {})
+    finally:
+        sampler.stop()
+
+    spawned = 0
+    if os.path.exists(spawn_log):
+        with open(spawn_log, 'r', encoding='utf-8') as f:
+            spawned = sum(1 for _ in f)
+    wall = sum(run['wall_s'] for run in runs)
+    audio = sum(run['audio_s'] for run in runs)
+    first_audio = [run['time_to_first_audio_s'] for run in runs]
+    result = {
+        'corpus': corpus,
+        'backend': backend,
+        'conversions': len(runs),
+        'characters': sum(len(text) for text in texts),
+        'wall_s': round(wall, 4),
+        'audio_s': round(audio, 4),
+        'rtf': round(wall / audio, 5) if audio else None,
+        'time_to_first_audio_s': round(statistics.median(first_audio), 4),
+        'time_to_first_audio_max_s': round(max(first_audio), 4),
+        'duplicate_sentences': sum(run['duplicates'] for run in runs),
+        'processes_spawned': spawned,
+        'peak_child_processes': sampler.peak if sampler.supported else None,
+        'peak_rss_kb': None,
+        'peak_child_rss_kb': None,
+    }
+    if core.synthesis_engine == 'onnx':
+        result['phonemized_sentences'] = sum(run['phonemized'] for run in runs)
+    temp_stats = core.get_temp_storage().stats()
+    result['temp_mode'] = temp_stats['mode']
+    result['temp_peak_bytes'] = temp_stats['peak_bytes']
+    result['temp_quota_waits'] = temp_stats['waits']
+    if resource:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        scale = 1024 if sys.platform == 'darwin' else 1
+        result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale
+        result['peak_child_rss_kb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_all(corpora, backends, repeat, stub_env):
+    results = []
+    for corpus in corpora:
+        for backend in backends:
+            for run_index in range(repeat):
+                with tempfile.TemporaryDirectory(prefix='tts-bench-') as work_dir:
+                    command = [sys.executable, os.path.abspath(__file__), '--case', corpus,
+                               '--backend', backend, '--work-dir', work_dir]
+                    completed = subprocess.run(command, capture_output=True, text=True,
+                                               env={**os.environ, **stub_env})
+                if completed.returncode != 0:
+                    sys.stderr.write(completed.stderr)
+                    raise SystemExit(f"Benchmark case {corpus}/{backend} failed")
+                result = json.loads(completed.stdout.strip().splitlines()[-1])
+                result['run'] = run_index
+                results.append(result)
+                print(f"{corpus:>10} {backend:>11}  wall {result['wall_s']:8.3f}s  "
+                      f"ttfa {result['time_to_first_audio_s']:7.3f}s  rtf {result['rtf']:.4f}  "
+                      f"procs {result['processes_spawned']}", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark text-to-speech throughput and latency.')
+    parser.add_argument('--corpus', action='append', choices=sorted(CORPORA),
+                        help='Corpus to run (repeatable, default: all)')
+    parser.add_argument('--backend', action='append', choices=sorted(BACKENDS),
+                        help='Backend to run (repeatable, default: all)')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--stub-load-seconds', type=float, default=0.05,
+                        help='Simulated model load time of the stub piper')
+    parser.add_argument('--stub-rtf', type=float, default=0.02,
+                        help='Simulated inference real-time factor of the stub piper')
+    parser.add_argument('--output', help='JSON results file (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case, args.backend[0], args.work_dir)))
+        return
+
+    stub_env = {
+        'STUB_PIPER_LOAD_SECONDS': str(args.stub_load_seconds),
+        'STUB_PIPER_RTF': str(args.stub_rtf),
+    }
+    backends = args.backend or [name for name in sorted(BACKENDS)
+                                if BACKEND_REQUIREMENTS.get(name, lambda: True)()]
+    results = run_all(args.corpus or sorted(CORPORA), backends, args.repeat, stub_env)
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'stub': stub_env,
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
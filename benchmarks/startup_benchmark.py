@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# Start-up time benchmark with a regression budget.
+#
+# Measures, each in a fresh interpreter: importing the Qt-free synthesis core,
+# importing the GUI module and the time until TTSApp is shown and painted.
+# Fails (exit code 1) when a median exceeds startup_budget.json or when a module
+# that should be imported lazily is already loaded once the window is up.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+BUDGET_PATH = os.path.join(BENCH_DIR, 'startup_budget.json')
+
+CORE_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import tts_core
+elapsed = time.perf_counter() - start
+print(json.dumps({'core_import_s': elapsed, 'qt_loaded': any(m.startswith('PyQt5') for m in sys.modules)}))
+'''
+
+APP_PROBE = '''
+import importlib.util, json, os, sys, time
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('tts_app', {script!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+imported = time.perf_counter()
+app = module.QApplication([])
+app.setStyle('Fusion')
+app.setStyleSheet(module.ThemeManager.dark_theme())
+window = module.TTSApp()
+window.show()
+loaded = sorted(name for name in {lazy!r} if name in sys.modules)
+app.processEvents()
+shown = time.perf_counter()
+print(json.dumps({{'app_import_s': imported - start, 'time_to_window_s': shown - start, 'eager_modules': loaded}}))
+sys.stdout.flush()
+# Skip Qt teardown, the voice catalog download may still be running
+os._exit(0)
+'''
+
+
+def run_probe(code, env):
+    completed = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR, capture_output=True,
+                               text=True, env=env)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise SystemExit('Start-up probe failed')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure start-up time against a budget.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--script', default='main-eng.py', help='GUI script to measure')
+    parser.add_argument('--budget', default=BUDGET_PATH)
+    parser.add_argument('--output', help='Write the measurements as JSON')
+    args = parser.parse_args()
+
+    with open(args.budget, 'r', encoding='utf-8') as f:
+        budget = json.load(f)
+    env = {**os.environ, 'QT_QPA_PLATFORM': os.environ.get('QT_QPA_PLATFORM', 'offscreen')}
+    script = os.path.join(REPO_DIR, args.script)
+    app_probe = APP_PROBE.format(script=script, lazy=budget.get('lazy_modules', []))
+
+    samples = {'core_import_s': [], 'app_import_s': [], 'time_to_window_s': []}
+    failures = []
+    for _ in range(args.repeat):
+        core = run_probe(CORE_PROBE, env)
+        samples['core_import_s'].append(core['core_import_s'])
+        if core['qt_loaded']:
+            failures.append('tts_core imports PyQt5')
+        app = run_probe(app_probe, env)
+        samples['app_import_s'].append(app['app_import_s'])
+        samples['time_to_window_s'].append(app['time_to_window_s'])
+        for name in app['eager_modules']:
+            failures.append(f'{name} is imported before it is needed')
+
+    report = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'script': args.script, 'repeat': args.repeat,
+              'medians': {}, 'budget': budget, 'failures': []}
+    for name, values in samples.items():
+        median = statistics.median(values)
+        report['medians'][name] = round(median, 4)
+        limit = budget.get(name)
+        status = 'ok'
+        if limit is not None and median > limit:
+            status = 'OVER BUDGET'
+            failures.append(f'{name} median {median:.3f}s exceeds budget {limit:.3f}s')
+        print(f"{name:>18}: {median:7.3f}s  (budget {limit}s)  {status}")
+    report['failures'] = sorted(set(failures))
+    for failure in report['failures']:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if report['failures'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# Tiny ONNX model with the input and output signature of a piper voice, used to
+# benchmark the in-process onnxruntime engine without downloading real voices.
+# The audio is meaningless; the two MatMuls give quantization something to work on.
+# Like piper's exports it takes a batch of padded sentences. The pad id is 0, which
+# renders as silence, so padded tails can be trimmed the same way as a real voice's.
+# With lengths_output it also returns audio_lengths, the samples of each row, like exports
+# that report their per-row length.
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+
+HIDDEN_SIZE = 256
+SAMPLES_PER_PHONEME = 1024
+OPSET = 13
+
+
+def build_model(seed=0, num_speakers=1, lengths_output=False):
+    rng = np.random.default_rng(seed)
+    weights = [
+        numpy_helper.from_array((rng.standard_normal((1, HIDDEN_SIZE)) * 0.05).astype(np.float32), 'embed'),
+        numpy_helper.from_array((rng.standard_normal((HIDDEN_SIZE, SAMPLES_PER_PHONEME))
+                                 / np.sqrt(HIDDEN_SIZE)).astype(np.float32), 'decoder'),
+        numpy_helper.from_array(np.array([2], dtype=np.int64), 'unsqueeze_axes'),
+        numpy_helper.from_array(np.array([1], dtype=np.int64), 'length_index'),
+        numpy_helper.from_array(np.array([0, 1, -1], dtype=np.int64), 'audio_shape'),
+    ]
+    nodes = [
+        helper.make_node('Cast', ['input'], ['ids'], to=TensorProto.FLOAT),
+        helper.make_node('Unsqueeze', ['ids', 'unsqueeze_axes'], ['ids_3d']),
+        helper.make_node('MatMul', ['ids_3d', 'embed'], ['hidden_linear']),
+        helper.make_node('Tanh', ['hidden_linear'], ['hidden']),
+        helper.make_node('MatMul', ['hidden', 'decoder'], ['frames_linear']),
+        helper.make_node('Tanh', ['frames_linear'], ['frames']),
+        helper.make_node('Gather', ['scales', 'length_index'], ['length_scale']),
+        helper.make_node('Mul', ['frames', 'length_scale'], ['scaled']),
+        helper.make_node('Reshape', ['scaled', 'audio_shape'], ['output']),
+    ]
+    inputs = [helper.make_tensor_value_info('input', TensorProto.INT64, ['batch_size', 'phonemes']),
+              helper.make_tensor_value_info('input_lengths', TensorProto.INT64, ['batch_size']),
+              helper.make_tensor_value_info('scales', TensorProto.FLOAT, [3])]
+    if num_speakers > 1:
+        # A per-row speaker offset on the hidden state, masked to non-pad ids like VITS does
+        weights += [
+            numpy_helper.from_array((rng.standard_normal((1, 1, HIDDEN_SIZE)) * 0.05).astype(np.float32),
+                                    'speaker_embed'),
+            numpy_helper.from_array(np.array([-1, 1, 1], dtype=np.int64), 'speaker_shape'),
+        ]
+        nodes[2:3] = [
+            helper.make_node('MatMul', ['ids_3d', 'embed'], ['text_linear']),
+            helper.make_node('Cast', ['sid'], ['sid_float'], to=TensorProto.FLOAT),
+            helper.make_node('Reshape', ['sid_float', 'speaker_shape'], ['sid_3d']),
+            helper.make_node('Mul', ['sid_3d', 'speaker_embed'], ['speaker_offset']),
+            helper.make_node('Sign', ['ids_3d'], ['id_mask']),
+            helper.make_node('Mul', ['speaker_offset', 'id_mask'], ['masked_offset']),
+            helper.make_node('Add', ['text_linear', 'masked_offset'], ['hidden_linear']),
+        ]
+        inputs.append(helper.make_tensor_value_info('sid', TensorProto.INT64, ['batch_size']))
+    outputs = [helper.make_tensor_value_info('output', TensorProto.FLOAT, ['batch_size', 1, 'time'])]
+    if lengths_output:
+        weights.append(numpy_helper.from_array(np.array(SAMPLES_PER_PHONEME, dtype=np.int64), 'samples_per_phoneme'))
+        nodes.append(helper.make_node('Mul', ['input_lengths', 'samples_per_phoneme'], ['audio_lengths']))
+        outputs.append(helper.make_tensor_value_info('audio_lengths', TensorProto.INT64, ['batch_size']))
+    graph = helper.make_graph(nodes, 'stub_piper_voice', inputs, outputs, weights)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', OPSET)])
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    return model
+
+
+def write_model(path, seed=0, num_speakers=1, lengths_output=False):
+    onnx.save(build_model(seed, num_speakers, lengths_output), path)
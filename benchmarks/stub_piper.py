@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# Deterministic stand-in for the piper binary used by the benchmarks.
+# It accepts the same command line as piper, produces a tone whose length is
+# proportional to the input text and simulates model load and inference cost
+# with sleeps, so throughput numbers are reproducible without real voices.
+import argparse
+import json
+import math
+import os
+import struct
+import sys
+import time
+import wave
+import zlib
+
+SECONDS_PER_CHAR = 0.06
+DEFAULT_SAMPLE_RATE = 22050
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='piper')
+    parser.add_argument('-m', '--model', required=True)
+    parser.add_argument('-c', '--config')
+    parser.add_argument('-f', '--output_file', '--output-file')
+    parser.add_argument('-d', '--output_dir', '--output-dir')
+    parser.add_argument('--output_raw', '--output-raw', action='store_true')
+    parser.add_argument('--json-input', action='store_true')
+    parser.add_argument('-s', '--speaker', type=int, default=0)
+    parser.add_argument('--noise_scale', '--noise-scale', type=float, default=0.667)
+    parser.add_argument('--length_scale', '--length-scale', type=float, default=1.0)
+    parser.add_argument('--noise_w', '--noise-w', type=float, default=0.8)
+    parser.add_argument('--sentence_silence', '--sentence-silence', type=float, default=0.2)
+    parser.add_argument('-q', '--quiet', action='store_true')
+    parser.add_argument('--debug', action='store_true')
+    return parser.parse_args(argv)
+
+
+def load_sample_rate(args):
+    config_path = args.config or f"{args.model}.json"
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            return int(json.load(f)['audio']['sample_rate'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return DEFAULT_SAMPLE_RATE
+
+
+def synthesize(text, sample_rate, length_scale, speaker):
+    seconds = max(0.1, len(text) * SECONDS_PER_CHAR * length_scale)
+    num_samples = int(seconds * sample_rate)
+    frequency = 110 + (zlib.crc32(text.encode('utf-8')) + speaker * 37) % 440
+    period = max(2, sample_rate // frequency)
+    cycle = struct.pack(f'<{period}h', *(int(8000 * math.sin(2 * math.pi * i / period)) for i in range(period)))
+    return (cycle * (num_samples // period + 1))[:num_samples * 2], seconds
+
+
+def write_wav(path, pcm, sample_rate):
+    with wave.open(path, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm)
+
+
+def main(argv):
+    args = parse_args(argv)
+    if not os.path.exists(args.model):
+        print(f"Model does not exist: {args.model}", file=sys.stderr)
+        return 1
+    counter_path = os.environ.get('STUB_PIPER_LOG')
+    if counter_path:
+        with open(counter_path, 'a', encoding='utf-8') as f:
+            f.write(f"{os.getpid()}\n")
+    time.sleep(float(os.environ.get('STUB_PIPER_LOAD_SECONDS', '0.05')))
+    inference_rtf = float(os.environ.get('STUB_PIPER_RTF', '0.02'))
+    sample_rate = load_sample_rate(args)
+    stdout = sys.stdout.buffer
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        output_file = args.output_file
+        speaker = args.speaker
+        if args.json_input:
+            request = json.loads(line)
+            line = request['text']
+            output_file = request.get('output_file', output_file)
+            speaker = request.get('speaker_id', speaker)
+        pcm, seconds = synthesize(line, sample_rate, args.length_scale, speaker)
+        time.sleep(seconds * inference_rtf)
+        if args.output_raw:
+            stdout.write(pcm)
+            stdout.flush()
+        elif output_file:
+            write_wav(output_file, pcm, sample_rate)
+            print(output_file, flush=True)
+        elif args.output_dir:
+            path = os.path.join(args.output_dir, f"{time.monotonic_ns()}.wav")
+            write_wav(path, pcm, sample_rate)
+            print(path, flush=True)
+        else:
+            buffer = struct.pack('<4sI4s', b'RIFF', 36 + len(pcm), b'WAVE')
+            buffer += struct.pack('<4sIHHIIHH', b'fmt ', 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+            stdout.write(buffer + struct.pack('<4sI', b'data', len(pcm)) + pcm)
+            stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
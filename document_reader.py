@@ -0,0 +1,146 @@
+import codecs
+import os
+import posixpath
+import re
+import zipfile
+from html.parser import HTMLParser
+from xml.etree import ElementTree
+
+# Reads TXT, Markdown and EPUB files as a stream of (title, text) chapters, so a whole book
+# never has to be in memory at once: only the chapter being read, and chapters longer than
+# MAX_CHAPTER_CHARS are cut into parts at a line break.
+DOCUMENT_EXTENSIONS = ('.txt', '.md', '.markdown', '.epub')
+MAX_CHAPTER_CHARS = 200000
+READ_CHUNK_BYTES = 65536
+# Markdown headings and lines starting with "Chapter"/"Capítulo" start a chapter
+CHAPTER_PATTERN = re.compile(r'^\s*(#{1,6}\s+\S.*|(chapter|cap[ií]tulo)\b.*)$', re.IGNORECASE)
+MARKDOWN_IMAGE_PATTERN = re.compile(r'!\[[^\]]*\]\([^)]*\)')
+MARKDOWN_LINK_PATTERN = re.compile(r'\[([^\]]*)\]\([^)]*\)')
+# HTML elements that end a line of text, and those whose text is never read
+BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'blockquote', 'section', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+SKIPPED_TAGS = {'head', 'script', 'style', 'nav'}
+HEADING_TAGS = {'h1': '#', 'h2': '##', 'h3': '###'}
+OPF_NAMESPACE = '{http://www.idpf.org/2007/opf}'
+CONTAINER_NAMESPACE = '{urn:oasis:names:tc:opendocument:xmlns:container}'
+
+
+def split_chapters(lines, title='', max_chars=MAX_CHAPTER_CHARS):
+    # Groups lines into chapters at headings; text before the first heading is a chapter of
+    # its own and a chapter that outgrows max_chars goes on as "title (2)", "title (3)"...
+    part, buffer, size = 1, [], 0
+    for line in lines:
+        if CHAPTER_PATTERN.match(line):
+            if ''.join(buffer).strip():
+                yield _part_title(title, part), '\n'.join(buffer)
+            # The heading is read out without its Markdown marks
+            title = line.strip().lstrip('#').strip()
+            part, buffer, size = 1, [title], len(title)
+            continue
+        if size + len(line) > max_chars and ''.join(buffer).strip():
+            yield _part_title(title, part), '\n'.join(buffer)
+            part, buffer, size = part + 1, [], 0
+        buffer.append(line)
+        size += len(line) + 1
+    if ''.join(buffer).strip():
+        yield _part_title(title, part), '\n'.join(buffer)
+
+
+def _part_title(title, part):
+    return title if part == 1 else f"{title} ({part})".strip()
+
+
+def _text_lines(path, markdown):
+    with open(path, 'r', encoding='utf-8-sig', errors='replace') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if markdown:
+                line = MARKDOWN_LINK_PATTERN.sub(r'\1', MARKDOWN_IMAGE_PATTERN.sub('', line))
+            yield line
+
+
+class _HTMLLines(HTMLParser):
+    # Collects the text of an XHTML document as lines, headings as Markdown headings
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self.text = []
+        self.skipping = 0
+        self.heading = ''
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag in BLOCK_TAGS:
+            self.end_line()
+            self.heading = HEADING_TAGS.get(tag, '')
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in BLOCK_TAGS:
+            self.end_line()
+            self.heading = ''
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.text.append(data)
+
+    def end_line(self):
+        line = ' '.join(''.join(self.text).split())
+        self.text = []
+        if line:
+            self.lines.append(f"{self.heading} {line}" if self.heading else line)
+
+
+def _epub_documents(archive):
+    # Paths of the EPUB's XHTML documents in reading order
+    container = ElementTree.fromstring(archive.read('META-INF/container.xml'))
+    rootfile = container.find(f'.//{CONTAINER_NAMESPACE}rootfile')
+    if rootfile is None:
+        raise ValueError('The EPUB has no package document')
+    opf_path = rootfile.get('full-path')
+    package = ElementTree.fromstring(archive.read(opf_path))
+    base = posixpath.dirname(opf_path)
+    manifest = {item.get('id'): item.get('href') for item in package.iter(f'{OPF_NAMESPACE}item')}
+    for itemref in package.iter(f'{OPF_NAMESPACE}itemref'):
+        href = manifest.get(itemref.get('idref'))
+        if href:
+            yield posixpath.normpath(posixpath.join(base, href.split('#')[0]))
+
+
+def _epub_chapters(path, max_chars):
+    with zipfile.ZipFile(path) as archive:
+        for name in _epub_documents(archive):
+            parser = _HTMLLines()
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            title = os.path.splitext(posixpath.basename(name))[0]
+            lines = []
+            with archive.open(name) as f:
+                # Documents are parsed as they are decompressed
+                while True:
+                    data = f.read(READ_CHUNK_BYTES)
+                    parser.feed(decoder.decode(data, final=not data))
+                    lines.extend(parser.lines)
+                    parser.lines = []
+                    if not data:
+                        break
+            parser.close()
+            parser.end_line()
+            lines.extend(parser.lines)
+            # Every document starts a chapter, titled by its first heading or its file name
+            yield from split_chapters(lines, title, max_chars)
+
+
+def read_chapters(path, max_chars=MAX_CHAPTER_CHARS):
+    """Yield (title, text) for each chapter of a TXT, Markdown or EPUB file, in order.
+
+    Text files are read line by line and cut at Markdown headings and lines that start
+    with "Chapter" or "Capítulo"; EPUB files at every document of the reading order and at
+    the headings in them. Only one chapter, at most max_chars, is held at a time.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in DOCUMENT_EXTENSIONS:
+        raise ValueError(f"Unsupported document type: {extension or path}")
+    if extension == '.epub':
+        return _epub_chapters(path, max_chars)
+    return split_chapters(_text_lines(path, extension != '.txt'), max_chars=max_chars)
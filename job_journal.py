@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import shutil
+import time
+
+from tag_plan import TagPlan
+from temp_storage import pid_alive
+from wav_writer import HEADER_SIZE, StreamingWavWriter, read_layout
+
+# Durable record of a conversion: its compiled TagPlan (sentences and silence tags) and the
+# audio of every chunk finished so far, so a conversion that was stopped, crashed or lost
+# power resumes where it stopped instead of starting over. Each job is a folder:
+#   journal.json  text, voice, params, priority and the plan, written once
+#   progress.log  "<chunk> <bytes>" appended for every finished chunk
+#   audio.wav     the finished chunks in order
+#   owner.pid     the process writing the journal
+JOURNAL_FILE = 'journal.json'
+PROGRESS_FILE = 'progress.log'
+AUDIO_FILE = 'audio.wav'
+OWNER_FILE = 'owner.pid'
+JOURNAL_VERSION = 2
+# Progress lines are flushed as they are written; both files reach the disk at least this
+# often, which bounds what a power cut can take back
+SYNC_SECONDS = 5.0
+
+
+def _write_json(path, data):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def _owner(path):
+    try:
+        with open(os.path.join(path, OWNER_FILE), 'r', encoding='utf-8') as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+class JobJournal:
+    def __init__(self, path, data):
+        self.path = path
+        self.job_id = data['job_id']
+        self.text = data['text']
+        self.voice = data['voice']
+        self.params = data['params']
+        self.priority = data['priority']
+        self.created = data['created']
+        self.plan = TagPlan.from_dict(data['plan'])
+        # Chunks before next_chunk are done (or failed and were skipped); data_bytes of
+        # audio.wav hold their audio
+        self.next_chunk = 0
+        self.data_bytes = 0
+        self.chunk_bytes = []
+        self._progress = None
+        self._last_sync = 0.0
+
+    @property
+    def audio_path(self):
+        return os.path.join(self.path, AUDIO_FILE)
+
+    @property
+    def progress_path(self):
+        return os.path.join(self.path, PROGRESS_FILE)
+
+    @classmethod
+    def create(cls, root, job_id, text, voice, params, priority, plan):
+        path = os.path.join(root, job_id)
+        os.makedirs(path)
+        data = {
+            'version': JOURNAL_VERSION,
+            'job_id': job_id,
+            'text': text,
+            'voice': voice,
+            'params': params or {},
+            'priority': priority,
+            'created': time.time(),
+            'plan': plan.to_dict(),
+        }
+        _write_json(os.path.join(path, JOURNAL_FILE), data)
+        return cls(path, data)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, JOURNAL_FILE), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != JOURNAL_VERSION:
+            raise ValueError(f"Unsupported job journal version in {path}")
+        journal = cls(path, data)
+        journal._read_progress()
+        return journal
+
+    def _read_progress(self):
+        try:
+            audio_bytes = os.path.getsize(self.audio_path) - HEADER_SIZE
+        except OSError:
+            audio_bytes = 0
+        try:
+            with open(self.progress_path, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            lines = []
+        for line in lines:
+            try:
+                chunk, size = (int(value) for value in line.split())
+            except ValueError:
+                # A line torn by a crash ends the usable progress
+                break
+            # After a power cut the log can be ahead of the audio that reached the disk
+            if self.data_bytes + size > audio_bytes:
+                break
+            self.next_chunk = chunk + 1
+            self.data_bytes += size
+            self.chunk_bytes.append((chunk, size))
+
+    def summary(self):
+        # How much of the job is already done: chunks, sentences and seconds of audio
+        kinds = [kind for kind, _, _, _ in self.plan.chunks()]
+        spoken = [index for index, kind in enumerate(kinds) if kind == 'speak']
+        done = sum(1 for index in spoken if index < self.next_chunk)
+        sample_rate = None
+        if self.data_bytes:
+            try:
+                sample_rate = read_layout(self.audio_path)['sample_rate']
+            except (OSError, ValueError):
+                pass
+        return {
+            'chunks': self.next_chunk,
+            'total_chunks': len(kinds),
+            'sentences': done,
+            'total_sentences': len(spoken),
+            'audio_seconds': self.data_bytes / 2 / sample_rate if sample_rate else 0.0,
+        }
+
+    def open_writer(self):
+        # Claims the journal for this process and returns a writer positioned after the
+        # recorded audio
+        with open(os.path.join(self.path, OWNER_FILE), 'w', encoding='utf-8') as f:
+            f.write(str(os.getpid()))
+        if self.data_bytes:
+            writer = StreamingWavWriter(self.audio_path, resume_bytes=self.data_bytes)
+        else:
+            writer = StreamingWavWriter(self.audio_path)
+        # Drop progress lines the audio did not keep, so new lines follow the valid ones
+        with open(self.progress_path, 'w', encoding='utf-8') as f:
+            f.writelines(f"{chunk} {size}\n" for chunk, size in self.chunk_bytes)
+        self._progress = open(self.progress_path, 'a', encoding='utf-8')
+        self._last_sync = time.monotonic()
+        return writer
+
+    def record(self, chunk, size, writer):
+        # Called after chunk's audio was written; the audio goes out before the line that counts it
+        writer.flush()
+        self._progress.write(f"{chunk} {size}\n")
+        self._progress.flush()
+        self.next_chunk = chunk + 1
+        self.data_bytes += size
+        self.chunk_bytes.append((chunk, size))
+        if time.monotonic() - self._last_sync >= SYNC_SECONDS:
+            self.sync(writer)
+
+    def sync(self, writer):
+        os.fsync(writer.file.fileno())
+        os.fsync(self._progress.fileno())
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._progress:
+            self._progress.close()
+            self._progress = None
+        try:
+            os.remove(os.path.join(self.path, OWNER_FILE))
+        except OSError:
+            pass
+
+    def finish(self, output_path):
+        # Moves the finished audio out and removes the journal
+        self.close()
+        shutil.move(self.audio_path, output_path)
+        self.discard()
+
+    def discard(self):
+        self.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def journal_path(root, job_id):
+    return os.path.join(root, job_id)
+
+
+def load_journal(root, job_id):
+    # The journal of job_id, or None when it finished, was discarded or never existed
+    path = journal_path(root, job_id)
+    if not os.path.exists(os.path.join(path, JOURNAL_FILE)):
+        return None
+    return JobJournal.load(path)
+
+
+def discard_journal(root, job_id):
+    shutil.rmtree(journal_path(root, job_id), ignore_errors=True)
+
+
+def list_journals(root):
+    # Unfinished journals nobody is writing, oldest first
+    journals = []
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return journals
+    for name in names:
+        path = os.path.join(root, name)
+        if not os.path.exists(os.path.join(path, JOURNAL_FILE)):
+            continue
+        owner = _owner(path)
+        if owner and pid_alive(owner):
+            continue
+        try:
+            journals.append(JobJournal.load(path))
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"Error reading job journal {path}: {str(e)}")
+    return sorted(journals, key=lambda journal: journal.created)
@@ -1,56 +1,55 @@
 import os
-import sys
-import random
-import string
-import subprocess
-import requests
-import json
 import re
 import logging
+import bisect
 import tempfile
-import concurrent.futures
-import signal
 import shutil
-import markdown
+import time
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QLabel, QTextEdit,
     QPushButton, QHBoxLayout, QFileDialog, QComboBox,
     QMessageBox, QSlider, QDialog, QAction, QMenu,
-    QSizePolicy, QSpacerItem, QLineEdit, QListWidget, QListWidgetItem, QProgressBar, QInputDialog
+    QSizePolicy, QSpacerItem, QLineEdit, QListWidget, QListWidgetItem, QProgressBar, QInputDialog,
+    QCheckBox, QStyle
 )
-from PyQt5.QtCore import Qt, QUrl, QThread, pyqtSignal, QTimer, QEvent
+from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer, QEvent
 from PyQt5.QtGui import (QIcon, QTextDocument, QFont, QPalette, QColor,
                         QSyntaxHighlighter, QTextCharFormat, QTextCursor, QKeySequence)
-from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent
-import webbrowser
+import onnx_engine
+import profiling
+import job_journal
+import timing_index
+import tts_core
+from tts_core import (
+    file_folder, temp_audio_folder, profiles_folder, model_folder,
+    TextToSpeechConverter, PiperWorker, worker_cache, resolve_model_path, download_file, load_voices_data,
+    ConversionJob, JobQueue, VoiceScheduler, PRIORITY_PREVIEW, PRIORITY_NORMAL, PRIORITY_BATCH, get_temp_storage,
+    use_onnx_engine, warm_up_onnx_voice, voice_speakers, write_speaker_sweep, write_document,
+    compile_plan, PlanError
+)
 
 # Configure logging
 logging.basicConfig(level=logging.ERROR)
 
 # Define paths and folders
-def get_base_path():
-    if getattr(sys, 'frozen', False):
-        # Running in a PyInstaller bundle
-        return sys._MEIPASS
-    else:
-        # Running in normal Python environment
-        return os.path.dirname(os.path.abspath(__file__))
-
-file_folder = get_base_path()
-temp_audio_folder = os.path.join(file_folder, 'temp_audio')
-model_folder = os.path.join(os.path.expanduser('~'), 'Documents', 'ONNX-TTS')
-piper_binary_path = os.path.join(file_folder, 'piper', 'piper.exe')
 icon_path = os.path.join(file_folder, 'icon.ico')
 play_icon_path = os.path.join(file_folder, 'play.png')
 pause_icon_path = os.path.join(file_folder, 'pause.png')
-ffmpeg_path = os.path.join(file_folder, 'ffmpeg.exe')
 
-# Create necessary directories
-os.makedirs(temp_audio_folder, exist_ok=True)
-os.makedirs(model_folder, exist_ok=True)
+# Filled in by the background catalog download once the window is shown
+voices_data = {}
+
+# Order matches the priority selector in the main window
+JOB_PRIORITIES = [PRIORITY_PREVIEW, PRIORITY_NORMAL, PRIORITY_BATCH]
+JOB_PRIORITY_LABELS = ['Preview', 'Normal', 'Batch']
+JOB_STATE_LABELS = {'queued': 'Queued', 'running': 'Running', 'done': 'Done', 'failed': 'Failed', 'cancelled': 'Cancelled'}
+# Keys are onnx_engine.INFERENCE_PROFILES
+INFERENCE_PROFILE_LABELS = {'latency': 'Latency (one fast stream)', 'throughput': 'Throughput (many single-threaded sentences)', 'low-memory': 'Low memory'}
+# Keys are postprocess.MODES, None turns post-processing off
+POSTPROCESS_LABELS = {None: 'Off', 'peak': 'Trim silence + peak level', 'loudness': 'Trim silence + loudness (approx. LUFS)'}
 
-# Global replacements and text processing parameters
-global_replacements = [('\n', ' '), ('"', ''), ("'", ""), ('*', '')]
+# Previous sentence restarts the current one after this much of it has played
+SENTENCE_RESTART_MS = 1500
 
 # Custom button styles
 BUTTON_STYLE = """
@@ -116,10 +115,6 @@ QSlider::handle:horizontal:hover {
 }
 """
 
-# Function to get process creation flags
-def get_creationflags():
-    return subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
-
 class ThemeManager:
     @staticmethod
     def dark_theme():
@@ -306,162 +301,185 @@ class ModelSelectorDialog(QDialog):
         return self.selected_model_name
 
 class ConvertTextToSpeechThread(QThread):
-    conversion_done = pyqtSignal(str)
-    def __init__(self, text, default_model):
+    # Job id and output file, empty when the conversion failed or was stopped
+    conversion_done = pyqtSignal(str, str)
+    profile_ready = pyqtSignal(str)
+    # Job id, PCM, sample rate and sentence of every chunk as it is written, for live
+    # playback, and the byte of the output file's audio where the chunk starts
+    audio_ready = pyqtSignal(str, bytes, int, str, 'qint64')
+    def __init__(self, job, scheduler=None, profiling_enabled=False):
         super().__init__()
-        self.text = text
-        self.default_model = default_model
-        self.running = True
-        self.piper_processes = []
+        self.text = job.text
+        self.default_model = job.voice
+        self.params = job.params
+        self.plan = job.plan
+        self.profiling_enabled = profiling_enabled or profiling.env_enabled()
+        # Batch renders are not played and resumed jobs are played from the file once
+        # they finish, so neither sends its audio to the GUI
+        on_audio = None if job.priority == PRIORITY_BATCH or job.journal else self.emit_audio
+        # Previews are short enough to start over, everything else can resume
+        journal_root = None if job.priority == PRIORITY_PREVIEW else tts_core.journals_folder
+        self.converter = TextToSpeechConverter(job.job_id, scheduler, job.priority, on_audio,
+                                               job.journal, journal_root)
+        self.job_id = self.converter.job_id
 
     def run(self):
-        result = self.convert_text_to_speech(self.text, self.default_model)
-        self.conversion_done.emit(result if result else None)
+        result = None
+        try:
+            if self.profiling_enabled:
+                job_dir = os.path.join(profiles_folder, f"{time.strftime('%Y%m%d-%H%M%S')}_{self.job_id}")
+                profile = profiling.ConversionProfile(job_dir, self.job_id,
+                                                      child_counter=lambda: len(self.converter.piper_processes))
+                with profile:
+                    result = self.convert_text_to_speech(self.text, self.default_model, self.params)
+                    profile.counters.update(self.converter.stats)
+                self.profile_ready.emit(profile.summary)
+            else:
+                result = self.convert_text_to_speech(self.text, self.default_model, self.params)
+        except Exception as e:
+            logging.error(f"Error in conversion thread: {str(e)}")
+        finally:
+            # The jobs panel waits for this to move the job out of "running"
+            self.conversion_done.emit(self.job_id, result or '')
 
     def stop(self):
-        self.running = False
-        for process in self.piper_processes:
+        self.converter.stop()
+
+    def emit_audio(self, pcm, sample_rate, sentence):
+        self.audio_ready.emit(self.job_id, pcm, sample_rate, sentence,
+                              self.converter.output_bytes - len(pcm))
+
+    def convert_text_to_speech(self, text, default_model, params=None):
+        return self.converter.convert_text_to_speech(text, default_model, params, self.plan)
+
+class WarmUpThread(QThread):
+    warmed_up = pyqtSignal(str, float)
+    warm_up_failed = pyqtSignal(str)
+    def __init__(self, model_name, params=None):
+        super().__init__()
+        self.model_name = model_name
+        self.worker = PiperWorker(resolve_model_path(model_name), params)
+        self.cancelled = False
+
+    def run(self):
+        if use_onnx_engine():
+            self.warm_up_onnx()
+            return
+        try:
+            seconds = self.worker.warm_up()
+        except Exception as e:
+            self.worker.close()
+            if not self.cancelled:
+                logging.error(f"Error warming up {self.model_name}: {str(e)}")
+                self.warm_up_failed.emit(self.model_name)
+            return
+        if self.cancelled:
+            self.worker.close()
+            return
+        worker_cache.checkin(self.worker)
+        self.warmed_up.emit(self.model_name, seconds)
+
+    def warm_up_onnx(self):
+        try:
+            seconds = warm_up_onnx_voice(self.worker.model_path, self.worker.params)
+        except Exception as e:
+            if not self.cancelled:
+                logging.error(f"Error warming up {self.model_name}: {str(e)}")
+                self.warm_up_failed.emit(self.model_name)
+            return
+        if not self.cancelled:
+            self.warmed_up.emit(self.model_name, seconds)
+
+    def cancel(self):
+        self.cancelled = True
+        process = self.worker.process
+        if process:
             try:
-                os.kill(process.pid, signal.SIGTERM)
-            except:
+                process.kill()
+            except OSError:
                 pass
-        self.piper_processes.clear()
 
-    def convert_text_to_speech(self, text, default_model):
+class VoicesIndexThread(QThread):
+    voices_loaded = pyqtSignal(dict)
+
+    def run(self):
+        self.voices_loaded.emit(load_voices_data())
+
+class SpeakerSweepThread(QThread):
+    progress = pyqtSignal(int, int)
+    sweep_done = pyqtSignal(list)
+    sweep_failed = pyqtSignal(str)
+
+    def __init__(self, text, model_name, params, output_dir, concatenate):
+        super().__init__()
+        self.text = text
+        self.model_name = model_name
+        self.params = params
+        self.output_dir = output_dir
+        self.concatenate = concatenate
+        self.cancelled = False
+
+    def run(self):
         try:
-            # Remove any previous final file in the temp_audio_folder
-            for file_name in os.listdir(temp_audio_folder):
-                file_path = os.path.join(temp_audio_folder, file_name)
-                if file_name.startswith("final_") and file_name.endswith(".wav"):
-                    try:
-                        os.remove(file_path)
-                    except Exception as e:
-                        logging.error(f"Error deleting previous final audio file: {str(e)}")
-
-            text = filter_code_blocks(text)
-            text = process_line_breaks(text)
-            text = multiple_replace(text, global_replacements)
-            text = text.replace('\\', '\\\\').replace('"', '\\"')
-            segments = re.split(r'(<#.*?#>)', text)
-            temp_dir = tempfile.mkdtemp(dir=temp_audio_folder)
-            audio_segments = []
-            num_workers = 2 * os.cpu_count()
-            current_model = default_model
-            with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
-                for segment in segments:
-                    if not self.running:
-                        for file in audio_segments:
-                            try:
-                                os.remove(file)
-                            except:
-                                pass
-                        try:
-                            os.rmdir(temp_dir)
-                        except:
-                            pass
-                        return None
-                    if not segment:
-                        continue
-                    processed_as_tag = False
-                    if segment.startswith('<#') and segment.endswith('#>'):
-                        silence_match = re.match(r'<#(\d+\.?\d*)#>', segment)
-                        if silence_match:
-                            seconds = float(silence_match.group(1))
-                            silence_file = generate_silence(seconds, temp_dir)
-                            if silence_file:
-                                audio_segments.append(silence_file)
-                            processed_as_tag = True
-                        else:
-                            model_match = re.match(r'<#([\w-]+)#>', segment)
-                            if model_match:
-                                model_name = model_match.group(1)
-                                if model_name == 'default':
-                                    current_model = default_model
-                                    processed_as_tag = True
-                                else:
-                                    model_path = os.path.join(model_folder, f"{model_name}.onnx")
-                                    if os.path.exists(model_path):
-                                        current_model = model_name
-                                        processed_as_tag = True
-                    if processed_as_tag:
-                        continue
-                    model_path = os.path.join(model_folder, f"{current_model}.onnx")
-                    if not os.path.exists(model_path):
-                        logging.error(f"Model {current_model} not found, skipping segment: {segment}")
-                        continue
-                    filtered_text = filter_text_segment(segment)
-                    sentences = split_sentences(filtered_text)
-                    futures = []
-                    for sentence in sentences:
-                        if sentence:
-                            future = executor.submit(self.generate_audio_with_process, sentence, model_path, temp_dir)
-                            futures.append(future)
-                    for future in futures:
-                        if not self.running:
-                            break
-                        audio_file = future.result()
-                        if audio_file:
-                            audio_segments.append(audio_file)
-                    if not self.running:
-                        break
-            if not self.running:
-                return None
-            final_output = os.path.join(temp_audio_folder, f"final_{random_string()}.wav")
-            if not concatenate_audio_files(audio_segments, final_output, temp_dir):
-                return None
-
-            # Remove temporary files after concatenation
-            for file in audio_segments:
-                try:
-                    os.remove(file)
-                except:
-                    pass
-            if os.path.exists(temp_dir):
-                try:
-                    os.rmdir(temp_dir)
-                except:
-                    pass
+            paths = write_speaker_sweep(self.text, self.model_name, self.output_dir, self.params,
+                                        concatenate=self.concatenate, progress=self.progress.emit,
+                                        running=lambda: not self.cancelled)
+        except Exception as e:
+            logging.error(f"Error in speaker sweep: {str(e)}")
+            self.sweep_failed.emit(str(e))
+            return
+        self.sweep_done.emit(paths)
+
+    def cancel(self):
+        self.cancelled = True
+
+class DocumentThread(QThread):
+    progress = pyqtSignal(int, str)
+    document_done = pyqtSignal(list)
+    document_failed = pyqtSignal(str)
+
+    def __init__(self, path, model_name, params, output_dir, merge, scheduler):
+        super().__init__()
+        self.path = path
+        self.model_name = model_name
+        self.params = params
+        self.output_dir = output_dir
+        self.merge = merge
+        self.scheduler = scheduler
+        self.cancelled = False
 
-            return final_output
+    def run(self):
+        try:
+            paths = write_document(self.path, self.model_name, self.output_dir, self.params, self.merge,
+                                   executor=self.scheduler, progress=self.progress.emit,
+                                   running=lambda: not self.cancelled)
         except Exception as e:
-            logging.error(f"Error in conversion: {str(e)}")
-            return None
-        finally:
-            for file in audio_segments:
-                try:
-                    os.remove(file)
-                except:
-                    pass
-            if os.path.exists(temp_dir):
-                try:
-                    os.rmdir(temp_dir)
-                except Exception as e:
-                    logging.error(f"Error cleaning temporary files: {str(e)}")
-
-    def generate_audio_with_process(self, text_part, model_path, temp_dir):
-        filtered_text = filter_text_segment(text_part)
-        if not filtered_text:
-            return None
-        output_file = os.path.join(temp_dir, f"audio_{random_string()}.wav")
+            logging.error(f"Error converting document: {str(e)}")
+            self.document_failed.emit(str(e))
+            return
+        self.document_done.emit(paths)
+
+    def cancel(self):
+        self.cancelled = True
+
+class QuantizeModelThread(QThread):
+    quantized = pyqtSignal(str, dict)
+    quantize_failed = pyqtSignal(str, str)
+
+    def __init__(self, model_name, parent=None):
+        super().__init__(parent)
+        self.model_name = model_name
+
+    def run(self):
+        import quantize_voice
         try:
-            command = [piper_binary_path, '-m', model_path, '-f', output_file]
-            process = subprocess.Popen(
-                command,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.PIPE,
-                text=True,
-                creationflags=get_creationflags()
-            )
-            self.piper_processes.append(process)
-            process.communicate(input=filtered_text, timeout=30)
-            self.piper_processes.remove(process)
-            return output_file if process.returncode == 0 else None
+            _, report = quantize_voice.quantize_voice(resolve_model_path(self.model_name),
+                                                      phoneme_store=tts_core.get_phoneme_store())
         except Exception as e:
-            logging.error(f"Error generating audio: {str(e)}")
-            if process in self.piper_processes:
-                self.piper_processes.remove(process)
-            return None
+            logging.error(f"Error quantizing {self.model_name}: {str(e)}")
+            self.quantize_failed.emit(self.model_name, str(e))
+            return
+        self.quantized.emit(self.model_name, report)
 
 class DownloadModelThread(QThread):
     progress_updated = pyqtSignal(int)
@@ -564,6 +582,7 @@ class DownloadModelDialog(QDialog):
         dialog.setWindowTitle("License Agreement")
         dialog.setMinimumSize(600, 400)
         layout = QVBoxLayout()
+        import markdown
         html_content = markdown.markdown(license_content)
         text_edit = QTextEdit()
         text_edit.setReadOnly(True)
@@ -629,6 +648,41 @@ class SettingsDialog(QDialog):
         self.create_slider('Length Scale', 0, 100, int(self.parent().length_scale * 100), self.set_length_scale)
         self.create_slider('Noise W', 0, 100, int(self.parent().noise_w * 100), self.set_noise_w)
         self.create_slider('Sentence Silence', 0, 100, int(self.parent().sentence_silence * 100), self.set_sentence_silence)
+        self.profiling_checkbox = QCheckBox('Profile conversions (cProfile)')
+        self.profiling_checkbox.setChecked(self.parent().profiling_enabled)
+        self.profiling_checkbox.toggled.connect(self.set_profiling)
+        main_layout.addWidget(self.profiling_checkbox)
+        self.engine_checkbox = QCheckBox('In-process ONNX engine (onnxruntime, caches phonemes)')
+        self.engine_checkbox.setChecked(tts_core.synthesis_engine == 'onnx')
+        self.engine_checkbox.toggled.connect(self.set_onnx_engine)
+        main_layout.addWidget(self.engine_checkbox)
+        profile_layout = QHBoxLayout()
+        profile_layout.addWidget(QLabel('Inference profile:'))
+        self.inference_profile_spinner = QComboBox()
+        for profile, label in INFERENCE_PROFILE_LABELS.items():
+            self.inference_profile_spinner.addItem(label, profile)
+        self.inference_profile_spinner.setCurrentIndex(max(0, self.inference_profile_spinner.findData(tts_core.inference_profile)))
+        self.inference_profile_spinner.currentIndexChanged.connect(self.set_inference_profile)
+        self.inference_profile_spinner.setEnabled(self.engine_checkbox.isChecked())
+        profile_layout.addWidget(self.inference_profile_spinner)
+        main_layout.addLayout(profile_layout)
+        postprocess_layout = QHBoxLayout()
+        postprocess_layout.addWidget(QLabel('Post-processing:'))
+        self.postprocess_spinner = QComboBox()
+        self.postprocess_spinner.addItems(POSTPROCESS_LABELS.values())
+        self.postprocess_spinner.setCurrentIndex(list(POSTPROCESS_LABELS).index(self.parent().postprocess))
+        self.postprocess_spinner.currentIndexChanged.connect(self.set_postprocess)
+        postprocess_layout.addWidget(self.postprocess_spinner)
+        main_layout.addLayout(postprocess_layout)
+        self.profile_summary = QTextEdit()
+        self.profile_summary.setReadOnly(True)
+        self.profile_summary.setFont(QFont('Consolas', 9))
+        self.profile_summary.setPlaceholderText('The summary of the last profiled conversion will appear here')
+        self.profile_summary.setPlainText(self.parent().last_profile_summary)
+        main_layout.addWidget(self.profile_summary)
+        self.temp_storage_label = QLabel(self.temp_storage_summary())
+        self.temp_storage_label.setWordWrap(True)
+        main_layout.addWidget(self.temp_storage_label)
         button_layout = QHBoxLayout()
         self.reset_button = QPushButton('Reset')
         self.reset_button.clicked.connect(self.reset_values)
@@ -638,6 +692,10 @@ class SettingsDialog(QDialog):
         self.help_button.clicked.connect(self.open_help_url)
         self.help_button.setStyleSheet(BUTTON_STYLE)
         button_layout.addWidget(self.help_button)
+        self.sweep_button = QPushButton('Speaker Sweep')
+        self.sweep_button.clicked.connect(self.parent().start_speaker_sweep)
+        self.sweep_button.setStyleSheet(BUTTON_STYLE)
+        button_layout.addWidget(self.sweep_button)
         main_layout.addLayout(button_layout)
         self.powered_by = QLabel('<a href="https://youtube.com/@hircoir" style="color: #4CAF50;">Powered by HirCoir</a>')
         self.powered_by.setOpenExternalLinks(True)
@@ -677,6 +735,36 @@ class SettingsDialog(QDialog):
         self.parent().sentence_silence = value / 100
         self.labels['Sentence Silence'].setText(f'Sentence Silence: {value / 100:.2f}')
 
+    def set_profiling(self, checked):
+        self.parent().profiling_enabled = checked
+
+    def set_onnx_engine(self, checked):
+        tts_core.synthesis_engine = 'onnx' if checked else 'piper'
+        if checked and not use_onnx_engine():
+            tts_core.synthesis_engine = 'piper'
+            QMessageBox.warning(self, 'ONNX engine', 'The ONNX engine needs numpy, onnxruntime and piper-phonemize. Install them with pip and try again.')
+            self.engine_checkbox.setChecked(False)
+        self.inference_profile_spinner.setEnabled(tts_core.synthesis_engine == 'onnx')
+
+    def set_inference_profile(self, index):
+        # Voices reload with the new session settings on their next sentence
+        tts_core.inference_profile = self.inference_profile_spinner.itemData(index)
+
+    def set_postprocess(self, index):
+        self.parent().postprocess = list(POSTPROCESS_LABELS)[index]
+
+    def update_profile_summary(self, summary):
+        self.profile_summary.setPlainText(summary)
+        self.temp_storage_label.setText(self.temp_storage_summary())
+
+    def temp_storage_summary(self):
+        stats = get_temp_storage().stats()
+        mb = 1024 * 1024
+        quota = f"of a {stats['quota_bytes'] / mb:.0f} MB quota" if stats['quota_bytes'] else 'with no quota'
+        return (f"Temporary audio ({stats['mode']}): {stats['in_use_bytes'] / mb:.1f} MB reserved, "
+                f"peak {stats['peak_bytes'] / mb:.1f} MB {quota}, waited {stats['waits']} times, "
+                f"removed {stats['swept_entries']} leftover files ({stats['swept_bytes'] / mb:.1f} MB)")
+
     def reset_values(self):
         default_values = {
             'Speaker': 0,
@@ -689,26 +777,71 @@ class SettingsDialog(QDialog):
             self.sliders[name].setValue(value)
 
     def open_help_url(self):
+        import webbrowser
         webbrowser.open('https://www.hircoir.eu.org/onnx-tts/help.html')
 
 class TTSApp(QWidget):
     def __init__(self):
         super().__init__()
-        self.player = QMediaPlayer()
+        self._player = None
         self.audio_file = None
-        self.conversion_thread = None
+        # Job whose audio the player is streaming as it is generated
+        self.stream_job_id = None
+        # Where each sentence of the playing audio starts, in milliseconds
+        self.sentence_starts = []
+        # All jobs share one scheduler, so concurrent jobs do not oversubscribe the CPU
+        self.scheduler = VoiceScheduler()
+        self.job_queue = JobQueue()
+        self.conversion_threads = {}
+        self.speaker_sweep_thread = None
+        self.document_thread = None
         self.volume = 100
         self.speaker = 0
         self.noise_scale = 0.667
         self.length_scale = 1.0
         self.noise_w = 0.8
         self.sentence_silence = 0.2
+        self.postprocess = tts_core.postprocess_mode if tts_core.postprocess_mode in POSTPROCESS_LABELS else None
         self.remove_style_enabled = False
         self.processing_text = False
         self.dark_mode = True
         self.download_dialog = None
+        self.settings_dialog = None
+        self.profiling_enabled = profiling.env_enabled()
+        self.last_profile_summary = ''
+        self.voices_thread = None
+        self.warm_up_thread = None
+        self.cancelled_warm_ups = []
+        # Leftovers of crashed or killed runs; live instances keep theirs
+        get_temp_storage().sweep()
         self.init_ui()
         self.apply_theme()
+        # Fetch the voice catalog after the window is up instead of blocking start-up
+        QTimer.singleShot(0, self.load_voices_index)
+        QTimer.singleShot(0, self.offer_resume_jobs)
+
+    @property
+    def player(self):
+        # QtMultimedia is only loaded when audio is first played
+        if self._player is None:
+            from audio_player import StreamPlayer
+            self._player = StreamPlayer(self)
+            self._player.positionChanged.connect(self.update_position)
+            self._player.durationChanged.connect(self.update_duration)
+            self._player.underrun.connect(lambda count: self.update_duration_label(self.slider.value()))
+            self._player.setVolume(self.volume)
+        return self._player
+
+    def load_voices_index(self):
+        self.voices_thread = VoicesIndexThread()
+        self.voices_thread.voices_loaded.connect(self.handle_voices_loaded)
+        self.voices_thread.start()
+
+    def handle_voices_loaded(self, data):
+        voices_data.clear()
+        voices_data.update(data)
+        self.download_button.setEnabled(bool(voices_data) and self.download_dialog is None)
+        self.update_model_spinner()
 
     def init_ui(self):
         self.setWindowTitle('ONNX - Text to Speech Converter')
@@ -732,6 +865,7 @@ class TTSApp(QWidget):
         self.model_spinner.setFixedHeight(40)
         self.model_spinner.addItem("Select a model")
         self.update_model_spinner()
+        self.model_spinner.currentIndexChanged.connect(self.on_model_selected)
         model_layout.addWidget(self.model_spinner)
         self.download_button = QPushButton('Download Model')
         self.download_button.clicked.connect(self.show_download_dialog)
@@ -741,10 +875,18 @@ class TTSApp(QWidget):
             self.download_button.setEnabled(False)
         layout.addLayout(model_layout)
         button_layout = QHBoxLayout()
+        self.priority_spinner = QComboBox()
+        self.priority_spinner.addItems(JOB_PRIORITY_LABELS)
+        self.priority_spinner.setCurrentIndex(JOB_PRIORITIES.index(PRIORITY_NORMAL))
+        button_layout.addWidget(self.priority_spinner)
         self.convert_button = QPushButton('Generate Audio')
         self.convert_button.clicked.connect(self.convert_text)
         self.convert_button.setStyleSheet(BUTTON_STYLE)
         button_layout.addWidget(self.convert_button)
+        self.document_button = QPushButton('Convert Document')
+        self.document_button.clicked.connect(self.start_document_conversion)
+        self.document_button.setStyleSheet(BUTTON_STYLE)
+        button_layout.addWidget(self.document_button)
         self.stop_button = QPushButton('Stop')
         self.stop_button.clicked.connect(self.stop_conversion)
         self.stop_button.setVisible(False)
@@ -777,6 +919,18 @@ class TTSApp(QWidget):
         self.pause_button.clicked.connect(self.pause_audio)
         self.pause_button.setStyleSheet(BUTTON_STYLE)
         self.audio_controls.addWidget(self.pause_button)
+        self.previous_sentence_button = QPushButton()
+        self.previous_sentence_button.setIcon(self.style().standardIcon(QStyle.SP_MediaSkipBackward))
+        self.previous_sentence_button.setToolTip('Previous sentence')
+        self.previous_sentence_button.clicked.connect(lambda: self.jump_sentence(-1))
+        self.previous_sentence_button.setStyleSheet(BUTTON_STYLE)
+        self.audio_controls.addWidget(self.previous_sentence_button)
+        self.next_sentence_button = QPushButton()
+        self.next_sentence_button.setIcon(self.style().standardIcon(QStyle.SP_MediaSkipForward))
+        self.next_sentence_button.setToolTip('Next sentence')
+        self.next_sentence_button.clicked.connect(lambda: self.jump_sentence(1))
+        self.next_sentence_button.setStyleSheet(BUTTON_STYLE)
+        self.audio_controls.addWidget(self.next_sentence_button)
         self.slider = QSlider(Qt.Horizontal)
         self.slider.setRange(0, 100)
         self.slider.sliderMoved.connect(self.set_position)
@@ -794,9 +948,30 @@ class TTSApp(QWidget):
         self.duration_label = QLabel('00:00 / 00:00')
         self.audio_controls.addWidget(self.duration_label)
         layout.addLayout(self.audio_controls)
+        layout.addWidget(QLabel('Jobs'))
+        self.jobs_list = QListWidget()
+        self.jobs_list.setMaximumHeight(120)
+        self.jobs_list.itemDoubleClicked.connect(self.play_job)
+        layout.addWidget(self.jobs_list)
+        jobs_buttons = QHBoxLayout()
+        self.cancel_job_button = QPushButton('Cancel Job')
+        self.cancel_job_button.clicked.connect(self.cancel_selected_job)
+        self.cancel_job_button.setStyleSheet(BUTTON_STYLE)
+        jobs_buttons.addWidget(self.cancel_job_button)
+        self.resume_job_button = QPushButton('Resume Job')
+        self.resume_job_button.clicked.connect(self.resume_selected_job)
+        self.resume_job_button.setStyleSheet(BUTTON_STYLE)
+        jobs_buttons.addWidget(self.resume_job_button)
+        self.clear_jobs_button = QPushButton('Clear Finished')
+        self.clear_jobs_button.clicked.connect(self.clear_finished_jobs)
+        self.clear_jobs_button.setStyleSheet(BUTTON_STYLE)
+        jobs_buttons.addWidget(self.clear_jobs_button)
+        layout.addLayout(jobs_buttons)
+        # Refreshes the elapsed time of running jobs
+        self.jobs_timer = QTimer(self)
+        self.jobs_timer.setInterval(1000)
+        self.jobs_timer.timeout.connect(self.refresh_jobs_list)
         self.setLayout(layout)
-        self.player.positionChanged.connect(self.update_position)
-        self.player.durationChanged.connect(self.update_duration)
         self.find_shortcut = QAction("Find", self)
         self.find_shortcut.setShortcut(QKeySequence.Find)
         self.find_shortcut.triggered.connect(self.show_find_dialog)
@@ -819,49 +994,361 @@ class TTSApp(QWidget):
         if model_name == "Select a model":
             QMessageBox.warning(self, 'Error', 'Please select a base model before generating audio.')
             return
-        self.audio_label.setText('Generating audio...')
-        self.conversion_thread = ConvertTextToSpeechThread(text, model_name)
-        self.conversion_thread.conversion_done.connect(self.handle_conversion_done)
-        self.conversion_thread.start()
-        self.convert_button.setVisible(False)
+        # Unknown voices and malformed tags are reported before anything is queued
+        try:
+            plan = compile_plan(text, model_name)
+        except PlanError as e:
+            QMessageBox.warning(self, 'Error', 'The text has errors, nothing was generated:\n\n' + '\n'.join(e.errors))
+            return
+        priority = JOB_PRIORITIES[self.priority_spinner.currentIndex()]
+        job = ConversionJob(text, model_name, self.synthesis_params(), priority)
+        job.plan = plan
+        self.job_queue.submit(job)
+        self.start_jobs()
+        self.audio_label.setText('Generating audio...' if job.state == 'running' else 'Job queued')
+        self.stop_button.setVisible(True)
+        self.refresh_jobs_list()
+
+    def start_jobs(self):
+        for job in self.job_queue.startable():
+            self.job_queue.mark_running(job)
+            thread = ConvertTextToSpeechThread(job, self.scheduler, self.profiling_enabled)
+            thread.conversion_done.connect(self.handle_conversion_done)
+            thread.profile_ready.connect(self.handle_profile_ready)
+            thread.audio_ready.connect(self.handle_audio_ready)
+            # Keep a reference until the thread has finished
+            thread.finished.connect(lambda job_id=job.job_id: self.conversion_threads.pop(job_id, None))
+            self.conversion_threads[job.job_id] = thread
+            thread.start()
+        if self.job_queue.in_state('running'):
+            self.jobs_timer.start()
+        else:
+            self.jobs_timer.stop()
+
+    def synthesis_params(self):
+        return {
+            'speaker': self.speaker,
+            'noise_scale': self.noise_scale,
+            'length_scale': self.length_scale,
+            'noise_w': self.noise_w,
+            'sentence_silence': self.sentence_silence,
+            'postprocess': self.postprocess,
+        }
+
+    def start_speaker_sweep(self):
+        # Renders the current text once per speaker of the selected voice
+        text = self.text_input.toPlainText()
+        model_name = self.model_spinner.currentText()
+        if model_name == self.model_spinner.itemText(0):
+            QMessageBox.warning(self, 'Error', 'Please select a base model before starting a speaker sweep.')
+            return
+        if not text.strip():
+            QMessageBox.warning(self, 'Error', 'Enter the text every speaker should say.')
+            return
+        if self.speaker_sweep_thread and self.speaker_sweep_thread.isRunning():
+            QMessageBox.information(self, 'Speaker Sweep', 'A speaker sweep is already running.')
+            return
+        speakers = voice_speakers(resolve_model_path(model_name))
+        if len(speakers) < 2:
+            QMessageBox.information(self, 'Speaker Sweep', 'This voice has a single speaker.')
+            return
+        output_dir = QFileDialog.getExistingDirectory(self, 'Choose a folder for the speaker sweep')
+        if not output_dir:
+            return
+        answer = QMessageBox.question(self, 'Speaker Sweep', f"{len(speakers)} speakers. Write one file per speaker?\n\nChoose No for a single file in which every speaker says its number first.",
+                                      QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
+        if answer == QMessageBox.Cancel:
+            return
+        self.speaker_sweep_thread = SpeakerSweepThread(text, model_name, self.synthesis_params(), output_dir,
+                                                       answer == QMessageBox.No)
+        self.speaker_sweep_thread.progress.connect(self.handle_speaker_sweep_progress)
+        self.speaker_sweep_thread.sweep_done.connect(self.handle_speaker_sweep_done)
+        self.speaker_sweep_thread.sweep_failed.connect(self.handle_speaker_sweep_failed)
+        self.speaker_sweep_thread.start()
+        self.audio_label.setText(f"Speaker sweep: 0/{len(speakers)} speakers")
         self.stop_button.setVisible(True)
 
+    def handle_speaker_sweep_progress(self, done, total):
+        self.audio_label.setText(f"Speaker sweep: {done}/{total} speakers")
+
+    def handle_speaker_sweep_done(self, paths):
+        if not paths:
+            self.audio_label.setText('Speaker sweep stopped')
+            return
+        if len(paths) == 1:
+            self.load_audio(paths[0])
+        self.audio_label.setText(f"Speaker sweep saved: {len(paths)} file(s) in {os.path.dirname(paths[0])}")
+
+    def handle_speaker_sweep_failed(self, error):
+        QMessageBox.warning(self, 'Speaker Sweep', f"The speaker sweep failed: {error}")
+
+    def start_document_conversion(self):
+        # Renders a text, Markdown or EPUB file chapter by chapter without loading it into the editor
+        model_name = self.model_spinner.currentText()
+        if model_name == self.model_spinner.itemText(0):
+            QMessageBox.warning(self, 'Error', 'Please select a base model before converting a document.')
+            return
+        if self.document_thread and self.document_thread.isRunning():
+            QMessageBox.information(self, 'Convert Document', 'A document is already being converted.')
+            return
+        path, _ = QFileDialog.getOpenFileName(self, 'Choose a document', '', 'Documents (*.txt *.md *.markdown *.epub)')
+        if not path:
+            return
+        output_dir = QFileDialog.getExistingDirectory(self, 'Choose a folder for the chapter files')
+        if not output_dir:
+            return
+        answer = QMessageBox.question(self, 'Convert Document', 'Also join the chapters into a single file?',
+                                      QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
+        if answer == QMessageBox.Cancel:
+            return
+        self.document_thread = DocumentThread(path, model_name, self.synthesis_params(), output_dir,
+                                              answer == QMessageBox.Yes, self.scheduler)
+        self.document_thread.progress.connect(self.handle_document_progress)
+        self.document_thread.document_done.connect(self.handle_document_done)
+        self.document_thread.document_failed.connect(self.handle_document_failed)
+        self.document_thread.start()
+        self.audio_label.setText(f"Document: converting {os.path.basename(path)}")
+        self.stop_button.setVisible(True)
+
+    def handle_document_progress(self, done, title):
+        self.audio_label.setText(f"Document: {done} chapter(s) done, last: {title or 'untitled'}")
+
+    def handle_document_done(self, paths):
+        if not paths:
+            self.audio_label.setText('Document conversion stopped')
+            return
+        self.audio_label.setText(f"Document saved: {len(paths)} file(s) in {os.path.dirname(paths[0])}")
+
+    def handle_document_failed(self, error):
+        QMessageBox.warning(self, 'Convert Document', f"The document conversion failed: {error}")
+
     def stop_conversion(self):
-        if self.conversion_thread and self.conversion_thread.isRunning():
-            self.conversion_thread.stop()
-            self.audio_label.setText('Audio generation stopped')
-            self.convert_button.setVisible(True)
-            self.stop_button.setVisible(False)
-
-    def handle_conversion_done(self, output_file):
-        self.convert_button.setVisible(True)
+        for job in self.job_queue.in_state('queued', 'running'):
+            self.cancel_job(job)
+        if self.speaker_sweep_thread:
+            self.speaker_sweep_thread.cancel()
+        if self.document_thread:
+            self.document_thread.cancel()
+        self.audio_label.setText('Audio generation stopped')
         self.stop_button.setVisible(False)
-        if output_file:
+        self.refresh_jobs_list()
+
+    def cancel_job(self, job):
+        self.job_queue.cancel(job)
+        thread = self.conversion_threads.get(job.job_id)
+        if thread and thread.isRunning():
+            thread.stop()
+
+    def cancel_selected_job(self):
+        item = self.jobs_list.currentItem()
+        job = self.job_queue.get(item.data(Qt.UserRole)) if item else None
+        if job:
+            self.cancel_job(job)
+            self.start_jobs()
+            self.stop_button.setVisible(bool(self.job_queue.in_state('queued', 'running')))
+            self.refresh_jobs_list()
+
+    def resume_selected_job(self):
+        item = self.jobs_list.currentItem()
+        job = self.job_queue.get(item.data(Qt.UserRole)) if item else None
+        if job is None or job.state not in ('cancelled', 'failed'):
+            return
+        thread = self.conversion_threads.get(job.job_id)
+        if thread and thread.isRunning():
+            # Still winding down and writing its journal
+            return
+        try:
+            journal = job_journal.load_journal(tts_core.journals_folder, job.job_id)
+        except (OSError, ValueError) as e:
+            logging.error(f"Error reading the journal of job {job.job_id}: {str(e)}")
+            journal = None
+        self.job_queue.requeue(job, journal)
+        self.start_jobs()
+        self.stop_button.setVisible(True)
+        self.refresh_jobs_list()
+
+    def offer_resume_jobs(self):
+        # Conversions a crash, a reboot or the stop button left unfinished in an earlier run
+        journals = job_journal.list_journals(tts_core.journals_folder)
+        if not journals:
+            return
+        jobs = [ConversionJob.from_journal(journal) for journal in journals]
+        details = '\n'.join(f"{job.title}: {job.recovered['sentences']}/{job.recovered['total_sentences']} sentences, {job.recovered['audio_seconds']:.0f} s of audio kept" for job in jobs)
+        answer = QMessageBox.question(self, 'Unfinished Conversions', f"{len(journals)} conversion(s) did not finish. Resume them where they stopped?\n\n" + details + "\n\nNo keeps them for later, Discard deletes them.",
+                                      QMessageBox.Yes | QMessageBox.No | QMessageBox.Discard)
+        if answer == QMessageBox.Discard:
+            for journal in journals:
+                journal.discard()
+        elif answer == QMessageBox.Yes:
+            for job in jobs:
+                self.job_queue.submit(job)
+            self.start_jobs()
+            self.audio_label.setText(f'Resuming {len(journals)} conversion(s)')
+            self.stop_button.setVisible(True)
+            self.refresh_jobs_list()
+
+    def clear_finished_jobs(self):
+        for job in self.job_queue.clear_finished():
+            if job.state != 'done':
+                job_journal.discard_journal(tts_core.journals_folder, job.job_id)
+            if job.output and job.output != self.audio_file and self.is_temp_output(job.output):
+                try:
+                    os.remove(job.output)
+                except OSError:
+                    pass
+                timing_index.remove_index(job.output)
+        self.refresh_jobs_list()
+
+    def is_temp_output(self, path):
+        return os.path.dirname(os.path.abspath(path)) == os.path.abspath(temp_audio_folder)
+
+    def handle_conversion_done(self, job_id, output_file):
+        job = self.job_queue.get(job_id)
+        thread = self.conversion_threads.get(job_id)
+        if job:
+            self.job_queue.mark_finished(job, output_file, thread.converter.audio_seconds if thread else 0.0,
+                                         thread.converter.stats.get('duplicates', 0) if thread else 0)
+        self.start_jobs()
+        self.stop_button.setVisible(bool(self.job_queue.in_state('queued', 'running')))
+        self.refresh_jobs_list()
+        if job_id == self.stream_job_id and (job is None or job.state != 'done'):
+            self.stream_job_id = None
+            self.player.clear()
+        if job is None or job.state == 'cancelled':
+            if output_file and os.path.exists(output_file):
+                os.remove(output_file)
+                timing_index.remove_index(output_file)
+            return
+        if job.state != 'done':
+            self.audio_label.setText('Failed to generate audio.')
+        elif job.priority == PRIORITY_BATCH:
+            # Batch renders wait in the jobs panel instead of interrupting playback
+            self.audio_label.setText(f'Batch job finished: {job.title}')
+        elif job_id == self.stream_job_id:
+            # Already playing; the rest is read from the finished file
+            try:
+                self.player.finish_stream(output_file)
+            except (OSError, ValueError) as e:
+                logging.error(f"Error opening {output_file} for playback: {str(e)}")
             self.audio_file = output_file
             self.audio_label.setText('Audio generated')
-            self.player.setMedia(QMediaContent(QUrl.fromLocalFile(output_file)))
-            self.player.setVolume(self.volume)
-            self.play_audio()
+        elif self.streaming_job_running():
+            self.audio_label.setText(f'Job finished: {job.title}')
         else:
-            self.audio_label.setText('Failed to generate audio.')
+            self.load_audio(output_file)
+
+    def load_audio(self, output_file):
+        self.stream_job_id = None
+        self.audio_file = output_file
+        try:
+            self.player.load_file(output_file)
+        except (OSError, ValueError) as e:
+            logging.error(f"Error opening {output_file} for playback: {str(e)}")
+            self.audio_label.setText(f'Could not play {os.path.basename(output_file)}: {e}')
+            return
+        self.audio_label.setText('Audio generated')
+        self.player.setVolume(self.volume)
+        self.sentence_starts = []
+        try:
+            index = timing_index.load_index(output_file)
+        except (OSError, ValueError) as e:
+            logging.error(f"Error reading the sentence index of {output_file}: {str(e)}")
+            index = None
+        if index:
+            self.sentence_starts = [int(index.start_seconds(position) * 1000) for position in range(len(index.sentences))]
+        self.play_audio()
+
+    def streaming_job_running(self):
+        job = self.job_queue.get(self.stream_job_id) if self.stream_job_id else None
+        return job is not None and job.state == 'running'
+
+    def handle_audio_ready(self, job_id, pcm, sample_rate, sentence, file_offset):
+        job = self.job_queue.get(job_id)
+        if job is None or job.state != 'running':
+            return
+        if job_id != self.stream_job_id:
+            # A job takes over the player with the chunk it is on, unless another job
+            # that is at least as urgent is still streaming; its audio starts file_offset
+            # bytes into the file
+            current = self.job_queue.get(self.stream_job_id) if self.stream_job_id else None
+            if current is not None and current.state == 'running' and current.priority <= job.priority:
+                return
+            self.stream_job_id = job_id
+            self.audio_file = None
+            thread = self.conversion_threads.get(job_id)
+            self.player.start_stream(thread.converter.output_path if thread else None, file_offset)
+            self.sentence_starts = [0] if sentence else []
+            self.player.append(pcm, sample_rate)
+            self.audio_label.setText('Playing while the audio is generated...')
+            self.play_audio()
+            return
+        if sentence:
+            self.sentence_starts.append(self.player.duration())
+        self.player.append(pcm, sample_rate)
+
+    def jump_sentence(self, step):
+        # Previous goes to the start of the current sentence first, like a track skip
+        if not self._player or not self.sentence_starts:
+            return
+        position = self.player.position()
+        current = max(0, bisect.bisect_right(self.sentence_starts, position) - 1)
+        if step < 0 and position - self.sentence_starts[current] > SENTENCE_RESTART_MS:
+            step = 0
+        target = min(max(current + step, 0), len(self.sentence_starts) - 1)
+        self.set_position(self.sentence_starts[target])
+        self.slider.setValue(self.sentence_starts[target])
+
+    def play_job(self, item):
+        job = self.job_queue.get(item.data(Qt.UserRole))
+        if job and job.state == 'done' and os.path.exists(job.output):
+            self.load_audio(job.output)
+
+    def refresh_jobs_list(self):
+        selected = self.jobs_list.currentItem()
+        selected_id = selected.data(Qt.UserRole) if selected else None
+        self.jobs_list.clear()
+        for job in self.job_queue.jobs:
+            text = (f'{JOB_STATE_LABELS[job.state]} [{JOB_PRIORITY_LABELS[JOB_PRIORITIES.index(job.priority)]}] '
+                    f'{job.voice}: {job.title}')
+            if job.state == 'done' and job.rtf is not None:
+                text += f'  RTF {job.rtf:.2f} ({job.wall_seconds:.1f} s for {job.audio_seconds:.1f} s of audio)'
+            elif job.state == 'running':
+                text += f'  {job.wall_seconds:.0f} s'
+            if job.recovered and job.recovered['sentences']:
+                text += f', resumed with {job.recovered["sentences"]}/{job.recovered["total_sentences"]} sentences ({job.recovered["audio_seconds"]:.0f} s of audio) recovered'
+            if job.state == 'done' and job.duplicates:
+                text += f', {job.duplicates} repeated sentences reused'
+            item = QListWidgetItem(text)
+            item.setData(Qt.UserRole, job.job_id)
+            self.jobs_list.addItem(item)
+            if job.job_id == selected_id:
+                self.jobs_list.setCurrentItem(item)
+
+    def handle_profile_ready(self, summary):
+        self.last_profile_summary = summary
+        if self.settings_dialog and self.settings_dialog.isVisible():
+            self.settings_dialog.update_profile_summary(summary)
 
     def play_audio(self):
-        if self.audio_file:
-            self.player.play()
+        if self._player:
+            self._player.play()
 
     def pause_audio(self):
-        self.player.pause()
+        if self._player:
+            self._player.pause()
 
     def set_position(self, position):
-        self.player.setPosition(position)
+        if self._player:
+            self._player.setPosition(position)
 
     def update_position(self, position):
         self.slider.setValue(position)
         self.update_duration_label(position)
 
     def update_duration(self, duration):
+        # A streaming conversion grows the duration while it plays
         self.slider.setRange(0, duration)
-        self.update_duration_label(0)
+        self.update_duration_label(self.slider.value())
 
     def update_duration_label(self, position):
         duration = self.player.duration()
@@ -870,26 +1357,45 @@ class TTSApp(QWidget):
             current_seconds = position // 1000
             total_minutes, total_seconds = divmod(total_seconds, 60)
             current_minutes, current_seconds = divmod(current_seconds, 60)
-            self.duration_label.setText(f'{current_minutes:02}:{current_seconds:02} / {total_minutes:02}:{total_seconds:02}')
+            text = f'{current_minutes:02}:{current_seconds:02} / {total_minutes:02}:{total_seconds:02}'
+            if self.player.underruns:
+                text += f' ({self.player.underruns} underruns)'
+            self.duration_label.setText(text)
+        else:
+            self.duration_label.setText('00:00 / 00:00')
 
     def set_volume(self, volume):
         self.volume = volume
-        self.player.setVolume(volume)
+        if self._player:
+            self._player.setVolume(volume)
 
     def save_audio(self):
         if self.audio_file:
             save_path, _ = QFileDialog.getSaveFileName(self, 'Save Audio File', '', 'Audio Files (*.wav)')
             if save_path:
                 os.rename(self.audio_file, save_path)
+                subtitles = []
+                if os.path.exists(timing_index.index_path(self.audio_file)):
+                    os.replace(timing_index.index_path(self.audio_file), timing_index.index_path(save_path))
+                    subtitles = timing_index.write_subtitles(save_path)
+                for job in self.job_queue.jobs:
+                    if job.output == self.audio_file:
+                        job.output = save_path
                 self.audio_file = save_path
-                QMessageBox.information(self, 'File Saved', 'The audio file has been saved successfully')
+                QMessageBox.information(self, 'File Saved', 'The audio file has been saved successfully, with SRT and VTT subtitles next to it' if subtitles else 'The audio file has been saved successfully')
 
     def show_settings(self):
         self.settings_button.setEnabled(False)
         self.settings_dialog = SettingsDialog(self)
-        self.settings_dialog.finished.connect(lambda: self.settings_button.setEnabled(True))
+        self.settings_dialog.finished.connect(self.on_settings_finished)
         self.settings_dialog.show()
 
+    def on_settings_finished(self):
+        self.settings_button.setEnabled(True)
+        # Warm workers are started with the synthesis parameters, reload them with the new values
+        if self.model_spinner.currentIndex() > 0:
+            self.warm_up_voice(self.model_spinner.currentText())
+
     def show_download_dialog(self):
         if self.download_dialog is None:
             self.download_dialog = DownloadModelDialog(self)
@@ -899,9 +1405,11 @@ class TTSApp(QWidget):
 
     def on_download_dialog_finished(self):
         self.download_dialog = None
-        self.download_button.setEnabled(True)
+        self.download_button.setEnabled(bool(voices_data))
 
     def update_model_spinner(self):
+        current = self.model_spinner.currentText()
+        self.model_spinner.blockSignals(True)
         self.model_spinner.clear()
         self.model_spinner.addItem("Select a model")
         downloaded_models = [f for f in os.listdir(model_folder) if f.endswith('.onnx')]
@@ -917,6 +1425,45 @@ class TTSApp(QWidget):
             if not found:
                 models_with_authors.append(model_name)
         self.model_spinner.addItems(sorted(models_with_authors))
+        self.model_spinner.setCurrentIndex(max(self.model_spinner.findText(current), 0))
+        self.model_spinner.blockSignals(False)
+        if self.model_spinner.currentText() != current:
+            self.on_model_selected(self.model_spinner.currentIndex())
+
+    def on_model_selected(self, index):
+        if index <= 0:
+            self.cancel_warm_up()
+            return
+        self.warm_up_voice(self.model_spinner.currentText())
+
+    def warm_up_voice(self, model_name):
+        # Load the voice and run a tiny inference now, so the first Generate starts immediately
+        self.cancel_warm_up()
+        model_path = resolve_model_path(model_name)
+        if not os.path.exists(model_path):
+            return
+        worker_cache.close_all(keep_model=model_path)
+        self.audio_label.setText(f'Loading voice {model_name}...')
+        self.warm_up_thread = WarmUpThread(model_name, self.synthesis_params())
+        self.warm_up_thread.warmed_up.connect(self.handle_voice_warmed_up)
+        self.warm_up_thread.warm_up_failed.connect(self.handle_voice_warm_up_failed)
+        self.warm_up_thread.start()
+
+    def cancel_warm_up(self):
+        self.cancelled_warm_ups = [thread for thread in self.cancelled_warm_ups if thread.isRunning()]
+        if self.warm_up_thread and self.warm_up_thread.isRunning():
+            self.warm_up_thread.cancel()
+            # Keep a reference until the thread has finished
+            self.cancelled_warm_ups.append(self.warm_up_thread)
+        self.warm_up_thread = None
+
+    def handle_voice_warmed_up(self, model_name, seconds):
+        if model_name == self.model_spinner.currentText():
+            self.audio_label.setText(f'Voice {model_name} ready (loaded in {seconds:.2f} s)')
+
+    def handle_voice_warm_up_failed(self, model_name):
+        if model_name == self.model_spinner.currentText():
+            self.audio_label.setText(f'Could not load voice {model_name}')
 
     def on_text_changed(self):
         if self.processing_text:
@@ -996,8 +1543,13 @@ class ManageModelsDialog(QDialog):
         self.delete_button.clicked.connect(self.delete_selected_models)
         self.delete_button.setStyleSheet(BUTTON_STYLE)
         button_layout.addWidget(self.delete_button)
+        self.quantize_button = QPushButton('Quantize Selected Model (INT8)')
+        self.quantize_button.clicked.connect(self.quantize_selected_model)
+        self.quantize_button.setStyleSheet(BUTTON_STYLE)
+        button_layout.addWidget(self.quantize_button)
         layout.addLayout(button_layout)
         self.setLayout(layout)
+        self.quantize_thread = None
         self.load_models()
 
     def load_models(self):
@@ -1018,152 +1570,52 @@ class ManageModelsDialog(QDialog):
                     model_path = os.path.join(model_folder, f"{model_name}.onnx")
                     if os.path.exists(model_path):
                         os.remove(model_path)
+                    onnx_engine.remove_optimized_model(model_path)
                 self.load_models()
                 self.main_app.update_model_spinner()
 
-def random_string(length=8):
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
-
-def multiple_replace(text, replacements):
-    for old, new in replacements:
-        text = text.replace(old, new)
-    return text
-
-def filter_code_blocks(text):
-    return re.sub(r'```[^`\n]*\n.*?```', '', text, flags=re.DOTALL)
-
-def process_line_breaks(text):
-    lines = [line.strip() for line in text.splitlines() if line.strip()]
-    if not lines:
-        return ''
-    processed = [lines[0]]
-    for line in lines[1:]:
-        prev_line = processed[-1]
-        if prev_line and prev_line[-1] in ('.', ','):
-            processed.append(' ' + line)
-        else:
-            if prev_line.endswith(')'):
-                processed.append(', ' + line)
-            else:
-                processed.append('. ' + line)
-    processed_text = ''.join(processed)
-    processed_text = re.sub(r'(\))(?![.,])(?=\s|\\\\$)', r'\1,', processed_text)
-    return processed_text
-
-def split_sentences(text):
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    return [s.strip() for s in sentences if s.strip()]
-
-def filter_text_segment(text_segment):
-    text = filter_code_blocks(text_segment)
-    text = process_line_breaks(text)
-    text = multiple_replace(text, global_replacements)
-    text = text.replace('\\', '\\\\').replace('"', '\\"')
-    return text[:100000]
-
-def generate_silence(seconds, temp_dir):
-    if seconds <= 0:
-        return None
-    output_file = os.path.join(temp_dir, f"silence_{seconds}s.wav")
-    try:
-        subprocess.run(
-            [
-                ffmpeg_path,
-                '-loglevel', 'error',
-                '-f', 'lavfi',
-                '-i', 'anullsrc=r=22050:cl=mono',
-                '-t', str(seconds),
-                '-ar', '22050',
-                '-y',
-                output_file
-            ],
-            check=True,
-            creationflags=get_creationflags()
-        )
-        return output_file
-    except subprocess.CalledProcessError:
-        logging.error("Error generating silence")
-        return None
-
-def concatenate_audio_files(audio_files, output_file, temp_dir):
-    list_file = os.path.join(temp_dir, 'concat_list.txt')
-    try:
-        with open(list_file, 'w') as f:
-            for file in audio_files:
-                f.write(f"file '{os.path.abspath(file)}'\n")
-        subprocess.run(
-            [
-                ffmpeg_path,
-                '-loglevel', 'error',
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', list_file,
-                '-c', 'copy',
-                '-y',
-                output_file
-            ],
-            check=True,
-            creationflags=get_creationflags()
-        )
-        return True
-    except subprocess.CalledProcessError:
-        logging.error("Error concatenating audios")
-        return False
-    finally:
-        try:
-            os.remove(list_file)
-        except:
-            pass
-
-def download_file(url, destination, progress_callback):
-    response = requests.get(url, stream=True)
-    total_size = int(response.headers.get('content-length', 0))
-    downloaded_size = 0
-    with open(destination, 'wb') as file:
-        for data in response.iter_content(1024):
-            file.write(data)
-            downloaded_size += len(data)
-            progress_callback(downloaded_size, total_size)
+    def quantize_selected_model(self):
+        import quantize_voice
+        selected_items = self.model_list.selectedItems()
+        if len(selected_items) != 1:
+            QMessageBox.information(self, 'Quantize Model', 'Select a single model to quantize.')
+            return
+        model_name = selected_items[0].text()
+        if model_name.endswith(quantize_voice.QUANTIZED_SUFFIX):
+            QMessageBox.information(self, 'Quantize Model', 'This model is already a quantized copy.')
+            return
+        if not quantize_voice.available():
+            QMessageBox.warning(self, 'Quantize Model', 'Quantization needs numpy, onnx, onnxruntime and piper-phonemize. Install them with pip and try again.')
+            return
+        self.quantize_button.setEnabled(False)
+        self.quantize_button.setText('Quantizing...')
+        # Parented to the dialog so the thread outlives a closed dialog
+        self.quantize_thread = QuantizeModelThread(model_name, self)
+        self.quantize_thread.quantized.connect(self.handle_model_quantized)
+        self.quantize_thread.quantize_failed.connect(self.handle_quantize_failed)
+        self.quantize_thread.start()
+
+    def finish_quantize(self):
+        self.quantize_button.setEnabled(True)
+        self.quantize_button.setText('Quantize Selected Model (INT8)')
+        self.load_models()
+        self.main_app.update_model_spinner()
+
+    def handle_model_quantized(self, model_name, report):
+        import quantize_voice
+        self.finish_quantize()
+        QMessageBox.information(
+            self, 'Quantize Model',
+            (f"{model_name}{quantize_voice.QUANTIZED_SUFFIX} is now available as a voice.\n\n"
+             f"Size: {report['original_bytes'] / 1e6:.1f} MB -> {report['quantized_bytes'] / 1e6:.1f} MB\n"
+             f"Real-time factor: {report['original_rtf']} -> {report['quantized_rtf']} ({report['speedup']}x faster)\n"
+             f"Spectral distance: {report['spectral_distance_db']} dB (max {report['max_spectral_distance_db']} dB)"))
+
+    def handle_quantize_failed(self, model_name, error):
+        self.finish_quantize()
+        QMessageBox.warning(self, 'Quantize Model', f"Could not quantize {model_name}: {error}")
 
 if __name__ == '__main__':
-    # Check if FFmpeg exists
-    if not os.path.exists(ffmpeg_path):
-        print(f"Error: FFmpeg not found at {ffmpeg_path}")
-        sys.exit(1)
-
-    repos_url = "https://raw.githubusercontent.com/HirCoir/bash-logs/refs/heads/main/piper_voices.json"
-    voices_data = {}
-    try:
-        repos_response = requests.get(repos_url)
-        repos_response.raise_for_status()
-        repos = repos_response.json()
-        for repo in repos:
-            repo_base_url = repo['base_url']
-            repo_json_url = repo['json_url']
-            autor = repo['author_repo']
-            try:
-                repo_response = requests.get(repo_json_url)
-                repo_response.raise_for_status()
-                repo_voices = repo_response.json()
-                for model_key, model_info in repo_voices.items():
-                    updated_files = {}
-                    for file_path, file_details in model_info.get('files', {}).items():
-                        full_url = repo_base_url + file_path
-                        updated_files[file_path] = {
-                            'url': full_url,
-                            'size': file_details.get('size', 0)
-                        }
-                    voices_data[model_key] = {
-                        'files': updated_files,
-                        'Author': autor,
-                        'base_model_key': model_key
-                    }
-            except requests.RequestException as e:
-                logging.error(f"Error loading repository {repo_json_url}: {e}")
-    except requests.RequestException as e:
-        logging.error(f"Error loading repos.json: {e}")
-        voices_data = {}
-
     app = QApplication([])
     app.setStyle('Fusion')
     app.setStyleSheet(ThemeManager.dark_theme())
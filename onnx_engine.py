@@ -0,0 +1,420 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+# In-process synthesis with onnxruntime, following piper's own Python implementation.
+# numpy, onnxruntime and piper-phonemize are optional and only imported when used.
+BOS = '^'
+EOS = '$'
+PAD = '_'
+MAX_WAV_VALUE = 32767.0
+# Optimized graphs are saved next to each voice; the suffix keeps them out of the voice list
+OPTIMIZED_SUFFIX = '.ort-cache'
+
+# Session settings per inference profile. Threads of 0 leave the choice to ORT (one per
+# physical core). concurrent_runs caps the sentences a voice renders at once, 0 meaning
+# one per CPU: "latency" gives a single stream every core, "throughput" runs many
+# single-threaded sentences side by side, "low-memory" frees buffers after each run.
+# VITS graphs are one long chain, so parallel execution mode would only add overhead.
+INFERENCE_PROFILES = {
+    'latency': {'intra_op_threads': 0, 'inter_op_threads': 1, 'execution_mode': 'sequential',
+                'cpu_mem_arena': True, 'mem_pattern': True, 'spin_wait': True, 'concurrent_runs': 1},
+    'throughput': {'intra_op_threads': 1, 'inter_op_threads': 1, 'execution_mode': 'sequential',
+                   'cpu_mem_arena': True, 'mem_pattern': True, 'spin_wait': False, 'concurrent_runs': 0},
+    'low-memory': {'intra_op_threads': 0, 'inter_op_threads': 1, 'execution_mode': 'sequential',
+                   'cpu_mem_arena': False, 'mem_pattern': False, 'spin_wait': False, 'concurrent_runs': 1},
+}
+DEFAULT_PROFILE = 'latency'
+
+# Padded batches: at most BATCH_MAX_TOKENS phoneme ids (padding included) and an estimated
+# BATCH_MAX_BYTES of float audio per forward pass
+BATCH_MAX_TOKENS = 4096
+BATCH_MAX_BYTES = 64 * 1024 * 1024
+SAMPLES_PER_ID_ESTIMATE = 1024
+# Exports with a per-row length output (samples, or frames per phoneme id) have padded rows
+# cut at that length. Piper's own exports only return audio, so their padded rows are
+# trimmed after the last frame louder than this fraction of the row's peak, and unpadded
+# audio of a voice that batches is trimmed the same way, so a sentence comes out the same
+# whether it was rendered in a batch or alone
+TRIM_FRAME = 256
+TRIM_THRESHOLD = 0.01
+LENGTH_OUTPUTS = ('audio_lengths', 'output_lengths')
+DURATION_OUTPUTS = ('durations', 'w_ceil')
+# Samples per frame of piper's VITS decoder
+HOP_LENGTH = 256
+
+_modules = None
+_voices = {}
+_voices_lock = threading.Lock()
+
+
+def _import_modules():
+    global _modules
+    if _modules is None:
+        import numpy
+        import onnxruntime
+        import piper_phonemize
+        _modules = (numpy, onnxruntime, piper_phonemize)
+    return _modules
+
+
+def available():
+    try:
+        _import_modules()
+    except ImportError:
+        return False
+    return True
+
+
+def audio_float_to_int16(audio):
+    np = _import_modules()[0]
+    if not audio.size:
+        return audio.astype(np.int16)
+    audio = audio * (MAX_WAV_VALUE / max(0.01, float(np.max(np.abs(audio)))))
+    return np.clip(audio, -MAX_WAV_VALUE, MAX_WAV_VALUE).astype(np.int16)
+
+
+def session_options(profile=DEFAULT_PROFILE):
+    ort = _import_modules()[1]
+    settings = INFERENCE_PROFILES[profile]
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = settings['intra_op_threads']
+    options.inter_op_num_threads = settings['inter_op_threads']
+    options.execution_mode = (ort.ExecutionMode.ORT_PARALLEL if settings['execution_mode'] == 'parallel'
+                              else ort.ExecutionMode.ORT_SEQUENTIAL)
+    options.enable_cpu_mem_arena = settings['cpu_mem_arena']
+    options.enable_mem_pattern = settings['mem_pattern']
+    spinning = '1' if settings['spin_wait'] else '0'
+    options.add_session_config_entry('session.intra_op.allow_spinning', spinning)
+    options.add_session_config_entry('session.inter_op.allow_spinning', spinning)
+    return options
+
+
+def optimized_model_paths(model_path):
+    cache_path = f"{model_path}{OPTIMIZED_SUFFIX}"
+    return cache_path, f"{cache_path}.json"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_stamp(stamp_path):
+    try:
+        with open(stamp_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_stamp(stamp_path, stamp):
+    with open(stamp_path, 'w', encoding='utf-8') as f:
+        json.dump(stamp, f)
+
+
+def cache_is_valid(model_path, cache_path, stamp_path, stamp):
+    # Size and mtime save hashing the model on every load; the hash decides when they differ
+    ort = _import_modules()[1]
+    if not stamp or stamp.get('ort_version') != ort.__version__ or not os.path.exists(cache_path):
+        return False
+    stat = os.stat(model_path)
+    if stamp.get('size') == stat.st_size and stamp.get('mtime_ns') == stat.st_mtime_ns:
+        return True
+    if stamp.get('sha256') != file_sha256(model_path):
+        return False
+    write_stamp(stamp_path, dict(stamp, size=stat.st_size, mtime_ns=stat.st_mtime_ns))
+    return True
+
+
+def remove_optimized_model(model_path):
+    for path in optimized_model_paths(model_path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def load_session(model_path, profile=DEFAULT_PROFILE):
+    # Returns (session, cache) where cache is "warm" when the saved optimized graph was used,
+    # "cold" when it was (re)built by this load and "off" when it could not be saved.
+    # Graphs are saved at the extended level: the layout transforms of the "all" level are
+    # specific to the CPU, and a models folder in Documents may be synced between machines.
+    _, ort, _ = _import_modules()
+    cache_path, stamp_path = optimized_model_paths(model_path)
+    if cache_is_valid(model_path, cache_path, stamp_path, read_stamp(stamp_path)):
+        options = session_options(profile)
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        try:
+            return ort.InferenceSession(cache_path, options, providers=['CPUExecutionProvider']), 'warm'
+        except Exception as e:
+            logging.error(f"Error loading optimized model {cache_path}, rebuilding it: {str(e)}")
+    options = session_options(profile)
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    options.optimized_model_filepath = temp_path
+    try:
+        session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    try:
+        stat = os.stat(model_path)
+        os.replace(temp_path, cache_path)
+        write_stamp(stamp_path, {'sha256': file_sha256(model_path), 'size': stat.st_size,
+                                 'mtime_ns': stat.st_mtime_ns, 'ort_version': ort.__version__})
+    except OSError as e:
+        logging.error(f"Error saving optimized model for {model_path}: {str(e)}")
+        return session, 'off'
+    return session, 'cold'
+
+
+def plan_batches(lengths, max_tokens=BATCH_MAX_TOKENS, max_bytes=BATCH_MAX_BYTES, max_size=None,
+                 length_scale=1.0):
+    # Groups indexes of lengths into batches of similar length, shortest first, so
+    # little of each forward pass is spent on padding
+    batches = []
+    batch = []
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # Sorted, so this sentence sets the padded length of the batch
+        padded = lengths[index] * (len(batch) + 1)
+        audio_bytes = padded * SAMPLES_PER_ID_ESTIMATE * length_scale * 4
+        if batch and (padded > max_tokens or audio_bytes > max_bytes or len(batch) == max_size):
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def trim_padding(audio):
+    np = _import_modules()[0]
+    peak = float(np.max(np.abs(audio))) if len(audio) else 0.0
+    if peak == 0.0:
+        return audio[:0]
+    loud = np.nonzero(np.abs(audio) > peak * TRIM_THRESHOLD)[0]
+    end = (int(loud[-1]) // TRIM_FRAME + 1) * TRIM_FRAME
+    return audio[:end]
+
+
+class OnnxVoice:
+    def __init__(self, model_path, phoneme_store=None, profile=DEFAULT_PROFILE):
+        if profile not in INFERENCE_PROFILES:
+            logging.error(f"Unknown inference profile {profile!r}, using {DEFAULT_PROFILE}")
+            profile = DEFAULT_PROFILE
+        self.model_path = model_path
+        self.profile = profile
+        self.run_slots = threading.BoundedSemaphore(INFERENCE_PROFILES[profile]['concurrent_runs'] or os.cpu_count())
+        with open(f"{model_path}.json", 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        self.sample_rate = self.config.get('audio', {}).get('sample_rate', 22050)
+        self.num_speakers = self.config.get('num_speakers', 1)
+        self.phoneme_type = self.config.get('phoneme_type', 'espeak')
+        self.espeak_voice = self.config.get('espeak', {}).get('voice', 'en-us')
+        self.phoneme_id_map = self.config['phoneme_id_map']
+        self.phoneme_store = phoneme_store
+        start = time.perf_counter()
+        self.session, self.load_cache = load_session(model_path, profile)
+        self.load_seconds = time.perf_counter() - start
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        batch_dim = next(model_input.shape[0] for model_input in self.session.get_inputs()
+                         if model_input.name == 'input')
+        self.supports_batching = not isinstance(batch_dim, int)
+        self.output_names = [output.name for output in self.session.get_outputs()]
+        self.length_output = next((name for name in self.output_names
+                                   if name in LENGTH_OUTPUTS + DURATION_OUTPUTS), None)
+
+    @property
+    def store_key(self):
+        # Codepoint "phonemes" are the text itself, independent of espeak
+        return self.espeak_voice if self.phoneme_type == 'espeak' else f"text:{self.espeak_voice}"
+
+    def run_phonemizer(self, text):
+        phonemizer = _import_modules()[2]
+        if self.phoneme_type == 'text':
+            return phonemizer.phonemize_codepoints(text)
+        return phonemizer.phonemize_espeak(text, self.espeak_voice)
+
+    def phonemize(self, text):
+        # One list of phonemes per sentence found by espeak
+        if self.phoneme_store is None:
+            return self.run_phonemizer(text)
+        sentences = self.phoneme_store.get(self.store_key, text)
+        if sentences is None:
+            sentences = self.run_phonemizer(text)
+            self.phoneme_store.put(self.store_key, text, sentences)
+        return sentences
+
+    def precompute(self, texts):
+        # Phonemize everything a job will need up front, in a single store transaction
+        if self.phoneme_store is None:
+            return 0
+        missing = self.phoneme_store.missing(self.store_key, texts)
+        if missing:
+            self.phoneme_store.put_many(self.store_key, [(text, self.run_phonemizer(text)) for text in missing])
+        return len(missing)
+
+    def phoneme_ids(self, phonemes):
+        id_map = self.phoneme_id_map
+        ids = list(id_map[BOS]) + list(id_map[PAD])
+        for phoneme in phonemes:
+            if phoneme not in id_map:
+                logging.warning(f"Missing phoneme from id map: {phoneme}")
+                continue
+            ids.extend(id_map[phoneme])
+            ids.extend(id_map[PAD])
+        ids.extend(id_map[EOS])
+        return ids
+
+    def inference_inputs(self, phoneme_ids, params):
+        np = _import_modules()[0]
+        inference = self.config.get('inference', {})
+        text = np.expand_dims(np.array(phoneme_ids, dtype=np.int64), 0)
+        inputs = {
+            'input': text,
+            'input_lengths': np.array([text.shape[1]], dtype=np.int64),
+            'scales': np.array([
+                params.get('noise_scale', inference.get('noise_scale', 0.667)),
+                params.get('length_scale', inference.get('length_scale', 1.0)),
+                params.get('noise_w', inference.get('noise_w', 0.8)),
+            ], dtype=np.float32),
+        }
+        if self.num_speakers > 1 and 'sid' in self.input_names:
+            inputs['sid'] = np.array([params.get('speaker') or 0], dtype=np.int64)
+        return inputs
+
+    def synthesize_ids(self, phoneme_ids, params=None):
+        inputs = self.inference_inputs(phoneme_ids, params or {})
+        with self.run_slots:
+            audio = self.session.run(None, inputs)[0].reshape(-1)
+        if self.supports_batching and self.length_output is None:
+            audio = trim_padding(audio)
+        return audio_float_to_int16(audio)
+
+    def row_samples(self, outputs):
+        # Samples each row of a padded batch really has, or None when the export doesn't say
+        if self.length_output is None:
+            return None
+        values = outputs[self.output_names.index(self.length_output)]
+        values = values.reshape(len(values), -1).sum(axis=1)
+        if self.length_output in DURATION_OUTPUTS:
+            values = values * HOP_LENGTH
+        return [int(round(float(value))) for value in values]
+
+    def synthesize_padded(self, id_lists, params=None, speakers=None):
+        # One forward pass for several sentences, padded to the longest one; speakers gives
+        # each row its own speaker id
+        np = _import_modules()[0]
+        params = params or {}
+        width = max(len(ids) for ids in id_lists)
+        pad = self.phoneme_id_map[PAD][0]
+        inputs = self.inference_inputs(id_lists[0], params)
+        inputs['input'] = np.array([ids + [pad] * (width - len(ids)) for ids in id_lists], dtype=np.int64)
+        inputs['input_lengths'] = np.array([len(ids) for ids in id_lists], dtype=np.int64)
+        if 'sid' in inputs:
+            inputs['sid'] = (np.array(speakers, dtype=np.int64) if speakers is not None
+                             else np.repeat(inputs['sid'], len(id_lists)))
+        with self.run_slots:
+            outputs = self.session.run(None, inputs)
+        audio = outputs[0].reshape(len(id_lists), -1)
+        lengths = self.row_samples(outputs)
+        if lengths is not None:
+            return [audio_float_to_int16(row[:length]) for row, length in zip(audio, lengths)]
+        return [audio_float_to_int16(trim_padding(row)) for row in audio]
+
+    def synthesize_batch(self, texts, params=None, max_size=None):
+        # Like synthesize() for each text, but espeak sentences of all texts are sorted by
+        # length and rendered in padded batches. Returns (pcm, sample_rate) per text
+        params = params or {}
+        if not self.supports_batching:
+            return [self.synthesize(text, params) for text in texts]
+        parts = []
+        for text_index, text in enumerate(texts):
+            for phonemes in self.phonemize(text):
+                parts.append((text_index, self.phoneme_ids(phonemes)))
+        rendered = [None] * len(parts)
+        length_scale = params.get('length_scale') or 1.0
+        for batch in plan_batches([len(ids) for _, ids in parts], max_size=max_size, length_scale=length_scale):
+            for index, pcm in zip(batch, self.synthesize_padded([parts[index][1] for index in batch], params)):
+                rendered[index] = pcm
+        silence = bytes(2 * int(self.sample_rate * (params.get('sentence_silence') or 0.0)))
+        pcm_by_text = [bytearray() for _ in texts]
+        for (text_index, _), pcm in zip(parts, rendered):
+            pcm_by_text[text_index] += pcm.tobytes()
+            pcm_by_text[text_index] += silence
+        return [(bytes(pcm), self.sample_rate) for pcm in pcm_by_text]
+
+    def synthesize_speakers(self, texts, speakers, params=None, markers=None):
+        # Renders texts once per speaker id, phonemizing each text only once; rows of every
+        # speaker share padded batches. markers maps a speaker id to a text said first.
+        # Returns (pcm, sample_rate) per speaker, in the order of speakers
+        params = params or {}
+        phonemes = [self.phonemize(text) for text in texts]
+        marker_phonemes = {speaker: self.phonemize(text) for speaker, text in (markers or {}).items()}
+        rows = []
+        for position, speaker in enumerate(speakers):
+            for sentences in [marker_phonemes.get(speaker, [])] + phonemes:
+                for sentence in sentences:
+                    rows.append((position, speaker, self.phoneme_ids(sentence)))
+        rendered = [None] * len(rows)
+        if self.supports_batching and 'sid' in self.input_names:
+            length_scale = params.get('length_scale') or 1.0
+            for batch in plan_batches([len(ids) for _, _, ids in rows], length_scale=length_scale):
+                audio = self.synthesize_padded([rows[index][2] for index in batch], params,
+                                               [rows[index][1] for index in batch])
+                for index, pcm in zip(batch, audio):
+                    rendered[index] = pcm
+        else:
+            for index, (_, speaker, ids) in enumerate(rows):
+                rendered[index] = self.synthesize_ids(ids, dict(params, speaker=speaker))
+        silence = bytes(2 * int(self.sample_rate * (params.get('sentence_silence') or 0.0)))
+        pcm_by_speaker = [bytearray() for _ in speakers]
+        for (position, _, _), pcm in zip(rows, rendered):
+            pcm_by_speaker[position] += pcm.tobytes()
+            pcm_by_speaker[position] += silence
+        return [(bytes(pcm), self.sample_rate) for pcm in pcm_by_speaker]
+
+    def synthesize(self, text, params=None):
+        # Same output as `piper --output_raw`: every espeak sentence followed by sentence_silence
+        params = params or {}
+        silence = bytes(2 * int(self.sample_rate * (params.get('sentence_silence') or 0.0)))
+        pcm = bytearray()
+        for phonemes in self.phonemize(text):
+            pcm += self.synthesize_ids(self.phoneme_ids(phonemes), params).tobytes()
+            pcm += silence
+        return bytes(pcm), self.sample_rate
+
+
+def get_voice(model_path, phoneme_store=None, profile=DEFAULT_PROFILE):
+    if profile not in INFERENCE_PROFILES:
+        logging.error(f"Unknown inference profile {profile!r}, using {DEFAULT_PROFILE}")
+        profile = DEFAULT_PROFILE
+    with _voices_lock:
+        voice = _voices.get(model_path)
+        # A profile change reloads the session with the new settings
+        if voice is None or voice.profile != profile:
+            voice = _voices[model_path] = OnnxVoice(model_path, phoneme_store, profile)
+        return voice
+
+
+def unload_voices(keep_model=None):
+    with _voices_lock:
+        for model_path in list(_voices):
+            if model_path != keep_model:
+                del _voices[model_path]
+
+
+def unload_voice(model_path):
+    # Drops the session of one model, e.g. after its file was replaced on disk
+    with _voices_lock:
+        for loaded_path in list(_voices):
+            if os.path.abspath(loaded_path) == os.path.abspath(model_path):
+                del _voices[loaded_path]
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+# Phonemes depend only on the text and the espeak voice, so one store serves every
+# model that shares a language and the entries stay valid across synthesis settings.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS phonemes (
+    voice TEXT NOT NULL,
+    text_hash BLOB NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (voice, text_hash)
+) WITHOUT ROWID
+'''
+
+
+def text_key(text):
+    return hashlib.sha1(text.encode('utf-8')).digest()
+
+
+def encode_phonemes(sentences):
+    return zlib.compress(json.dumps(sentences, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def decode_phonemes(data):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+class PhonemeStore:
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(SCHEMA)
+        return self._connection
+
+    def get(self, voice, text):
+        with self.lock:
+            row = self.connection.execute('SELECT data FROM phonemes WHERE voice = ? AND text_hash = ?',
+                                          (voice, text_key(text))).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return decode_phonemes(row[0])
+
+    def put(self, voice, text, sentences):
+        self.put_many(voice, [(text, sentences)])
+
+    def put_many(self, voice, items):
+        rows = [(voice, text_key(text), encode_phonemes(sentences)) for text, sentences in items]
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO phonemes VALUES (?, ?, ?)', rows)
+
+    def missing(self, voice, texts):
+        keys = {text_key(text): text for text in texts}
+        hashes = list(keys)
+        known = set()
+        with self.lock:
+            # Stay below SQLite's default limit on bound parameters
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                query = (f"SELECT text_hash FROM phonemes WHERE voice = ? AND text_hash IN "
+                         f"({','.join('?' * len(chunk))})")
+                known.update(row[0] for row in self.connection.execute(query, [voice] + chunk))
+        return [text for key, text in keys.items() if key not in known]
+
+    def stats(self):
+        with self.lock:
+            entries = self.connection.execute('SELECT COUNT(*) FROM phonemes').fetchone()[0]
+            hits, misses = self.hits, self.misses
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return {'entries': entries, 'hits': hits, 'misses': misses, 'size_bytes': size}
+
+    def close(self):
+        with self.lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,118 @@
+import math
+
+# Per-sentence clean-up of 16-bit mono PCM before it is assembled: energy-based trimming
+# of leading and trailing silence, peak or loudness normalization and short fades, so
+# sentences join at a consistent level without another ffmpeg pass. numpy is optional.
+MODES = ('peak', 'loudness')
+FRAME_SECONDS = 0.01
+SILENCE_DB = -45.0
+# Kept around the trimmed speech so soft onsets and releases are not cut
+KEEP_SECONDS = 0.03
+PEAK_TARGET_DB = -1.0
+# Loudness is approximated with BS.1770 style gating on plain RMS (no K-weighting filter)
+LOUDNESS_TARGET_DB = -20.0
+ABSOLUTE_GATE_DB = -70.0
+RELATIVE_GATE_DB = -10.0
+MAX_GAIN_DB = 20.0
+FADE_SECONDS = 0.005
+MAX_VALUE = 32767.0
+
+_numpy = None
+
+
+def _np():
+    global _numpy
+    if _numpy is None:
+        import numpy
+        _numpy = numpy
+    return _numpy
+
+
+def available():
+    try:
+        _np()
+    except ImportError:
+        return False
+    return True
+
+
+def db_to_gain(db):
+    return 10.0 ** (db / 20.0)
+
+
+def frame_levels(samples, frame_size):
+    # RMS of each whole frame in dBFS
+    np = _np()
+    count = len(samples) // frame_size
+    frames = samples[:count * frame_size].reshape(count, frame_size)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20.0 * np.log10(np.maximum(rms, 1e-9))
+
+
+def trim_silence(samples, sample_rate, threshold_db=SILENCE_DB, keep_seconds=KEEP_SECONDS):
+    np = _np()
+    frame_size = max(1, int(sample_rate * FRAME_SECONDS))
+    if len(samples) < frame_size:
+        return samples
+    loud = np.nonzero(frame_levels(samples, frame_size) > threshold_db)[0]
+    if not len(loud):
+        return samples[:0]
+    keep = int(sample_rate * keep_seconds)
+    start = max(0, int(loud[0]) * frame_size - keep)
+    end = min(len(samples), (int(loud[-1]) + 1) * frame_size + keep)
+    return samples[start:end]
+
+
+def loudness_db(samples, sample_rate):
+    np = _np()
+    frame_size = max(1, int(sample_rate * FRAME_SECONDS))
+    if len(samples) < frame_size:
+        return None
+    levels = frame_levels(samples, frame_size)
+    gated = levels[levels > ABSOLUTE_GATE_DB]
+    if not len(gated):
+        return None
+    # Energy average, then the relative gate against it
+    mean = 10.0 * math.log10(float(np.mean(10.0 ** (gated / 10.0))))
+    gated = gated[gated > mean + RELATIVE_GATE_DB]
+    return 10.0 * math.log10(float(np.mean(10.0 ** (gated / 10.0))))
+
+
+def normalize(samples, sample_rate, mode='peak'):
+    np = _np()
+    peak = float(np.max(np.abs(samples))) if len(samples) else 0.0
+    if peak <= 0.0:
+        return samples
+    peak_gain = db_to_gain(PEAK_TARGET_DB) / peak
+    if mode == 'loudness':
+        level = loudness_db(samples, sample_rate)
+        if level is None:
+            return samples
+        # Never louder than the peak target allows, to avoid clipping
+        gain = min(db_to_gain(LOUDNESS_TARGET_DB - level), peak_gain, db_to_gain(MAX_GAIN_DB))
+    else:
+        gain = peak_gain
+    return samples * gain
+
+
+def fade(samples, sample_rate, seconds=FADE_SECONDS):
+    np = _np()
+    length = min(int(sample_rate * seconds), len(samples) // 2)
+    if length < 2:
+        return samples
+    ramp = np.linspace(0.0, 1.0, length, dtype=samples.dtype)
+    samples[:length] *= ramp
+    samples[-length:] *= ramp[::-1]
+    return samples
+
+
+def process_pcm(pcm, sample_rate, mode='peak', silence_seconds=0.0):
+    # Trims, normalizes and fades one sentence, then appends silence_seconds of silence
+    # (the sentence silence the trim removed)
+    np = _np()
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / MAX_VALUE
+    samples = trim_silence(samples, sample_rate)
+    if len(samples):
+        samples = fade(normalize(samples, sample_rate, mode), sample_rate)
+    out = np.clip(samples * MAX_VALUE, -MAX_VALUE, MAX_VALUE).astype(np.int16).tobytes()
+    return out + bytes(2 * int(round(silence_seconds * sample_rate)))
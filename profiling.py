@@ -0,0 +1,251 @@
+import contextlib
+import cProfile
+import csv
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Set ONNX_TTS_PROFILE=1 to profile every conversion without opening the Settings dialog
+PROFILE_ENV_VAR = 'ONNX_TTS_PROFILE'
+SAMPLE_INTERVAL = 0.1
+HOTSPOT_LIMIT = 15
+# Before Python 3.12 cProfile only sees the thread that enabled it, so every thread that
+# runs profiled work gets its own profiler; from 3.12 on one profiler sees every thread and
+# only one may be active per process
+PER_THREAD_PROFILERS = sys.version_info < (3, 12)
+
+
+def env_enabled():
+    return os.environ.get(PROFILE_ENV_VAR, '').strip() not in ('', '0', 'false', 'False')
+
+
+def current_rss_bytes():
+    if psutil:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def count_child_processes():
+    if psutil:
+        return len(psutil.Process().children(recursive=True))
+    return None
+
+
+class ResourceSampler(threading.Thread):
+    def __init__(self, interval=SAMPLE_INTERVAL, child_counter=None):
+        super().__init__(daemon=True, name='profile-sampler')
+        self.interval = interval
+        self.child_counter = child_counter or count_child_processes
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        start = time.perf_counter()
+        while True:
+            self.samples.append((time.perf_counter() - start, current_rss_bytes(), self.child_counter()))
+            if self._stop_event.wait(self.interval):
+                break
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def peak_rss(self):
+        values = [rss for _, rss, _ in self.samples if rss is not None]
+        return max(values) if values else None
+
+    def peak_children(self):
+        values = [children for _, _, children in self.samples if children is not None]
+        return max(values) if values else None
+
+    def write_csv(self, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['elapsed_s', 'rss_bytes', 'child_processes'])
+            for elapsed, rss, children in self.samples:
+                writer.writerow([f"{elapsed:.3f}", '' if rss is None else rss, '' if children is None else children])
+
+
+def _add_stats(target, stats, sign=1):
+    # Adds (or with sign=-1 subtracts) pstats-style {function: (cc, nc, tt, ct, callers)}
+    for function, (cc, nc, tt, ct, callers) in stats.items():
+        old = target.get(function, (0, 0, 0.0, 0.0, {}))
+        merged_callers = dict(old[4])
+        for caller, values in callers.items():
+            before = merged_callers.get(caller, (0, 0, 0.0, 0.0))
+            merged_callers[caller] = tuple(a + sign * b for a, b in zip(before, values))
+        target[function] = (old[0] + sign * cc, old[1] + sign * nc, old[2] + sign * tt, old[3] + sign * ct,
+                            {caller: values for caller, values in merged_callers.items() if values[0]})
+    for function in [function for function, values in target.items() if not values[1]]:
+        del target[function]
+    return target
+
+
+class _ProfileSession:
+    # One profiling session per process, shared by the profiled conversions running at
+    # once: it starts with the first and stops with the last, and covers the conversion
+    # threads and, through thread_profile(), the scheduler threads that synthesize for them
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = 0
+        self.generation = 0
+        self.profilers = []
+        self.local = threading.local()
+
+    def start(self):
+        with self.lock:
+            self.users += 1
+            if self.users == 1 and not PER_THREAD_PROFILERS:
+                profiler = cProfile.Profile()
+                try:
+                    profiler.enable()
+                except ValueError as e:
+                    # Another profiler (a debugger, python -m cProfile) owns this process
+                    logging.error(f"Error starting the profiler: {str(e)}")
+                else:
+                    self.profilers.append(profiler)
+
+    def stop(self):
+        with self.lock:
+            self.users -= 1
+            if self.users == 0:
+                if not PER_THREAD_PROFILERS:
+                    for profiler in self.profilers:
+                        profiler.disable()
+                self.profilers = []
+                self.generation += 1
+
+    def thread_profiler(self):
+        # This thread's profiler for the current session, or None when nothing is profiled
+        if not PER_THREAD_PROFILERS:
+            return None
+        with self.lock:
+            if not self.users:
+                return None
+            local = self.local
+            if getattr(local, 'generation', None) != self.generation:
+                local.profiler = cProfile.Profile()
+                local.generation = self.generation
+                local.active = False
+                self.profilers.append(local.profiler)
+            return local.profiler
+
+    def snapshot(self):
+        # Merged stats of every profiler in the session so far, taken without stopping them
+        with self.lock:
+            profilers = list(self.profilers)
+        stats = {}
+        for profiler in profilers:
+            profiler.snapshot_stats()
+            _add_stats(stats, profiler.stats)
+        return stats
+
+
+_session = _ProfileSession()
+
+
+@contextlib.contextmanager
+def thread_profile():
+    # Profiles the enclosed work on this thread while any conversion is being profiled
+    profiler = _session.thread_profiler()
+    if profiler is None or _session.local.active:
+        yield
+        return
+    _session.local.active = True
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _session.local.active = False
+
+
+class ConversionProfile:
+    # Profiles that overlap share the session, so a job's stats also hold what the jobs
+    # running alongside it did in the meantime
+    def __init__(self, job_dir, job_id=None, child_counter=None, interval=SAMPLE_INTERVAL):
+        self.job_dir = job_dir
+        self.job_id = job_id or os.path.basename(job_dir)
+        self.stats = {}
+        self._baseline = {}
+        self._thread_profile = None
+        self.sampler = ResourceSampler(interval, child_counter)
+        self.elapsed = 0.0
+        self.summary = ''
+        # Extra job figures for the summary, e.g. the converter's sentence counts
+        self.counters = {}
+        self._start = 0.0
+
+    @property
+    def stats_path(self):
+        return os.path.join(self.job_dir, 'profile.pstats')
+
+    @property
+    def timeline_path(self):
+        return os.path.join(self.job_dir, 'timeline.csv')
+
+    @property
+    def summary_path(self):
+        return os.path.join(self.job_dir, 'summary.txt')
+
+    def __enter__(self):
+        os.makedirs(self.job_dir, exist_ok=True)
+        self.sampler.start()
+        self._start = time.perf_counter()
+        _session.start()
+        self._baseline = _session.snapshot()
+        self._thread_profile = thread_profile()
+        self._thread_profile.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._thread_profile.__exit__(None, None, None)
+        self.stats = _add_stats(_session.snapshot(), self._baseline, -1)
+        _session.stop()
+        self.elapsed = time.perf_counter() - self._start
+        self.sampler.stop()
+        with open(self.stats_path, 'wb') as f:
+            marshal.dump(self.stats, f)
+        self.sampler.write_csv(self.timeline_path)
+        self.summary = self.format_summary()
+        with open(self.summary_path, 'w', encoding='utf-8') as f:
+            f.write(self.summary)
+        return False
+
+    def hotspots(self, limit=HOTSPOT_LIMIT):
+        rows = []
+        for (file_name, line, function), (_, calls, tottime, cumtime, _) in self.stats.items():
+            location = f"{os.path.basename(file_name)}:{line}({function})" if line else function
+            rows.append((cumtime, tottime, calls, location))
+        rows.sort(reverse=True)
+        return rows[:limit]
+
+    def format_summary(self, limit=HOTSPOT_LIMIT):
+        peak_rss = self.sampler.peak_rss()
+        peak_children = self.sampler.peak_children()
+        lines = [
+            f"Job {self.job_id}: {self.elapsed:.2f} s",
+            f"Peak RSS: {peak_rss / (1024 * 1024):.1f} MB" if peak_rss else "Peak RSS: n/a",
+            f"Peak child processes: {peak_children}" if peak_children is not None else "Peak child processes: n/a",
+            f"Profile: {self.job_dir}",
+        ]
+        lines += [f"{name.replace('_', ' ').capitalize()}: {value}" for name, value in self.counters.items()]
+        lines += [
+            "",
+            "   cumtime   tottime     calls  function",
+        ]
+        for cumtime, tottime, calls, location in self.hotspots(limit):
+            lines.append(f"{cumtime:10.3f}{tottime:10.3f}{calls:10d}  {location}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# INT8 copies of downloaded voices, made with onnxruntime's dynamic quantization.
+#
+#   python quantize_voice.py es_MX-claude-high
+#
+# writes es_MX-claude-high-int8.onnx (+ .onnx.json) to the models folder, where it shows
+# up as one more voice, and compares its speed and output with the original.
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+import onnx_engine
+
+QUANTIZED_SUFFIX = '-int8'
+# Fixed sentences for the report, so numbers are comparable between voices and runs
+REPORT_SENTENCES = (
+    'The quick brown fox jumps over the lazy dog.',
+    'Please leave a message after the tone.',
+    'Numbers like 42 and 1999 are read aloud.',
+    'How are you today?',
+    'Quantized voices trade a little quality for speed.',
+)
+# No noise, so both voices get the same input and differences come only from the weights
+REPORT_PARAMS = {'noise_scale': 0.0, 'noise_w': 0.0, 'length_scale': 1.0}
+FFT_SIZE = 1024
+HOP_SIZE = 256
+
+
+def available():
+    try:
+        import onnx
+        import onnxruntime.quantization
+    except ImportError:
+        return False
+    return onnx_engine.available()
+
+
+def quantized_model_path(model_path):
+    return f"{os.path.splitext(model_path)[0]}{QUANTIZED_SUFFIX}.onnx"
+
+
+def quantize_model(model_path, output_path=None):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    output_path = output_path or quantized_model_path(model_path)
+    # ConvInteger only has uint8 kernels on CPU, and VITS voices are mostly convolutions
+    quantize_dynamic(model_path, output_path, weight_type=QuantType.QUInt8)
+    shutil.copyfile(f"{model_path}.json", f"{output_path}.json")
+    return output_path
+
+
+def log_spectrum(pcm):
+    np = onnx_engine._import_modules()[0]
+    audio = pcm.astype(np.float32) / onnx_engine.MAX_WAV_VALUE
+    if len(audio) < FFT_SIZE:
+        audio = np.pad(audio, (0, FFT_SIZE - len(audio)))
+    frame_count = 1 + (len(audio) - FFT_SIZE) // HOP_SIZE
+    frames = np.stack([audio[i * HOP_SIZE:i * HOP_SIZE + FFT_SIZE] for i in range(frame_count)])
+    magnitude = np.abs(np.fft.rfft(frames * np.hanning(FFT_SIZE), axis=1))
+    return 20 * np.log10(np.maximum(magnitude, 1e-5))
+
+
+def spectral_distance(reference, candidate):
+    # Log-spectral distance in dB over the frames both renders have
+    np = onnx_engine._import_modules()[0]
+    a, b = log_spectrum(reference), log_spectrum(candidate)
+    frames = min(len(a), len(b))
+    return float(np.mean(np.sqrt(np.mean((a[:frames] - b[:frames]) ** 2, axis=1))))
+
+
+def render_report_sentences(voice, sentences, repeat):
+    np = onnx_engine._import_modules()[0]
+    # The first pass fills the phoneme store and is not timed
+    renders = [np.frombuffer(voice.synthesize(text, REPORT_PARAMS)[0], dtype=np.int16) for text in sentences]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in sentences:
+            voice.synthesize(text, REPORT_PARAMS)
+    seconds = (time.perf_counter() - start) / repeat
+    audio_seconds = sum(len(pcm) for pcm in renders) / voice.sample_rate
+    return renders, seconds, audio_seconds
+
+
+def compare_models(original_path, quantized_path, sentences=REPORT_SENTENCES, repeat=3, phoneme_store=None):
+    original = onnx_engine.OnnxVoice(original_path, phoneme_store)
+    quantized = onnx_engine.OnnxVoice(quantized_path, phoneme_store)
+    original_renders, original_seconds, audio_seconds = render_report_sentences(original, sentences, repeat)
+    quantized_renders, quantized_seconds, quantized_audio_seconds = render_report_sentences(quantized, sentences, repeat)
+    distances = [spectral_distance(a, b) for a, b in zip(original_renders, quantized_renders)]
+    return {
+        'sentences': len(sentences),
+        'original_rtf': round(original_seconds / audio_seconds, 4) if audio_seconds else None,
+        'quantized_rtf': round(quantized_seconds / quantized_audio_seconds, 4) if quantized_audio_seconds else None,
+        'speedup': round(original_seconds / quantized_seconds, 2) if quantized_seconds else None,
+        'spectral_distance_db': round(sum(distances) / len(distances), 2),
+        'max_spectral_distance_db': round(max(distances), 2),
+        'duration_change': round(quantized_audio_seconds / audio_seconds - 1, 4) if audio_seconds else None,
+        'original_bytes': os.path.getsize(original_path),
+        'quantized_bytes': os.path.getsize(quantized_path),
+    }
+
+
+def quantize_voice(model_path, repeat=3, phoneme_store=None):
+    # Quantizes, measures, and keeps the report in the copy's config next to piper's own keys
+    if os.path.splitext(model_path)[0].endswith(QUANTIZED_SUFFIX):
+        raise ValueError(f"{os.path.basename(model_path)} is already quantized")
+    output_path = quantize_model(model_path)
+    report = compare_models(model_path, output_path, repeat=repeat, phoneme_store=phoneme_store)
+    report['source'] = os.path.basename(model_path)
+    report['weight_type'] = 'uint8'
+    with open(f"{output_path}.json", 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    config['quantization'] = report
+    with open(f"{output_path}.json", 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=4)
+    # A copy quantized again replaces the file a loaded session was made from
+    onnx_engine.unload_voice(output_path)
+    return output_path, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Make an INT8 copy of a voice and compare it with the original.')
+    parser.add_argument('voice', help='voice name in the models folder, or a path to an .onnx file')
+    parser.add_argument('--repeat', type=int, default=3, help='timed passes over the report sentences')
+    args = parser.parse_args()
+    if not available():
+        print('Quantization needs numpy, onnx, onnxruntime and piper-phonemize', file=sys.stderr)
+        return 1
+    import tts_core
+    model_path = tts_core.resolve_model_path(args.voice)
+    if not os.path.exists(model_path):
+        print(f"Voice not found: {model_path}", file=sys.stderr)
+        return 1
+    try:
+        output_path, report = quantize_voice(model_path, args.repeat, tts_core.get_phoneme_store())
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(f"Wrote {output_path}")
+    print(f"  size          {report['original_bytes'] / 1e6:.1f} MB -> {report['quantized_bytes'] / 1e6:.1f} MB")
+    print(f"  rtf           {report['original_rtf']} -> {report['quantized_rtf']} ({report['speedup']}x)")
+    print(f"  spectral dist {report['spectral_distance_db']} dB mean, {report['max_spectral_distance_db']} dB max")
+    print(f"  duration      {report['duration_change']:+.2%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
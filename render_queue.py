@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+# Work queue for rendering whole books on several processes or machines.
+#
+#   python render_queue.py add catalog.sqlite3 book.txt --voice es_MX-claude-high
+#   python render_queue.py work catalog.sqlite3        (start as many as you like)
+#   python render_queue.py assemble catalog.sqlite3 --output audiobooks
+#   python render_queue.py status catalog.sqlite3
+#
+# A book is split into chapters and each chapter into units of a few sentences. Workers
+# lease one unit at a time, render it into <queue>.parts next to the database and record
+# the result. Leases are renewed while a unit renders; one that expires goes back to the
+# queue, so a dead worker never stalls a book. The assembler joins the units of finished
+# chapters into one file per chapter and the chapters into one file per book.
+#
+# The queue can live on a shared filesystem: it uses SQLite's rollback journal, which only
+# needs file locks, and stores result paths relative to itself. Leases compare wall clock
+# times of different hosts, so keep their clocks in sync.
+import argparse
+import json
+import logging
+import os
+import re
+import socket
+import sqlite3
+import sys
+import time
+
+import timing_index
+import tts_core
+from document_reader import read_chapters
+
+LEASE_SECONDS = 120.0
+# Renewed this often while a unit renders; well inside the lease
+RENEW_SECONDS = 30.0
+MAX_ATTEMPTS = 3
+UNIT_MAX_CHARS = 1500
+BUSY_TIMEOUT_SECONDS = 60.0
+IDLE_POLL_SECONDS = 5.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    voice TEXT NOT NULL,
+    params TEXT NOT NULL,
+    added REAL NOT NULL,
+    assembled_path TEXT
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    id INTEGER PRIMARY KEY,
+    book_id INTEGER NOT NULL REFERENCES books (id),
+    position INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    assembled_path TEXT
+);
+CREATE TABLE IF NOT EXISTS units (
+    id INTEGER PRIMARY KEY,
+    chapter_id INTEGER NOT NULL REFERENCES chapters (id),
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result_path TEXT,
+    audio_seconds REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS units_by_state ON units (state, lease_expires);
+CREATE INDEX IF NOT EXISTS units_by_chapter ON units (chapter_id, position);
+'''
+
+
+def tag_state(text, state=(None, {})):
+    # The (voice, params) tags in effect after text, read like compile_plan reads them:
+    # None is the book's voice and params maps setting names to the tag's value
+    voice, params = state
+    for match in tts_core.TAG_PATTERN.finditer(text):
+        tag = match.group(1)
+        param_match = tts_core.PARAM_TAG_PATTERN.fullmatch(tag)
+        if tts_core.SILENCE_TAG_PATTERN.fullmatch(tag):
+            continue
+        if tag == 'default':
+            voice, params = None, {}
+        elif tts_core.VOICE_TAG_PATTERN.fullmatch(tag):
+            voice = tag
+        elif param_match:
+            params = {**params, param_match.group(1): param_match.group(2)}
+    return voice, params
+
+
+def state_tags(state):
+    # Tags that put a unit back in state; on the same line as the text, since a tag on a
+    # line of its own would be read as a sentence break
+    voice, params = state
+    tags = [f"<#{voice}#>"] if voice else []
+    tags.extend(f"<#{name}={value}#>" for name, value in params.items())
+    return ''.join(f"{tag} " for tag in tags)
+
+
+def split_units(text, max_chars=UNIT_MAX_CHARS, state=(None, {})):
+    # Groups whole lines, or the sentences of longer lines, into units of up to max_chars.
+    # Every unit starts with the voice and setting tags in effect where it begins; state is
+    # where the text itself begins, e.g. tag_state() of the previous chapter
+    pieces = []
+    for line in text.splitlines():
+        if len(line) <= max_chars:
+            pieces.append(line)
+        else:
+            pieces.extend(tts_core.split_sentences(line))
+    units = []
+    current, size, start = [], 0, state
+    for piece in pieces:
+        if current and size + len(piece) > max_chars:
+            units.append((start, current))
+            current, size, start = [], 0, state
+        current.append(piece)
+        size += len(piece) + 1
+        state = tag_state(piece, state)
+    units.append((start, current))
+    return [state_tags(start) + '\n'.join(lines) for start, lines in units if ''.join(lines).strip()]
+
+
+def safe_name(name):
+    return re.sub(r'[^\w.-]+', '_', name).strip('_') or 'untitled'
+
+
+class RenderQueue:
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.parts_dir = self.path + '.parts'
+        self.connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=DELETE')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def _write(self, sql, args=()):
+        # One statement in an immediate transaction, so concurrent writers queue on the lock
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = connection.execute(sql, args)
+            connection.execute('COMMIT')
+            return cursor
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def add_book(self, name, chapters, voice, params=None, max_chars=UNIT_MAX_CHARS):
+        # chapters yields (title, text), e.g. from document_reader.read_chapters
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            book_id = connection.execute(
+                'INSERT INTO books (name, voice, params, added) VALUES (?, ?, ?, ?)',
+                (name, voice, json.dumps(params or {}), time.time())).lastrowid
+            units = 0
+            # Tags stay in effect from one chapter to the next, as in write_document
+            state = (None, {})
+            for chapter_position, (title, chapter_text) in enumerate(chapters):
+                chapter_id = connection.execute(
+                    'INSERT INTO chapters (book_id, position, title) VALUES (?, ?, ?)',
+                    (book_id, chapter_position, title)).lastrowid
+                rows = [(chapter_id, position, unit) for position, unit in
+                        enumerate(split_units(chapter_text, max_chars, state))]
+                state = tag_state(chapter_text, state)
+                connection.executemany('INSERT INTO units (chapter_id, position, text) VALUES (?, ?, ?)', rows)
+                units += len(rows)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return book_id, units
+
+    def claim(self, owner, lease_seconds=LEASE_SECONDS):
+        # Leases the first pending unit, or one whose lease ran out; None when there is none
+        now = time.time()
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                "SELECT units.*, chapters.book_id, books.voice, books.params FROM units "
+                "JOIN chapters ON chapters.id = units.chapter_id JOIN books ON books.id = chapters.book_id "
+                "WHERE units.state = 'pending' OR (units.state = 'leased' AND units.lease_expires < ?) "
+                "ORDER BY units.id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                connection.execute('COMMIT')
+                return None
+            if row['state'] == 'leased' and row['attempts'] >= MAX_ATTEMPTS:
+                # Expired too often: whatever kills its workers will kill the next one too
+                connection.execute("UPDATE units SET state = 'failed', owner = NULL, error = ? WHERE id = ?",
+                                   (f"Lease expired {row['attempts']} times", row['id']))
+                connection.execute('COMMIT')
+                return self.claim(owner, lease_seconds)
+            connection.execute(
+                "UPDATE units SET state = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE id = ?", (owner, now + lease_seconds, row['id']))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return dict(row)
+
+    def renew(self, unit_id, owner, lease_seconds=LEASE_SECONDS):
+        # False when the lease was lost to another worker
+        cursor = self._write("UPDATE units SET lease_expires = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                             (time.time() + lease_seconds, unit_id, owner))
+        return cursor.rowcount == 1
+
+    def complete(self, unit_id, owner, result_path, audio_seconds):
+        cursor = self._write(
+            "UPDATE units SET state = 'done', owner = NULL, lease_expires = NULL, result_path = ?, "
+            "audio_seconds = ?, error = NULL WHERE id = ? AND owner = ? AND state = 'leased'",
+            (result_path, audio_seconds, unit_id, owner))
+        return cursor.rowcount == 1
+
+    def fail(self, unit_id, owner, error):
+        # Back to the queue until it has failed MAX_ATTEMPTS times
+        self._write(
+            "UPDATE units SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "owner = NULL, lease_expires = NULL, error = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+            (MAX_ATTEMPTS, error, unit_id, owner))
+
+    def leased_count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM units WHERE state = 'leased'").fetchone()[0]
+
+    def retry_failed(self):
+        return self._write("UPDATE units SET state = 'pending', attempts = 0, error = NULL "
+                           "WHERE state = 'failed'").rowcount
+
+    def status(self):
+        rows = self.connection.execute(
+            "SELECT books.id, books.name, books.assembled_path, units.state, COUNT(*) AS count, "
+            "SUM(units.audio_seconds) AS audio_seconds FROM books "
+            "JOIN chapters ON chapters.book_id = books.id JOIN units ON units.chapter_id = chapters.id "
+            "GROUP BY books.id, units.state ORDER BY books.id").fetchall()
+        books = {}
+        for row in rows:
+            book = books.setdefault(row['id'], {'name': row['name'], 'assembled_path': row['assembled_path'],
+                                                'pending': 0, 'leased': 0, 'done': 0, 'failed': 0,
+                                                'audio_seconds': 0.0})
+            book[row['state']] = row['count']
+            book['audio_seconds'] += row['audio_seconds'] or 0.0
+        return list(books.values())
+
+    def finished_chapters(self):
+        # Chapters whose units are all done and that were not assembled yet
+        return [dict(row) for row in self.connection.execute(
+            "SELECT chapters.*, books.name AS book_name FROM chapters JOIN books ON books.id = chapters.book_id "
+            "WHERE chapters.assembled_path IS NULL AND NOT EXISTS "
+            "(SELECT 1 FROM units WHERE units.chapter_id = chapters.id AND units.state != 'done') "
+            "ORDER BY chapters.book_id, chapters.position").fetchall()]
+
+    def chapter_parts(self, chapter_id):
+        return [os.path.join(self.parts_dir, row['result_path']) for row in self.connection.execute(
+            'SELECT result_path FROM units WHERE chapter_id = ? ORDER BY position', (chapter_id,))]
+
+    def finished_books(self):
+        # Books whose chapters are all assembled and that were not joined yet
+        return [dict(row) for row in self.connection.execute(
+            "SELECT * FROM books WHERE assembled_path IS NULL AND NOT EXISTS "
+            "(SELECT 1 FROM chapters WHERE chapters.book_id = books.id AND chapters.assembled_path IS NULL) "
+            "ORDER BY id").fetchall()]
+
+    def book_chapters(self, book_id):
+        return [row['assembled_path'] for row in self.connection.execute(
+            'SELECT assembled_path FROM chapters WHERE book_id = ? ORDER BY position', (book_id,))]
+
+    def mark_chapter_assembled(self, chapter_id, path):
+        self._write('UPDATE chapters SET assembled_path = ? WHERE id = ?', (path, chapter_id))
+
+    def mark_book_assembled(self, book_id, path):
+        self._write('UPDATE books SET assembled_path = ? WHERE id = ?', (path, book_id))
+
+
+def render_unit(queue, unit, owner, lease_seconds=LEASE_SECONDS):
+    # Renders one leased unit into the parts folder; False when it failed or the lease was lost
+    converter = tts_core.TextToSpeechConverter(job_id=f"unit{unit['id']}")
+    state = {'renewed': time.monotonic(), 'lost': False}
+
+    def keep_lease(pcm, sample_rate, sentence):
+        if time.monotonic() - state['renewed'] < min(RENEW_SECONDS, lease_seconds / 3):
+            return
+        state['renewed'] = time.monotonic()
+        try:
+            renewed = queue.renew(unit['id'], owner, lease_seconds)
+        except sqlite3.Error as e:
+            # The lease may still hold; try again at the next sentence
+            logging.error(f"Error renewing the lease of unit {unit['id']}: {str(e)}")
+            return
+        if not renewed:
+            state['lost'] = True
+            converter.stop()
+
+    converter.on_audio = keep_lease
+    output = converter.convert_text_to_speech(unit['text'], unit['voice'], json.loads(unit['params']))
+    if state['lost']:
+        logging.error(f"Lost the lease of unit {unit['id']}, another worker renders it")
+        return False
+    if not output:
+        queue.fail(unit['id'], owner, 'Conversion failed, see the worker log')
+        return False
+    relative_path = os.path.join(str(unit['book_id']), str(unit['chapter_id']), f"{unit['position']:05d}.wav")
+    destination = os.path.join(queue.parts_dir, relative_path)
+    tts_core.publish_render(output, destination)
+    return queue.complete(unit['id'], owner, relative_path, converter.audio_seconds)
+
+
+def run_worker(queue_path, owner=None, exit_when_idle=False, lease_seconds=LEASE_SECONDS):
+    owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+    queue = RenderQueue(queue_path)
+    rendered = 0
+    try:
+        while True:
+            unit = queue.claim(owner, lease_seconds)
+            if unit is None:
+                # Leased units can still come back to the queue if their worker dies
+                if exit_when_idle and not queue.leased_count():
+                    return rendered
+                time.sleep(IDLE_POLL_SECONDS)
+                continue
+            if render_unit(queue, unit, owner, lease_seconds):
+                rendered += 1
+    finally:
+        queue.close()
+
+
+def assemble(queue_path, output_dir):
+    # Joins every finished chapter, then every book whose chapters are all joined.
+    # Returns the written paths
+    queue = RenderQueue(queue_path)
+    written = []
+    try:
+        for chapter in queue.finished_chapters():
+            path = os.path.join(output_dir, safe_name(chapter['book_name']),
+                                tts_core.chapter_file_name(chapter['position'], chapter['title']))
+            timing_index.join_wavs(queue.chapter_parts(chapter['id']), path)
+            queue.mark_chapter_assembled(chapter['id'], path)
+            written.append(path)
+        for book in queue.finished_books():
+            path = os.path.join(output_dir, safe_name(book['name']) + '.wav')
+            timing_index.join_wavs(queue.book_chapters(book['id']), path)
+            timing_index.write_subtitles(path)
+            queue.mark_book_assembled(book['id'], path)
+            written.append(path)
+    finally:
+        queue.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render books on any number of worker processes through a shared queue.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help='split a document into chapters and units and queue it')
+    add.add_argument('queue', help='queue database, local or on a shared path')
+    add.add_argument('text', help='UTF-8 text, Markdown or EPUB file')
+    add.add_argument('--voice', required=True, help='voice name in the models folder of every worker')
+    add.add_argument('--name', help='book name (default: the file name)')
+    add.add_argument('--params', default='{}', help='synthesis params as JSON, e.g. {"length_scale": 1.1}')
+    add.add_argument('--unit-chars', type=int, default=UNIT_MAX_CHARS, help='characters per work unit')
+    work = commands.add_parser('work', help='render units until stopped')
+    work.add_argument('queue')
+    work.add_argument('--exit-when-idle', action='store_true', help='stop when no unit is left to claim')
+    work.add_argument('--lease', type=float, default=LEASE_SECONDS, help='lease length in seconds')
+    work.add_argument('--owner', help='worker name in the queue (default: host:pid)')
+    assemble_parser = commands.add_parser('assemble', help='join finished chapters and books')
+    assemble_parser.add_argument('queue')
+    assemble_parser.add_argument('--output', required=True, help='folder for the chapter and book files')
+    status = commands.add_parser('status', help='show the progress of every book')
+    status.add_argument('queue')
+    retry = commands.add_parser('retry', help='queue failed units again')
+    retry.add_argument('queue')
+    args = parser.parse_args()
+
+    if args.command == 'add':
+        name = args.name or os.path.splitext(os.path.basename(args.text))[0]
+        queue = RenderQueue(args.queue)
+        try:
+            book_id, units = queue.add_book(name, read_chapters(args.text), args.voice, json.loads(args.params), args.unit_chars)
+        except sqlite3.IntegrityError:
+            print(f"A book named {name} is already queued", file=sys.stderr)
+            return 1
+        finally:
+            queue.close()
+        print(f"Queued {name} as book {book_id}: {units} units")
+    elif args.command == 'work':
+        rendered = run_worker(args.queue, args.owner, args.exit_when_idle, args.lease)
+        print(f"Rendered {rendered} units")
+    elif args.command == 'assemble':
+        for path in assemble(args.queue, args.output):
+            print(f"Wrote {path}")
+    elif args.command == 'status':
+        queue = RenderQueue(args.queue)
+        try:
+            for book in queue.status():
+                total = book['pending'] + book['leased'] + book['done'] + book['failed']
+                print(f"{book['name']}: {book['done']}/{total} units done, {book['leased']} leased, "
+                      f"{book['failed']} failed, {book['audio_seconds']:.0f} s of audio"
+                      + (f", joined in {book['assembled_path']}" if book['assembled_path'] else ''))
+        finally:
+            queue.close()
+    elif args.command == 'retry':
+        queue = RenderQueue(args.queue)
+        try:
+            print(f"Queued {queue.retry_failed()} failed units again")
+        finally:
+            queue.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
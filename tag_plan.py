@@ -0,0 +1,140 @@
+from array import array
+
+# Compiled form of a text with <#...#> tags: one op per sentence, silence, voice switch and
+# params change in document order, with the arguments in flat tables. Voices are stored by
+# name and params as small override dicts, each once, so a plan is plain JSON that can be
+# journaled with a conversion, cached or handed to another process. Chunks are the ops that
+# produce audio (speak and silence), numbered in order; journals count progress in chunks.
+OP_SPEAK = 0
+OP_SILENCE = 1
+OP_VOICE = 2
+OP_PARAMS = 3
+PLAN_VERSION = 1
+
+
+class PlanError(ValueError):
+    # Every problem found in a text, raised before anything is synthesized
+    def __init__(self, errors):
+        super().__init__('\n'.join(errors))
+        self.errors = errors
+
+
+class TagPlan:
+    __slots__ = ('default_voice', 'ops', 'args', 'texts', 'seconds', 'voices', 'param_sets',
+                 '_voice_ids', '_param_ids')
+
+    def __init__(self, default_voice):
+        self.default_voice = default_voice
+        # ops[i] is an OP_* code and args[i] its row in texts, seconds, voices or param_sets
+        self.ops = array('B')
+        self.args = array('I')
+        self.texts = []
+        self.seconds = array('d')
+        self.voices = []
+        self.param_sets = []
+        self._voice_ids = {}
+        self._param_ids = {}
+
+    def __len__(self):
+        return len(self.ops)
+
+    def speak(self, text):
+        self.ops.append(OP_SPEAK)
+        self.args.append(len(self.texts))
+        self.texts.append(text)
+
+    def silence(self, seconds):
+        self.ops.append(OP_SILENCE)
+        self.args.append(len(self.seconds))
+        self.seconds.append(seconds)
+
+    def switch_voice(self, voice):
+        index = self._voice_ids.get(voice)
+        if index is None:
+            index = self._voice_ids[voice] = len(self.voices)
+            self.voices.append(voice)
+        self.ops.append(OP_VOICE)
+        self.args.append(index)
+
+    def set_params(self, params):
+        # params replaces the overrides in effect; {} goes back to the conversion's params
+        key = tuple(sorted(params.items()))
+        index = self._param_ids.get(key)
+        if index is None:
+            index = self._param_ids[key] = len(self.param_sets)
+            self.param_sets.append(dict(params))
+        self.ops.append(OP_PARAMS)
+        self.args.append(index)
+
+    def chunks(self, resolve=None):
+        """Yield (kind, value, voice, params) for every speak and silence op in order.
+
+        value is the sentence or the seconds of silence, voice the voice in effect, passed
+        through resolve (once per voice) if given, and params the overrides in effect, a
+        dict shared by every chunk it applies to.
+        """
+        resolved = {}
+
+        def voice_of(name):
+            if resolve is None:
+                return name
+            if name not in resolved:
+                resolved[name] = resolve(name)
+            return resolved[name]
+
+        voice, params = voice_of(self.default_voice), {}
+        texts, seconds, voices, param_sets = self.texts, self.seconds, self.voices, self.param_sets
+        for op, arg in zip(self.ops, self.args):
+            if op == OP_SPEAK:
+                yield 'speak', texts[arg], voice, params
+            elif op == OP_SILENCE:
+                yield 'silence', seconds[arg], voice, params
+            elif op == OP_VOICE:
+                voice = voice_of(voices[arg])
+            else:
+                params = param_sets[arg]
+
+    def end_state(self):
+        # (voice, params) in effect after the last op, where a text that follows goes on
+        voice, params = self.default_voice, {}
+        for op, arg in zip(self.ops, self.args):
+            if op == OP_VOICE:
+                voice = self.voices[arg]
+            elif op == OP_PARAMS:
+                params = self.param_sets[arg]
+        return voice, params
+
+    def sentences(self):
+        return [self.texts[arg] for op, arg in zip(self.ops, self.args) if op == OP_SPEAK]
+
+    def chunk_count(self):
+        return sum(1 for op in self.ops if op in (OP_SPEAK, OP_SILENCE))
+
+    def to_dict(self):
+        return {
+            'version': PLAN_VERSION,
+            'default_voice': self.default_voice,
+            'ops': self.ops.tolist(),
+            'args': self.args.tolist(),
+            'texts': self.texts,
+            'seconds': self.seconds.tolist(),
+            'voices': self.voices,
+            'param_sets': self.param_sets,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != PLAN_VERSION:
+            raise ValueError(f"Unsupported plan version {data.get('version')}")
+        plan = cls(data['default_voice'])
+        plan.ops.extend(data['ops'])
+        plan.args.extend(data['args'])
+        plan.texts = list(data['texts'])
+        plan.seconds.extend(data['seconds'])
+        plan.voices = list(data['voices'])
+        plan.param_sets = [dict(params) for params in data['param_sets']]
+        plan._voice_ids = {voice: index for index, voice in enumerate(plan.voices)}
+        plan._param_ids = {tuple(sorted(params.items())): index for index, params in enumerate(plan.param_sets)}
+        if len(plan.ops) != len(plan.args):
+            raise ValueError('Corrupt plan: ops and args differ in length')
+        return plan
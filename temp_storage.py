@@ -0,0 +1,237 @@
+import atexit
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# ONNX_TTS_TEMP_MODE: "auto" (default) keeps intermediate files on a RAM-backed tmpfs when
+# one is available, "tmpfs" requires it, "disk" keeps them next to the final renders.
+# ONNX_TTS_TEMP_QUOTA_MB caps the bytes reserved for intermediates at once (0 disables it).
+TEMP_MODE_ENV_VAR = 'ONNX_TTS_TEMP_MODE'
+TEMP_QUOTA_ENV_VAR = 'ONNX_TTS_TEMP_QUOTA_MB'
+DEFAULT_QUOTA_BYTES = 256 * 1024 * 1024
+TMPFS_ROOTS = ('/dev/shm',)
+TMPFS_DIR_NAME = 'onnx-tts'
+# Entries from before per-process naming cannot be attributed to a pid
+LEGACY_STALE_SECONDS = 6 * 3600
+
+PROCESS_DIR_PATTERN = re.compile(r'^proc_(\d+)_\w+$')
+FINAL_FILE_PATTERN = re.compile(r'^final_(\d+)_\w+\.(wav|index\.json|srt|vtt)$')
+LEGACY_PATTERN = re.compile(r'^(tmp\w+|worker_\w+|final_[A-Za-z0-9]+\.wav)$')
+
+
+def pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    if psutil:
+        return psutil.pid_exists(pid)
+    if sys.platform == 'win32':
+        # os.kill(pid, 0) would terminate the process on Windows
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return exit_code.value == 259
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def tmpfs_root():
+    for root in TMPFS_ROOTS:
+        if os.path.isdir(root) and os.access(root, os.W_OK):
+            return os.path.join(root, TMPFS_DIR_NAME)
+    return None
+
+
+def tree_size(path):
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(folder, name))
+            except OSError:
+                pass
+    return total
+
+
+class TempStorage:
+    # Owns this process's scratch directory (proc_<pid>_<random>) and accounts for the
+    # bytes reserved in it. reserve() blocks while the quota is exhausted, so producers
+    # slow down instead of filling RAM or the disk.
+    def __init__(self, disk_root, mode='auto', quota_bytes=DEFAULT_QUOTA_BYTES):
+        self.disk_root = disk_root
+        self.requested_mode = mode
+        self.quota_bytes = quota_bytes
+        ram_root = tmpfs_root() if mode in ('auto', 'tmpfs') else None
+        if mode == 'tmpfs' and ram_root is None:
+            logging.error("No tmpfs available for temporary audio, using the disk instead")
+        self.mode = 'tmpfs' if ram_root else 'disk'
+        self.root = ram_root or disk_root
+        self.process_dir = None
+        self.in_use = 0
+        self.peak = 0
+        self.reservations = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.swept_entries = 0
+        self.swept_bytes = 0
+        self.condition = threading.Condition()
+
+    @classmethod
+    def from_environment(cls, disk_root):
+        mode = os.environ.get(TEMP_MODE_ENV_VAR, 'auto').strip().lower() or 'auto'
+        if mode not in ('auto', 'tmpfs', 'disk'):
+            logging.error(f"Unknown {TEMP_MODE_ENV_VAR} value {mode!r}, using auto")
+            mode = 'auto'
+        quota = DEFAULT_QUOTA_BYTES
+        value = os.environ.get(TEMP_QUOTA_ENV_VAR, '').strip()
+        if value:
+            try:
+                quota = int(float(value) * 1024 * 1024)
+            except ValueError:
+                logging.error(f"Invalid {TEMP_QUOTA_ENV_VAR} value {value!r}")
+        return cls(disk_root, mode, quota)
+
+    def ensure_process_dir(self):
+        with self.condition:
+            if self.process_dir is None:
+                os.makedirs(self.root, exist_ok=True)
+                self.process_dir = tempfile.mkdtemp(prefix=f'proc_{os.getpid()}_', dir=self.root)
+                atexit.register(self.cleanup)
+            return self.process_dir
+
+    def mkdtemp(self, prefix='tmp'):
+        return tempfile.mkdtemp(prefix=prefix, dir=self.ensure_process_dir())
+
+    def final_path(self, name):
+        # Final renders stay on disk: they are played, saved (renamed) and may outlive the job
+        os.makedirs(self.disk_root, exist_ok=True)
+        return os.path.join(self.disk_root, f"final_{os.getpid()}_{name}.wav")
+
+    def reserve(self, nbytes, timeout=None):
+        return _Reservation(self, nbytes, timeout)
+
+    def _acquire(self, nbytes, timeout):
+        start = time.perf_counter()
+        with self.condition:
+            waited = False
+            # A single reservation larger than the quota still runs once nothing else is reserved
+            while self.quota_bytes and self.in_use and self.in_use + nbytes > self.quota_bytes:
+                waited = True
+                remaining = None if timeout is None else timeout - (time.perf_counter() - start)
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"Temporary storage quota of {self.quota_bytes} bytes exhausted")
+                self.condition.wait(remaining)
+            if waited:
+                self.waits += 1
+                self.wait_seconds += time.perf_counter() - start
+            self.in_use += nbytes
+            self.reservations += 1
+            self.peak = max(self.peak, self.in_use)
+
+    def release(self, nbytes):
+        with self.condition:
+            self.in_use = max(0, self.in_use - nbytes)
+            self.condition.notify_all()
+
+    def sweep(self):
+        # Removes scratch directories and final renders left behind by processes that died
+        removed = 0
+        freed = 0
+        roots = {self.disk_root, self.root}
+        ram_root = tmpfs_root()
+        if ram_root:
+            roots.add(ram_root)
+        now = time.time()
+        for root in roots:
+            try:
+                entries = os.listdir(root)
+            except OSError:
+                continue
+            for name in entries:
+                path = os.path.join(root, name)
+                match = PROCESS_DIR_PATTERN.match(name) or FINAL_FILE_PATTERN.match(name)
+                if match:
+                    stale = not pid_alive(int(match.group(1)))
+                else:
+                    try:
+                        stale = (LEGACY_PATTERN.match(name) is not None
+                                 and now - os.path.getmtime(path) > LEGACY_STALE_SECONDS)
+                    except OSError:
+                        stale = False
+                if not stale:
+                    continue
+                try:
+                    if os.path.isdir(path):
+                        size = tree_size(path)
+                        shutil.rmtree(path)
+                    else:
+                        size = os.path.getsize(path)
+                        os.remove(path)
+                except OSError as e:
+                    logging.error(f"Error removing stale temporary file {path}: {str(e)}")
+                    continue
+                removed += 1
+                freed += size
+        with self.condition:
+            self.swept_entries += removed
+            self.swept_bytes += freed
+        return removed, freed
+
+    def stats(self):
+        with self.condition:
+            stats = {
+                'mode': self.mode,
+                'root': self.root,
+                'quota_bytes': self.quota_bytes,
+                'in_use_bytes': self.in_use,
+                'peak_bytes': self.peak,
+                'reservations': self.reservations,
+                'waits': self.waits,
+                'wait_seconds': round(self.wait_seconds, 3),
+                'swept_entries': self.swept_entries,
+                'swept_bytes': self.swept_bytes,
+            }
+            process_dir = self.process_dir
+        stats['on_disk_bytes'] = tree_size(process_dir) if process_dir else 0
+        return stats
+
+    def cleanup(self):
+        with self.condition:
+            process_dir, self.process_dir = self.process_dir, None
+        if process_dir:
+            shutil.rmtree(process_dir, ignore_errors=True)
+
+
+class _Reservation:
+    __slots__ = ('storage', 'nbytes', 'timeout')
+
+    def __init__(self, storage, nbytes, timeout):
+        self.storage = storage
+        self.nbytes = nbytes
+        self.timeout = timeout
+
+    def __enter__(self):
+        self.storage._acquire(self.nbytes, self.timeout)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.storage.release(self.nbytes)
+        return False
@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import audio_player
+from wav_writer import StreamingWavWriter
+
+SAMPLE_RATE = 22050
+CHUNK_BYTES = 256 * 1024
+
+
+def chunk(number):
+    # Distinct, frame-aligned content for every chunk, so a read from the wrong place shows
+    return bytes([number % 251]) * CHUNK_BYTES
+
+
+class StreamPlayerTest(unittest.TestCase):
+    def test_stream_started_mid_file_reads_its_own_audio(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'render.wav')
+            writer = StreamingWavWriter(path)
+            # Chunks another job took the player for
+            for number in range(4):
+                writer.write_pcm(chunk(number), SAMPLE_RATE)
+            player = audio_player.StreamPlayer()
+            player.start_stream(path, writer.data_bytes)
+            streamed = bytearray()
+            number = 4
+            # Enough for the ring to drop its oldest audio
+            while len(streamed) <= audio_player.RING_BYTES + CHUNK_BYTES:
+                writer.write_pcm(chunk(number), SAMPLE_RATE)
+                player.append(chunk(number), SAMPLE_RATE)
+                streamed += chunk(number)
+                number += 1
+            self.assertGreater(player.ring_start, 0)
+            self.assertEqual(player.total, len(streamed))
+            self.assertEqual(player._read(0, CHUNK_BYTES), streamed[:CHUNK_BYTES])
+
+            writer.close()
+            player.finish_stream(path)
+            for offset in (0, player.ring_start - CHUNK_BYTES, player.ring_start):
+                self.assertEqual(player._read(offset, CHUNK_BYTES), streamed[offset:offset + CHUNK_BYTES])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import render_queue
+
+
+class SplitUnitsTest(unittest.TestCase):
+    def test_pause_and_setting_tags_before_a_unit_boundary(self):
+        text = '\n'.join([
+            '<#voice_b#> First line of the second voice.',
+            'A line that ends with a pause. <#2#>',
+            '<#speaker=3#> The third speaker starts here.',
+            'Another line that does not fit in the unit.',
+            'And one more after that.',
+        ])
+        units = render_queue.split_units(text, max_chars=100)
+        self.assertGreater(len(units), 1)
+        for unit in units[1:]:
+            # The voice and the setting carry over; the pause stays where it was
+            self.assertTrue(unit.startswith('<#voice_b#> <#speaker=3#> '), unit)
+            self.assertNotIn('<#2#>', unit)
+        self.assertEqual(sum(unit.count('<#2#>') for unit in units), 1)
+
+    def test_default_tag_resets_the_state(self):
+        text = '<#voice_b#> <#length_scale=1.5#> One.\n<#default#> Two.\nThree.'
+        units = render_queue.split_units(text, max_chars=10)
+        self.assertEqual(units[-1], 'Three.')
+        self.assertEqual(render_queue.tag_state(text), (None, {}))
+
+    def test_chapters_start_where_the_previous_one_ended(self):
+        with tempfile.TemporaryDirectory() as folder:
+            queue = render_queue.RenderQueue(os.path.join(folder, 'queue.sqlite3'))
+            try:
+                queue.add_book('book', [('One', '<#voice_b#> Start. <#noise_w=0.5#> <#1.5#>'),
+                                        ('Two', 'Next chapter.')], 'voice_a')
+                texts = [row['text'] for row in queue.connection.execute(
+                    'SELECT units.text FROM units JOIN chapters ON chapters.id = units.chapter_id '
+                    'ORDER BY chapters.position, units.position')]
+            finally:
+                queue.close()
+        self.assertEqual(texts[-1], '<#voice_b#> <#noise_w=0.5#> Next chapter.')
+
+
+if __name__ == '__main__':
+    unittest.main()
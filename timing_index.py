@@ -0,0 +1,202 @@
+import bisect
+import hashlib
+import json
+import os
+import re
+
+import wav_writer
+
+# Sidecar written next to every render: each sentence with its voice, its first and
+# one-past-last sample in the WAV and a key for its audio (text, voice and synthesis
+# settings). Players seek with it, subtitles are formatted from it and a re-rendered
+# sentence is spliced into the WAV by its offsets.
+INDEX_SUFFIX = '.index.json'
+INDEX_VERSION = 1
+# Synthesis params that change a sentence's audio
+KEY_PARAM_NAMES = ('speaker', 'noise_scale', 'length_scale', 'noise_w', 'sentence_silence', 'postprocess')
+ESCAPE_PATTERN = re.compile(r'\\(.)', re.DOTALL)
+
+
+def index_path(wav_path):
+    return os.path.splitext(wav_path)[0] + INDEX_SUFFIX
+
+
+def remove_index(wav_path):
+    try:
+        os.remove(index_path(wav_path))
+    except OSError:
+        pass
+
+
+def sentence_key(text, voice, params):
+    settings = {name: params.get(name) for name in KEY_PARAM_NAMES}
+    data = json.dumps([voice, text, settings], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+
+
+def display_text(text):
+    r"""Sentences are stored as sent to piper, with quotes and backslashes escaped.
+
+    Every escape is undone in one pass, so an escaped backslash never pairs up with the
+    character after it:
+
+    >>> display_text(r'a \\ b \" c \\\" d')
+    'a \\ b " c \\" d'
+    >>> display_text(r'C:\\<#default#> \\\\server')
+    'C:\\<#default#> \\\\server'
+    """
+    return ESCAPE_PATTERN.sub(r'\1', text)
+
+
+def format_timestamp(seconds, separator):
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02}:{minutes:02}:{seconds:02}{separator}{milliseconds:03}"
+
+
+class SentenceIndex:
+    def __init__(self, params=None, sample_rate=None, sentences=None, frames=0):
+        self.params = params or {}
+        self.sample_rate = sample_rate
+        self.sentences = sentences if sentences is not None else []
+        self.frames = frames
+
+    def add(self, text, voice, frames, sample_rate, params=None):
+        # Called for every chunk in file order; silence tags (no text) only move the offset.
+        # params are the settings a <#name=value#> tag changed for this sentence
+        if self.sample_rate is None:
+            self.sample_rate = sample_rate
+        if text:
+            entry = {
+                'text': text,
+                'voice': voice,
+                'start': self.frames,
+                'end': self.frames + frames,
+                'key': sentence_key(text, voice, {**self.params, **params} if params else self.params),
+            }
+            if params:
+                entry['params'] = params
+            self.sentences.append(entry)
+        self.frames += frames
+
+    def start_seconds(self, position):
+        return self.sentences[position]['start'] / self.sample_rate
+
+    def end_seconds(self, position):
+        return self.sentences[position]['end'] / self.sample_rate
+
+    def sentence_at(self, seconds):
+        # Position of the sentence playing at seconds, or the one before a silence tag
+        starts = [sentence['start'] for sentence in self.sentences]
+        return max(0, bisect.bisect_right(starts, seconds * (self.sample_rate or 0)) - 1)
+
+    def save(self, path):
+        data = {
+            'version': INDEX_VERSION,
+            'sample_rate': self.sample_rate,
+            'frames': self.frames,
+            'params': self.params,
+            'sentences': self.sentences,
+        }
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError(f"Unsupported sentence index version in {path}")
+        return cls(data['params'], data['sample_rate'], data['sentences'], data['frames'])
+
+    def to_srt(self):
+        cues = []
+        for position, sentence in enumerate(self.sentences):
+            cues.append(f"{position + 1}\n"
+                        f"{format_timestamp(self.start_seconds(position), ',')} --> "
+                        f"{format_timestamp(self.end_seconds(position), ',')}\n"
+                        f"{display_text(sentence['text'])}\n")
+        return '\n'.join(cues)
+
+    def to_vtt(self):
+        cues = ['WEBVTT\n']
+        for position, sentence in enumerate(self.sentences):
+            cues.append(f"{format_timestamp(self.start_seconds(position), '.')} --> "
+                        f"{format_timestamp(self.end_seconds(position), '.')}\n"
+                        f"{display_text(sentence['text'])}\n")
+        return '\n'.join(cues)
+
+    def splice(self, wav_path, position, pcm, key=None):
+        # Replaces one sentence's samples in wav_path and shifts the sentences after it
+        sentence = self.sentences[position]
+        layout = wav_writer.read_layout(wav_path)
+        frame_size = layout['channels'] * layout['sample_width']
+        wav_writer.splice_pcm(wav_path, sentence['start'] * frame_size, sentence['end'] * frame_size, pcm, layout)
+        shift = len(pcm) // frame_size - (sentence['end'] - sentence['start'])
+        sentence['end'] += shift
+        for later in self.sentences[position + 1:]:
+            later['start'] += shift
+            later['end'] += shift
+        self.frames += shift
+        if key:
+            sentence['key'] = key
+
+    def extend(self, other, start=None):
+        # Appends other's sentences for a WAV joined at frame start (default: the end of this one)
+        start = self.frames if start is None else start
+        if self.sample_rate is None:
+            self.sample_rate = other.sample_rate
+            self.params = self.params or other.params
+        for sentence in other.sentences:
+            self.sentences.append(dict(sentence, start=sentence['start'] + start, end=sentence['end'] + start))
+        self.frames = start + other.frames
+
+
+def load_index(wav_path):
+    # The render's index, or None for WAVs saved without one
+    path = index_path(wav_path)
+    if not os.path.exists(path):
+        return None
+    return SentenceIndex.load(path)
+
+
+def join_wavs(paths, output_path):
+    # Concatenates WAVs and their indexes into output_path and its index; returns the index
+    index = SentenceIndex()
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    temp_path = output_path + '.tmp'
+    writer = wav_writer.StreamingWavWriter(temp_path)
+    try:
+        for path in paths:
+            start = writer.frames_written
+            writer.append_wav(path)
+            part_index = load_index(path)
+            if part_index:
+                index.extend(part_index, start)
+            # Parts without an index still move the sentences after them
+            index.frames = writer.frames_written
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    os.replace(temp_path, output_path)
+    index.save(index_path(output_path))
+    return index
+
+
+def write_subtitles(wav_path, index=None):
+    # Writes <name>.srt and <name>.vtt next to wav_path; returns their paths
+    index = index or load_index(wav_path)
+    if index is None:
+        return []
+    base = os.path.splitext(wav_path)[0]
+    paths = []
+    for extension, text in (('.srt', index.to_srt()), ('.vtt', index.to_vtt())):
+        with open(base + extension, 'w', encoding='utf-8') as f:
+            f.write(text)
+        paths.append(base + extension)
+    return paths
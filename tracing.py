@@ -0,0 +1,130 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+# Set ONNX_TTS_TRACE to an output path (or to 1 for onnx_tts_trace_<pid>.json in the
+# working directory) to record spans. Load the file in chrome://tracing or Perfetto.
+# Events are appended to the file in Chrome's JSON array format, whose closing bracket is
+# optional, and dropped from memory once written, so long sessions stay flat.
+TRACE_ENV_VAR = 'ONNX_TTS_TRACE'
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.add_complete_event(self.name, self.start, end, self.args)
+        return False
+
+    def set(self, **args):
+        self.args.update(args)
+
+
+class Tracer:
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self.events = []
+        self.thread_names = {}
+        self.written_threads = set()
+        self.started = False
+        self.lock = threading.Lock()
+
+    def span(self, name, **args):
+        return _Span(self, name, args)
+
+    def add_complete_event(self, name, start_ns, end_ns, args):
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'ph': 'X',
+            'ts': start_ns / 1000,
+            'dur': (end_ns - start_ns) / 1000,
+            'pid': self.pid,
+            'tid': thread.ident,
+            'args': args,
+        }
+        with self.lock:
+            self.events.append(event)
+            self.thread_names.setdefault(thread.ident, thread.name)
+
+    def export(self):
+        # Appends the events recorded since the last export; the first one starts the file
+        with self.lock:
+            metadata = [
+                {'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                for tid, name in self.thread_names.items() if tid not in self.written_threads
+            ]
+            events = metadata + self.events
+            self.events = []
+            self.written_threads.update(self.thread_names)
+            with open(self.path, 'a' if self.started else 'w', encoding='utf-8') as f:
+                if not self.started:
+                    f.write('[\n')
+                    self.started = True
+                for event in events:
+                    f.write(json.dumps(event))
+                    f.write(',\n')
+        return self.path
+
+
+def _tracer_from_environment():
+    value = os.environ.get(TRACE_ENV_VAR, '').strip()
+    if not value or value in ('0', 'false', 'False'):
+        return None
+    if value in ('1', 'true', 'True'):
+        value = os.path.abspath(f"onnx_tts_trace_{os.getpid()}.json")
+    return Tracer(value)
+
+
+_tracer = _tracer_from_environment()
+
+
+def enabled():
+    return _tracer is not None
+
+
+def span(name, **args):
+    if _tracer is None:
+        return NULL_SPAN
+    return _tracer.span(name, **args)
+
+
+def export():
+    if _tracer is None or not _tracer.events:
+        return None
+    return _tracer.export()
+
+
+atexit.register(export)
@@ -0,0 +1,1371 @@
+import os
+import sys
+import atexit
+import random
+import string
+import subprocess
+import re
+import logging
+import json
+import collections
+import heapq
+import itertools
+import concurrent.futures
+import signal
+import shutil
+import threading
+import time
+import wave
+from wav_writer import StreamingWavWriter
+from temp_storage import TempStorage
+from phoneme_store import PhonemeStore
+import job_journal
+import postprocess
+import profiling
+import timing_index
+import tracing
+from tag_plan import PlanError, TagPlan
+
+# Define paths and folders
+def get_base_path():
+    if getattr(sys, 'frozen', False):
+        # Running in a PyInstaller bundle
+        return sys._MEIPASS
+    else:
+        # Running in normal Python environment
+        return os.path.dirname(os.path.abspath(__file__))
+
+file_folder = get_base_path()
+temp_audio_folder = os.path.join(file_folder, 'temp_audio')
+profiles_folder = os.path.join(file_folder, 'profiles')
+model_folder = os.path.join(os.path.expanduser('~'), 'Documents', 'ONNX-TTS')
+piper_binary_path = os.path.join(file_folder, 'piper', 'piper.exe')
+voices_index_url = "https://raw.githubusercontent.com/HirCoir/bash-logs/refs/heads/main/piper_voices.json"
+phoneme_store_path = os.path.join(model_folder, 'phonemes.sqlite3')
+# Journals of unfinished conversions (see job_journal.py); kept with the models because
+# the app folder of a bundled build does not outlive the process
+journals_folder = os.path.join(model_folder, 'journals')
+
+# "piper" runs the piper binary; "onnx" synthesizes in-process with onnxruntime and
+# reuses phonemes from phoneme_store_path (needs numpy, onnxruntime and piper-phonemize)
+ENGINE_ENV_VAR = 'ONNX_TTS_ENGINE'
+synthesis_engine = os.environ.get(ENGINE_ENV_VAR, 'piper').strip().lower() or 'piper'
+
+# Create necessary directories
+os.makedirs(temp_audio_folder, exist_ok=True)
+os.makedirs(model_folder, exist_ok=True)
+
+# ONNX Runtime session settings of the onnx engine: "latency", "throughput" or "low-memory"
+# (see onnx_engine.INFERENCE_PROFILES). benchmarks/profile_benchmark.py --save writes the
+# best one for the machine to inference_profile_path; the environment variable wins over it
+INFERENCE_PROFILE_ENV_VAR = 'ONNX_TTS_INFERENCE_PROFILE'
+inference_profile_path = os.path.join(model_folder, 'inference_profile.txt')
+
+def load_inference_profile():
+    profile = os.environ.get(INFERENCE_PROFILE_ENV_VAR, '').strip().lower()
+    if not profile and os.path.exists(inference_profile_path):
+        try:
+            with open(inference_profile_path, 'r', encoding='utf-8') as f:
+                profile = f.read().strip().lower()
+        except OSError as e:
+            logging.error(f"Error reading {inference_profile_path}: {str(e)}")
+    return profile or 'latency'
+
+inference_profile = load_inference_profile()
+
+# Default per-sentence post-processing (see postprocess.py): "peak", "loudness" or off.
+# The 'postprocess' synthesis parameter overrides it per conversion
+POSTPROCESS_ENV_VAR = 'ONNX_TTS_POSTPROCESS'
+postprocess_mode = os.environ.get(POSTPROCESS_ENV_VAR, '').strip().lower() or None
+
+# Global replacements and text processing parameters
+global_replacements = [('\n', ' '), ('"', ''), ("'", ""), ('*', '')]
+
+# Function to get process creation flags
+def get_creationflags():
+    return subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+
+# Defaults match piper's own command line defaults
+DEFAULT_SYNTHESIS_PARAMS = {
+    'speaker': 0,
+    'noise_scale': 0.667,
+    'length_scale': 1.0,
+    'noise_w': 0.8,
+    'sentence_silence': 0.2,
+}
+DEFAULT_SAMPLE_RATE = 22050
+PIPER_TIMEOUT = 30
+
+_temp_storage = None
+_phoneme_store = None
+_onnx_engine_missing_logged = False
+_postprocess_missing_logged = False
+
+def get_temp_storage():
+    # Created on first use so callers can still point temp_audio_folder elsewhere
+    global _temp_storage
+    if _temp_storage is None:
+        _temp_storage = TempStorage.from_environment(temp_audio_folder)
+    return _temp_storage
+
+def get_phoneme_store():
+    global _phoneme_store
+    if _phoneme_store is None:
+        _phoneme_store = PhonemeStore(phoneme_store_path)
+    return _phoneme_store
+
+def use_onnx_engine():
+    global _onnx_engine_missing_logged
+    if synthesis_engine != 'onnx':
+        return False
+    import onnx_engine
+    if onnx_engine.available():
+        return True
+    if not _onnx_engine_missing_logged:
+        _onnx_engine_missing_logged = True
+        logging.error("The onnx engine needs numpy, onnxruntime and piper-phonemize, using piper instead")
+    return False
+
+def resolve_postprocess(mode):
+    global _postprocess_missing_logged
+    if not mode:
+        return None
+    if mode not in postprocess.MODES:
+        logging.error(f"Unknown post-processing mode {mode!r}, skipping post-processing")
+        return None
+    if postprocess.available():
+        return mode
+    if not _postprocess_missing_logged:
+        _postprocess_missing_logged = True
+        logging.error("Post-processing needs numpy, skipping it")
+    return None
+
+def precompute_phonemes(sentences_by_model, job_id=None):
+    # Phonemizes every sentence of a job before synthesis starts; re-renders with other
+    # settings then find all of them in the phoneme store
+    import onnx_engine
+    added = 0
+    with tracing.span('precompute_phonemes', job=job_id) as phonemize_span:
+        for model_path, sentences in sentences_by_model.items():
+            try:
+                voice = onnx_engine.get_voice(model_path, get_phoneme_store(), inference_profile)
+                added += voice.precompute([filter_text_segment(sentence) for sentence in sentences])
+            except Exception as e:
+                logging.error(f"Error phonemizing sentences for {model_path}: {str(e)}")
+        phonemize_span.set(phonemized=added)
+    return added
+
+def resolve_model_path(voice):
+    if voice.endswith('.onnx') and os.path.exists(voice):
+        return voice
+    return os.path.join(model_folder, f"{voice}.onnx")
+
+_voice_configs = {}
+
+def load_voice_config(model_path):
+    if model_path not in _voice_configs:
+        try:
+            with open(f"{model_path}.json", 'r', encoding='utf-8') as f:
+                _voice_configs[model_path] = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Error reading voice config for {model_path}: {str(e)}")
+            return {}
+    return _voice_configs[model_path]
+
+def voice_sample_rate(model_path):
+    return load_voice_config(model_path).get('audio', {}).get('sample_rate', DEFAULT_SAMPLE_RATE)
+
+def piper_param_args(params):
+    args = []
+    for name in ('speaker', 'noise_scale', 'length_scale', 'noise_w', 'sentence_silence'):
+        if params.get(name) is not None:
+            args += [f'--{name}', str(params[name])]
+    return args
+
+def kill_processes(processes):
+    for process in list(processes):
+        try:
+            os.kill(process.pid, signal.SIGTERM)
+        except:
+            pass
+    processes.clear()
+
+# Tags: <#1.5#> is a pause in seconds, <#voice-name#> switches voice, <#default#> goes back
+# to the conversion's voice and params, and <#name=value#> changes one of PLAN_PARAM_NAMES
+TAG_PATTERN = re.compile(r'<#(.*?)#>')
+SILENCE_TAG_PATTERN = re.compile(r'\d+\.?\d*')
+VOICE_TAG_PATTERN = re.compile(r'[\w-]+')
+PARAM_TAG_PATTERN = re.compile(r'(\w+)\s*=\s*(\S+)')
+PLAN_PARAM_NAMES = ('speaker', 'noise_scale', 'length_scale', 'noise_w')
+
+def available_voices():
+    # Names of the voices in the models folder, listed once instead of checked per tag
+    try:
+        return {os.path.splitext(name)[0] for name in os.listdir(model_folder) if name.endswith('.onnx')}
+    except OSError:
+        return set()
+
+def parse_param_tag(name, value, model_path):
+    # (name, value) for a <#name=value#> tag, or an error message
+    if name not in PLAN_PARAM_NAMES:
+        return f"Unknown setting in <#{name}={value}#>, use one of: {', '.join(PLAN_PARAM_NAMES)}"
+    try:
+        number = int(value) if name == 'speaker' else float(value)
+    except ValueError:
+        return f"Invalid value in <#{name}={value}#>"
+    if name == 'speaker':
+        speakers = load_voice_config(model_path).get('num_speakers', 1)
+        if not 0 <= number < speakers:
+            return f"Speaker {number} does not exist in {os.path.splitext(os.path.basename(model_path))[0]} (0-{speakers - 1})"
+    elif number < 0 or (name == 'length_scale' and number == 0):
+        return f"Invalid value in <#{name}={value}#>"
+    return name, number
+
+def compile_plan(text, default_model, job_id=None, voices=None, state=None):
+    """Compile text into a TagPlan of sentences, pauses, voice switches and params changes.
+
+    Voice tags are checked against voices (default: the models folder, listed once) and
+    every unknown voice, malformed tag, invalid setting and mix of voices with different
+    sample rates (the output file has one) is reported in one PlanError before anything is
+    synthesized. state is the (voice, params) the text starts with, e.g. the previous
+    plan's end_state(); <#default#> still goes back to default_model.
+    """
+    voices = available_voices() if voices is None else voices
+    errors = []
+
+    def known(voice):
+        return voice in voices or (voice.endswith('.onnx') and os.path.exists(voice))
+
+    if not known(default_model):
+        errors.append(f"Voice {default_model} not found in {model_folder}")
+    with tracing.span('normalize', job=job_id, chars=len(text)):
+        text = filter_code_blocks(text)
+        text = process_line_breaks(text)
+        text = multiple_replace(text, global_replacements)
+        text = text.replace('\\', '\\\\').replace('"', '\\"')
+    plan = TagPlan(default_model)
+    current_model, overrides = default_model, {}
+    # Voices in effect for some audio, speech or silence, in order of appearance
+    audible = {}
+    if state:
+        if state[0] != default_model:
+            current_model = state[0]
+            plan.switch_voice(current_model)
+        if state[1]:
+            overrides = dict(state[1])
+            plan.set_params(overrides)
+
+    def add_text(segment):
+        with tracing.span('split_sentences', job=job_id, voice=current_model):
+            for sentence in split_sentences(filter_text_segment(segment)):
+                plan.speak(sentence)
+                audible[current_model] = None
+
+    position = 0
+    for match in TAG_PATTERN.finditer(text):
+        add_text(text[position:match.start()])
+        position = match.end()
+        tag = match.group(1)
+        param_match = PARAM_TAG_PATTERN.fullmatch(tag)
+        if SILENCE_TAG_PATTERN.fullmatch(tag):
+            plan.silence(float(tag))
+            audible[current_model] = None
+        elif tag == 'default':
+            if current_model != default_model:
+                current_model = default_model
+                plan.switch_voice(default_model)
+            if overrides:
+                overrides = {}
+                plan.set_params(overrides)
+        elif VOICE_TAG_PATTERN.fullmatch(tag):
+            if not known(tag):
+                errors.append(f"Voice {tag} in <#{tag}#> not found in {model_folder}")
+            elif tag != current_model:
+                current_model = tag
+                plan.switch_voice(tag)
+        elif param_match:
+            result = parse_param_tag(param_match.group(1), param_match.group(2), resolve_model_path(current_model))
+            if isinstance(result, str):
+                errors.append(result)
+            else:
+                overrides = {**overrides, result[0]: result[1]}
+                plan.set_params(overrides)
+        else:
+            errors.append(f"Unknown tag <#{tag}#>")
+    add_text(text[position:])
+    rates = {}
+    for voice in audible:
+        if known(voice):
+            rates.setdefault(voice_sample_rate(resolve_model_path(voice)), voice)
+    if len(rates) > 1:
+        errors.append("Voices with different sample rates can't be mixed in one audio: "
+                      + ', '.join(f"{voice} is {rate} Hz" for rate, voice in rates.items()))
+    if errors:
+        # Each problem once, in the order it appears
+        raise PlanError(list(dict.fromkeys(errors)))
+    return plan
+
+# Parameters piper only accepts on its command line; the speaker can change per request
+WORKER_PARAM_NAMES = ('noise_scale', 'length_scale', 'noise_w', 'sentence_silence')
+WARM_UP_TEXT = 'Hi.'
+# Upper estimate of speech per character, used to reserve temp storage before piper writes
+SECONDS_PER_CHAR_ESTIMATE = 0.1
+
+def worker_key(model_path, params):
+    return (model_path,) + tuple(params.get(name) for name in WORKER_PARAM_NAMES)
+
+def warm_up_onnx_voice(model_path, params=None):
+    import onnx_engine
+    start = time.perf_counter()
+    with tracing.span('warm_up', voice=os.path.splitext(os.path.basename(model_path))[0], engine='onnx'):
+        onnx_engine.get_voice(model_path, get_phoneme_store(), inference_profile).synthesize(WARM_UP_TEXT, params)
+    return time.perf_counter() - start
+
+class PiperWorker:
+    # A piper process kept alive in --json-input mode, so the model is loaded only once
+    def __init__(self, model_path, params=None):
+        self.model_path = model_path
+        self.voice = os.path.splitext(os.path.basename(model_path))[0]
+        self.params = {**DEFAULT_SYNTHESIS_PARAMS, **(params or {})}
+        self.key = worker_key(model_path, self.params)
+        self.sample_rate = voice_sample_rate(model_path)
+        self.process = None
+        self.output_dir = None
+        self.load_seconds = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.process:
+            return
+        self.output_dir = get_temp_storage().mkdtemp('worker_')
+        params = {name: self.params.get(name) for name in WORKER_PARAM_NAMES}
+        command = [piper_binary_path, '-m', self.model_path, '--json-input'] + piper_param_args(params)
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            creationflags=get_creationflags()
+        )
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def estimate_wav_bytes(self, text):
+        seconds = len(text) * SECONDS_PER_CHAR_ESTIMATE * (self.params.get('length_scale') or 1.0)
+        return 44 + 2 * int(seconds * self.sample_rate)
+
+    def synthesize(self, text, speaker=None, timeout=PIPER_TIMEOUT):
+        with self.lock, get_temp_storage().reserve(self.estimate_wav_bytes(text)):
+            self.start()
+            output_file = os.path.join(self.output_dir, f"audio_{random_string()}.wav")
+            request = {'text': text, 'output_file': output_file}
+            if speaker is not None:
+                request['speaker_id'] = speaker
+            watchdog = threading.Timer(timeout, self.process.kill)
+            watchdog.start()
+            try:
+                self.process.stdin.write((json.dumps(request) + '\n').encode('utf-8'))
+                self.process.stdin.flush()
+                # piper prints the output path once the file is complete
+                if not self.process.stdout.readline():
+                    raise RuntimeError(f"piper worker for {self.voice} exited")
+            finally:
+                watchdog.cancel()
+            try:
+                with wave.open(output_file, 'rb') as wav_file:
+                    return wav_file.readframes(wav_file.getnframes()), wav_file.getframerate()
+            finally:
+                os.remove(output_file)
+
+    def warm_up(self):
+        start = time.perf_counter()
+        with tracing.span('warm_up', voice=self.voice):
+            self.synthesize(WARM_UP_TEXT)
+        self.load_seconds = time.perf_counter() - start
+        return self.load_seconds
+
+    def close(self):
+        process, self.process = self.process, None
+        if process:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+            try:
+                process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.output_dir:
+            shutil.rmtree(self.output_dir, ignore_errors=True)
+            self.output_dir = None
+
+class WorkerCache:
+    # Idle warm workers, keyed by model and command line parameters
+    def __init__(self, max_idle_per_key=2):
+        self.max_idle_per_key = max_idle_per_key
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def checkout(self, model_path, params):
+        with self.lock:
+            workers = self.idle.get(worker_key(model_path, params), [])
+            while workers:
+                worker = workers.pop()
+                if worker.alive():
+                    return worker
+                worker.close()
+        return None
+
+    def checkin(self, worker):
+        with self.lock:
+            workers = self.idle.setdefault(worker.key, [])
+            if worker.alive() and len(workers) < self.max_idle_per_key:
+                workers.append(worker)
+                return
+        worker.close()
+
+    def close_all(self, keep_model=None):
+        with self.lock:
+            closing = []
+            for key in list(self.idle):
+                if key[0] != keep_model:
+                    closing.extend(self.idle.pop(key))
+        for worker in closing:
+            worker.close()
+
+worker_cache = WorkerCache()
+atexit.register(worker_cache.close_all)
+
+def synthesize_with_worker(text, model_path, params, processes, job_id=None, sentence_index=None, worker=None):
+    borrowed = worker is None
+    if borrowed:
+        worker = worker_cache.checkout(model_path, params)
+        if worker is None:
+            return None
+    with tracing.span('worker_synthesize', job=job_id, sentence=sentence_index, voice=worker.voice):
+        try:
+            worker.start()
+            processes.append(worker.process)
+            return worker.synthesize(text, params.get('speaker'))
+        except Exception as e:
+            logging.error(f"Error generating audio with warm worker: {str(e)}")
+            worker.close()
+            return None
+        finally:
+            if worker.process in processes:
+                processes.remove(worker.process)
+            if borrowed:
+                worker_cache.checkin(worker)
+
+def synthesize_pcm(text, model_path, params=None, processes=None, job_id=None, sentence_index=None, worker=None):
+    # Uses the given worker or an idle warm one when available, otherwise runs one piper
+    # process with raw output on stdout, so the audio never touches disk
+    voice = os.path.splitext(os.path.basename(model_path))[0]
+    processes = processes if processes is not None else []
+    with tracing.span('synthesize_pcm', job=job_id, sentence=sentence_index, voice=voice) as sentence_span:
+        filtered_text = filter_text_segment(text)
+        if not filtered_text:
+            return None
+        params = params or {}
+        if use_onnx_engine():
+            import onnx_engine
+            with tracing.span('onnx_synthesize', job=job_id, sentence=sentence_index, voice=voice):
+                try:
+                    onnx_voice = onnx_engine.get_voice(model_path, get_phoneme_store(), inference_profile)
+                    return onnx_voice.synthesize(filtered_text, params)
+                except Exception as e:
+                    logging.error(f"Error generating audio with the onnx engine: {str(e)}")
+                    return None
+        result = synthesize_with_worker(filtered_text, model_path, params, processes, job_id, sentence_index, worker)
+        if result:
+            return result
+        process = None
+        try:
+            command = [piper_binary_path, '-m', model_path, '--output_raw'] + piper_param_args(params)
+            with tracing.span('piper_spawn', job=job_id, sentence=sentence_index, voice=voice):
+                process = subprocess.Popen(
+                    command,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    creationflags=get_creationflags()
+                )
+            processes.append(process)
+            # Covers model load and inference, piper does not report them separately
+            with tracing.span('piper_synthesize', job=job_id, sentence=sentence_index, voice=voice,
+                              chars=len(filtered_text)):
+                pcm, _ = process.communicate(input=filtered_text.encode('utf-8'), timeout=PIPER_TIMEOUT)
+            sentence_span.set(returncode=process.returncode)
+            if process.returncode != 0:
+                return None
+            return pcm, voice_sample_rate(model_path)
+        except Exception as e:
+            logging.error(f"Error generating audio: {str(e)}")
+            if process and process.poll() is None:
+                process.kill()
+            return None
+        finally:
+            if process in processes:
+                processes.remove(process)
+
+# Lower runs first; the scheduler picks the next sentence by priority, so a preview
+# overtakes a running batch render at the next sentence boundary
+PRIORITY_PREVIEW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BATCH = 2
+
+# With the onnx engine, queued batch-priority sentences of one voice run as padded batches
+# of up to BATCH_MAX_SENTENCES; batch jobs also queue that many sentences ahead
+BATCH_MAX_SENTENCES = 16
+
+def synthesize_pcm_batch(texts, model_path, params=None, job_id=None, sentence_indexes=None):
+    # synthesize_pcm() for several sentences of one voice in padded onnx batches
+    import onnx_engine
+    voice = os.path.splitext(os.path.basename(model_path))[0]
+    params = params or {}
+    filtered = [filter_text_segment(text) for text in texts]
+    todo = [index for index, text in enumerate(filtered) if text]
+    results = [None] * len(texts)
+    with tracing.span('onnx_synthesize_batch', job=job_id, voice=voice, sentences=len(todo),
+                      first_sentence=sentence_indexes[0] if sentence_indexes else None):
+        try:
+            onnx_voice = onnx_engine.get_voice(model_path, get_phoneme_store(), inference_profile)
+            for index, result in zip(todo, onnx_voice.synthesize_batch([filtered[index] for index in todo], params)):
+                results[index] = result
+        except Exception as e:
+            logging.error(f"Error generating audio with the onnx engine: {str(e)}")
+    return results
+
+class _SentenceJob:
+    __slots__ = ('future', 'priority', 'sequence', 'key', 'args')
+
+    def __init__(self, future, priority, sequence, key, args):
+        self.future = future
+        self.priority = priority
+        self.sequence = sequence
+        self.key = key
+        self.args = args
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+class VoiceScheduler:
+    # Runs sentences on persistent piper workers, one queue per voice. Only voices with
+    # sentences of the most urgent queued priority are eligible. Each thread keeps its
+    # worker while its voice has work and it is within the voice's fair share of threads,
+    # otherwise it moves to the voice with the fewest threads and oldest sentence
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count()
+        self.queues = {}
+        self.busy = collections.Counter()
+        self.threads = []
+        self.waiting = 0
+        self.sequence = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def submit(self, text, model_path, params=None, processes=None, job_id=None, sentence_index=None,
+               priority=PRIORITY_NORMAL):
+        params = {**DEFAULT_SYNTHESIS_PARAMS, **(params or {})}
+        future = concurrent.futures.Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError('cannot submit after shutdown')
+            key = worker_key(model_path, params)
+            args = (text, model_path, params, processes if processes is not None else [], job_id, sentence_index)
+            heapq.heappush(self.queues.setdefault(key, []), _SentenceJob(future, priority, self.sequence, key, args))
+            self.sequence += 1
+            if self.waiting == 0 and len(self.threads) < self.max_workers:
+                thread = threading.Thread(target=self._run, daemon=True,
+                                          name=f'voice-scheduler-{len(self.threads)}')
+                self.threads.append(thread)
+                thread.start()
+            self.condition.notify()
+        return future
+
+    def _pick_key(self, current_key):
+        top = min(queue[0].priority for queue in self.queues.values())
+        candidates = [key for key, queue in self.queues.items() if queue[0].priority == top]
+        best = min(candidates, key=lambda key: (self.busy[key], self.queues[key][0].sequence))
+        if current_key in candidates:
+            share = -(-self.max_workers // len(candidates))
+            if self.busy[current_key] < share or self.busy[current_key] <= self.busy[best]:
+                return current_key
+        return best
+
+    def _next_job(self, current_key):
+        with self.condition:
+            while True:
+                while not self.closed and not any(self.queues.values()):
+                    self.waiting += 1
+                    self.condition.wait()
+                    self.waiting -= 1
+                if not any(self.queues.values()):
+                    return None
+                key = self._pick_key(current_key)
+                job = heapq.heappop(self.queues[key])
+                if not self.queues[key]:
+                    del self.queues[key]
+                if job.future.set_running_or_notify_cancel():
+                    self.busy[key] += 1
+                    return job
+
+    def _batch_companions(self, job):
+        # Queued sentences that can share a forward pass with job: same voice, settings and
+        # speaker, and batch priority. A preview waits for at most one batch
+        companions = []
+        speaker = job.args[2].get('speaker')
+        with self.condition:
+            queue = self.queues.get(job.key, [])
+            while (queue and len(companions) < BATCH_MAX_SENTENCES - 1 and queue[0].priority == PRIORITY_BATCH
+                   and queue[0].args[2].get('speaker') == speaker):
+                companion = heapq.heappop(queue)
+                if companion.future.set_running_or_notify_cancel():
+                    self.busy[job.key] += 1
+                    companions.append(companion)
+            if not queue:
+                self.queues.pop(job.key, None)
+        return companions
+
+    def _run_batch(self, jobs):
+        text, model_path, params, processes, job_id, sentence_index = jobs[0].args
+        try:
+            results = synthesize_pcm_batch([job.args[0] for job in jobs], model_path, params, job_id,
+                                           [job.args[5] for job in jobs])
+        except BaseException as e:
+            for job in jobs:
+                job.future.set_exception(e)
+        else:
+            for job, result in zip(jobs, results):
+                job.future.set_result(result)
+        finally:
+            for job in jobs:
+                self._job_done(job.key)
+
+    def _job_done(self, key):
+        with self.condition:
+            self.busy[key] -= 1
+            if not self.busy[key]:
+                del self.busy[key]
+
+    def _run(self):
+        worker = None
+        try:
+            while True:
+                job = self._next_job(worker.key if worker else None)
+                if job is None:
+                    break
+                if job.priority == PRIORITY_BATCH and use_onnx_engine():
+                    companions = self._batch_companions(job)
+                    if companions:
+                        with profiling.thread_profile():
+                            self._run_batch([job] + companions)
+                        continue
+                text, model_path, params, processes, job_id, sentence_index = job.args
+                try:
+                    # Profiled conversions see the work their sentences do on this thread
+                    with profiling.thread_profile():
+                        # The onnx engine runs in-process and needs no piper worker
+                        if not use_onnx_engine() and (worker is None or worker.key != job.key):
+                            if worker:
+                                worker_cache.checkin(worker)
+                            with tracing.span('worker_switch', job=job_id, sentence=sentence_index,
+                                              voice=os.path.splitext(os.path.basename(model_path))[0]):
+                                worker = (worker_cache.checkout(model_path, params)
+                                          or PiperWorker(model_path, params))
+                        result = synthesize_pcm(text, model_path, params, processes, job_id, sentence_index,
+                                                worker)
+                except BaseException as e:
+                    job.future.set_exception(e)
+                else:
+                    job.future.set_result(result)
+                finally:
+                    self._job_done(job.key)
+        finally:
+            if worker:
+                worker_cache.checkin(worker)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self.condition:
+            self.closed = True
+            if cancel_futures:
+                for queue in self.queues.values():
+                    for job in queue:
+                        job.future.cancel()
+                self.queues.clear()
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+def timing_params(params):
+    # The synthesis settings a render's timing index keys its sentences by
+    params = {**DEFAULT_SYNTHESIS_PARAMS, **(params or {})}
+    settings = {name: params.get(name) for name in timing_index.KEY_PARAM_NAMES}
+    settings['postprocess'] = resolve_postprocess(params.get('postprocess', postprocess_mode))
+    return settings
+
+def synthesize_iter(text, voice, params=None, max_pending=None, executor=None, processes=None, job_id=None,
+                    priority=PRIORITY_NORMAL, stats=None, timings=None, plan=None, start=0):
+    """Yield (sentence_index, text, pcm_chunk, sample_rate) for each sentence and silence tag in order.
+
+    At most max_pending sentences are synthesized ahead of the consumer. Closing the
+    generator cancels queued sentences and terminates running piper processes.
+    Sentences run on a VoiceScheduler unless another one, or a plain Executor, is
+    passed as executor. priority orders this job's sentences against other jobs
+    sharing the scheduler. A sentence that repeats with the same voice is synthesized
+    once; stats, if given, receives the 'sentences' and 'duplicates' counts. The
+    'postprocess' param ("peak" or "loudness", default postprocess_mode) trims,
+    normalizes and fades each sentence before it is yielded. timings, a SentenceIndex,
+    records every yielded chunk, which is its sample offset if they are written in order.
+    plan, a TagPlan from compile_plan, saves compiling text again; chunks before start are
+    skipped. Settings changed by <#name=value#> tags apply on top of params.
+    """
+    params = {**DEFAULT_SYNTHESIS_PARAMS, **(params or {})}
+    post_mode = resolve_postprocess(params.get('postprocess', postprocess_mode))
+    if timings is not None:
+        timings.params = timing_params(params)
+    if not max_pending:
+        batched = priority == PRIORITY_BATCH and use_onnx_engine()
+        max_pending = max(2 * os.cpu_count(), BATCH_MAX_SENTENCES) if batched else 2 * os.cpu_count()
+    processes = processes if processes is not None else []
+    own_executor = executor is None
+    if own_executor:
+        executor = VoiceScheduler(max_workers=max_pending)
+    stats = stats if stats is not None else {}
+    pending = collections.deque()
+    plan = plan if plan is not None else compile_plan(text, voice, job_id)
+    # (sentence, model, overrides) identifies the audio. PCM of a repeated sentence is only
+    # kept until its last occurrence has been yielded
+    remaining = collections.Counter((value, model_path, tuple(sorted(overrides.items())))
+                                    for kind, value, model_path, overrides in
+                                    itertools.islice(plan.chunks(resolve_model_path), start, None)
+                                    if kind == 'speak')
+    stats['sentences'] = sum(remaining.values())
+    stats['duplicates'] = stats['sentences'] - len(remaining)
+    if use_onnx_engine():
+        sentences_by_model = collections.defaultdict(list)
+        for sentence, model_path, _ in remaining:
+            sentences_by_model[model_path].append(sentence)
+        stats['phonemized'] = precompute_phonemes(sentences_by_model, job_id)
+    shared = {}
+    chunks = itertools.islice(plan.chunks(resolve_model_path), start, None)
+    index = start
+    try:
+        while True:
+            while len(pending) < max_pending:
+                item = next(chunks, None)
+                if item is None:
+                    break
+                kind, value, model_path, overrides = item
+                key = (value, model_path, tuple(sorted(overrides.items())))
+                if kind == 'silence':
+                    pending.append((index, '', None, value, model_path, key))
+                    index += 1
+                    continue
+                future = shared.get(key)
+                if future is None:
+                    sentence_params = {**params, **overrides} if overrides else params
+                    if isinstance(executor, VoiceScheduler):
+                        future = executor.submit(value, model_path, sentence_params, processes, job_id, index, priority)
+                    else:
+                        future = executor.submit(synthesize_pcm, value, model_path, sentence_params, processes,
+                                                 job_id, index)
+                    if remaining[key] > 1:
+                        shared[key] = future
+                pending.append((index, value, future, None, model_path, key))
+                index += 1
+            if not pending:
+                break
+            sentence_index, sentence, future, seconds, model_path, key = pending.popleft()
+            if future is None:
+                sample_rate = voice_sample_rate(model_path)
+                pcm = bytes(2 * int(round(seconds * sample_rate)))
+                if timings is not None:
+                    timings.add('', None, len(pcm) // 2, sample_rate)
+                yield sentence_index, sentence, pcm, sample_rate
+                continue
+            remaining[key] -= 1
+            if not remaining[key]:
+                shared.pop(key, None)
+            voice_name = os.path.splitext(os.path.basename(model_path))[0]
+            with tracing.span('wait_future', job=job_id, sentence=sentence_index, voice=voice_name):
+                result = future.result()
+            if result:
+                pcm, sample_rate = result
+                if post_mode:
+                    with tracing.span('postprocess', job=job_id, sentence=sentence_index, mode=post_mode):
+                        pcm = postprocess.process_pcm(pcm, sample_rate, post_mode,
+                                                      params.get('sentence_silence') or 0.0)
+                if timings is not None:
+                    timings.add(sentence, voice_name, len(pcm) // 2, sample_rate, dict(key[2]))
+                yield sentence_index, sentence, pcm, sample_rate
+    finally:
+        for entry in pending:
+            if entry[2] is not None:
+                entry[2].cancel()
+        kill_processes(processes)
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+# Pause between speakers in a concatenated sweep, after each speaker's spoken index
+SPEAKER_SWEEP_GAP = 0.6
+
+def voice_speakers(model_path):
+    # (speaker_id, name) pairs; voices without a speaker map only have numbered speakers
+    config = load_voice_config(model_path)
+    names = {speaker_id: name for name, speaker_id in config.get('speaker_id_map', {}).items()}
+    return [(speaker_id, names.get(speaker_id, str(speaker_id))) for speaker_id in range(config.get('num_speakers', 1))]
+
+def sweep_speakers(text, voice, params=None, speakers=None, markers=False, job_id=None):
+    """Yield (speaker_id, name, pcm, sample_rate) for text rendered by each speaker of voice.
+
+    The text is phonemized once and every speaker runs on the same warm session: one
+    onnx session with the speakers' sentences sharing padded batches, or one piper
+    worker that gets the speaker id with each request. speakers defaults to all of
+    the voice's speakers. With markers, each speaker first says its own id.
+    Voice and silence tags in text are ignored.
+    """
+    model_path = resolve_model_path(voice)
+    params = {**DEFAULT_SYNTHESIS_PARAMS, **(params or {})}
+    names = dict(voice_speakers(model_path))
+    speakers = list(names) if speakers is None else list(speakers)
+    sentences = [filter_text_segment(sentence) for sentence in compile_plan(text, voice, job_id).sentences()]
+    sentences = [sentence for sentence in sentences if sentence]
+    marker_texts = {speaker: f"{speaker}." for speaker in speakers} if markers else {}
+    if use_onnx_engine():
+        import onnx_engine
+        onnx_voice = onnx_engine.get_voice(model_path, get_phoneme_store(), inference_profile)
+        with tracing.span('speaker_sweep', job=job_id, voice=voice, speakers=len(speakers), engine='onnx'):
+            onnx_voice.precompute(sentences + list(marker_texts.values()))
+            results = onnx_voice.synthesize_speakers(sentences, speakers, params, marker_texts)
+        for speaker, (pcm, sample_rate) in zip(speakers, results):
+            yield speaker, names.get(speaker, str(speaker)), pcm, sample_rate
+        return
+    worker = worker_cache.checkout(model_path, params) or PiperWorker(model_path, params)
+    try:
+        for speaker in speakers:
+            pcm = bytearray()
+            sample_rate = worker.sample_rate
+            with tracing.span('speaker_sweep', job=job_id, voice=voice, speaker=speaker, engine='piper'):
+                for sentence in ([marker_texts[speaker]] if markers else []) + sentences:
+                    chunk, sample_rate = worker.synthesize(sentence, speaker=speaker)
+                    pcm += chunk
+            yield speaker, names.get(speaker, str(speaker)), bytes(pcm), sample_rate
+    finally:
+        worker_cache.checkin(worker)
+
+def speaker_file_name(voice_name, speaker, name):
+    label = '' if name == str(speaker) else '_' + re.sub(r'[^\w-]+', '_', name)
+    return f"{voice_name}_speaker_{speaker:03d}{label}.wav"
+
+def write_speaker_sweep(text, voice, output_dir, params=None, speakers=None, concatenate=False,
+                        progress=None, running=None, job_id=None):
+    # Writes one labelled file per speaker, or a single file in which every speaker says its
+    # index first. progress(done, total) is called per speaker; running() returning False
+    # stops the sweep. Returns the written paths
+    os.makedirs(output_dir, exist_ok=True)
+    voice_name = os.path.splitext(os.path.basename(resolve_model_path(voice)))[0]
+    total = len(voice_speakers(resolve_model_path(voice))) if speakers is None else len(speakers)
+    paths = []
+    writer = StreamingWavWriter(os.path.join(output_dir, f"{voice_name}_speakers.wav")) if concatenate else None
+    stream = sweep_speakers(text, voice, params, speakers, markers=concatenate, job_id=job_id)
+    try:
+        for done, (speaker, name, pcm, sample_rate) in enumerate(stream, 1):
+            if running and not running():
+                if writer:
+                    writer.abort()
+                return paths
+            if writer:
+                writer.write_pcm(pcm, sample_rate)
+                writer.write_silence(SPEAKER_SWEEP_GAP)
+            else:
+                path = os.path.join(output_dir, speaker_file_name(voice_name, speaker, name))
+                with StreamingWavWriter(path, sample_rate) as speaker_writer:
+                    speaker_writer.write_pcm(pcm, sample_rate)
+                paths.append(path)
+            if progress:
+                progress(done, total)
+        if writer:
+            writer.close()
+            paths.append(writer.path)
+        return paths
+    except Exception:
+        if writer:
+            writer.abort()
+        raise
+    finally:
+        stream.close()
+
+def rerender_sentence(wav_path, position, params=None, text=None, voice=None):
+    # Synthesizes sentence number position of a render again, with the render's params
+    # updated by params and optionally new text or voice, and splices it into the WAV
+    # without touching the other sentences. Returns the sentence's new index entry
+    index = timing_index.load_index(wav_path)
+    if index is None:
+        raise ValueError(f"{wav_path} has no sentence index")
+    entry = index.sentences[position]
+    # Settings the sentence had from a <#name=value#> tag, then the requested changes
+    params = {**index.params, **entry.get('params', {}), **(params or {})}
+    text = text or entry['text']
+    voice = voice or entry['voice']
+    model_path = resolve_model_path(voice)
+    result = synthesize_pcm(text, model_path, params)
+    if not result:
+        raise RuntimeError(f"Could not synthesize sentence {position} of {wav_path}")
+    pcm, sample_rate = result
+    if sample_rate != index.sample_rate:
+        raise ValueError(f"{voice} renders at {sample_rate} Hz, {wav_path} is {index.sample_rate} Hz")
+    post_mode = resolve_postprocess(params.get('postprocess'))
+    if post_mode:
+        pcm = postprocess.process_pcm(pcm, sample_rate, post_mode, params.get('sentence_silence') or 0.0)
+    index.splice(wav_path, position, pcm, timing_index.sentence_key(text, voice, params))
+    entry.update(text=text, voice=voice)
+    # What the sentence now renders with beyond the render's settings, for the next re-render
+    overrides = {name: value for name, value in params.items()
+                 if name in timing_index.KEY_PARAM_NAMES and value != index.params.get(name)}
+    if overrides:
+        entry['params'] = overrides
+    else:
+        entry.pop('params', None)
+    index.save(timing_index.index_path(wav_path))
+    return entry
+
+class TextToSpeechConverter:
+    def __init__(self, job_id=None, executor=None, priority=PRIORITY_NORMAL, on_audio=None, journal=None,
+                 journal_root=None):
+        self.running = True
+        self.piper_processes = []
+        self.job_id = job_id or random_string()
+        self.executor = executor
+        self.priority = priority
+        # Called with (pcm, sample_rate, sentence) for every chunk as it is written, for live
+        # playback; sentence is empty for silence tags
+        self.on_audio = on_audio
+        # A JobJournal to resume, or a folder to journal a new conversion in. Journaled
+        # conversions keep their finished sentences when they are stopped or fail
+        self.journal = journal
+        self.journal_root = journal_root
+        self.audio_seconds = 0.0
+        self.stats = {}
+        # The WAV being written, for players that read back what on_audio already passed on
+        self.output_path = None
+        # Bytes of audio in output_path so far, including what on_audio is being passed
+        self.output_bytes = 0
+        # Why the last conversion returned None, when it failed rather than stopped
+        self.error = None
+
+    def stop(self):
+        self.running = False
+        kill_processes(self.piper_processes)
+
+    def convert_text_to_speech(self, text, default_model, params=None, plan=None):
+        # plan is text compiled by compile_plan, when the caller already validated it
+        writer = None
+        stream = None
+        journal = self.journal
+        with tracing.span('convert_text_to_speech', job=self.job_id, voice=default_model) as job_span:
+            try:
+                final_output = get_temp_storage().final_path(random_string())
+                timings = timing_index.SentenceIndex(timing_params(params))
+                start = 0
+                if journal is None and self.journal_root:
+                    if plan is None:
+                        plan = compile_plan(text, default_model, self.job_id)
+                    try:
+                        journal = self.journal = job_journal.JobJournal.create(
+                            self.journal_root, self.job_id, text, default_model, params, self.priority, plan)
+                    except OSError as e:
+                        logging.error(f"Error creating the job journal, converting without it: {str(e)}")
+                if journal:
+                    plan, start = journal.plan, journal.next_chunk
+                    writer = journal.open_writer()
+                    if start:
+                        self.replay_journal(journal, timings)
+                        job_span.set(resumed_chunks=start, resumed_bytes=journal.data_bytes)
+                else:
+                    writer = StreamingWavWriter(final_output)
+                self.output_path = writer.path
+                self.output_bytes = writer.data_bytes
+                stream = synthesize_iter(text, default_model, params, executor=self.executor,
+                                         processes=self.piper_processes, job_id=self.job_id,
+                                         priority=self.priority, stats=self.stats, timings=timings,
+                                         plan=plan, start=start)
+                sentences = 0
+                for index, sentence, pcm, sample_rate in stream:
+                    if not self.running:
+                        break
+                    # Silence tags arrive as chunks without a sentence
+                    with tracing.span('append_audio' if sentence else 'write_silence', job=self.job_id,
+                                      sentence=index):
+                        writer.write_pcm(pcm, sample_rate)
+                        self.output_bytes = writer.data_bytes
+                        if journal:
+                            journal.record(index, len(pcm), writer)
+                    if self.on_audio:
+                        self.on_audio(pcm, sample_rate, sentence)
+                    sentences += 1
+                job_span.set(sentences=sentences, duplicates=self.stats.get('duplicates', 0))
+                if not self.running:
+                    job_span.set(stopped=True)
+                    self.keep_or_abort(writer, journal)
+                    return None
+                with tracing.span('finalize_output', job=self.job_id):
+                    writer.close()
+                    if journal:
+                        journal.finish(final_output)
+                    timings.save(timing_index.index_path(final_output))
+                self.audio_seconds = writer.duration
+                job_span.set(audio_seconds=round(writer.duration, 3))
+                return final_output
+            except Exception as e:
+                logging.error(f"Error in conversion: {str(e)}")
+                self.error = str(e)
+                if writer:
+                    self.keep_or_abort(writer, journal)
+                return None
+            finally:
+                if stream:
+                    stream.close()
+                tracing.export()
+
+    def keep_or_abort(self, writer, journal):
+        # A journaled conversion keeps what it finished so it can resume later
+        if journal:
+            writer.close()
+            journal.close()
+        else:
+            writer.abort()
+
+    def replay_journal(self, journal, timings):
+        # Timing entries and recovery stats for the chunks a resumed journal already holds
+        chunks = list(itertools.islice(journal.plan.chunks(resolve_model_path), journal.next_chunk))
+        for chunk, size in journal.chunk_bytes:
+            kind, value, model_path, overrides = chunks[chunk]
+            voice_name = os.path.splitext(os.path.basename(model_path))[0]
+            timings.add(value if kind == 'speak' else '', voice_name, size // 2, voice_sample_rate(model_path),
+                        overrides)
+        summary = journal.summary()
+        self.stats['recovered_sentences'] = summary['sentences']
+        self.stats['recovered_seconds'] = summary['audio_seconds']
+
+# Chapters of a document rendering at once. They share one scheduler, so this only needs to
+# be enough to keep it busy while a chapter starts or finishes
+DOCUMENT_PARALLEL_CHAPTERS = 3
+DOCUMENT_POLL_SECONDS = 0.2
+
+def publish_render(output, destination):
+    # Moves a finished render and its timing index to destination. Each file is moved next to
+    # its destination and renamed into place, so nobody sees a partial file even across
+    # filesystems; the WAV goes last, so its index is already there when it appears
+    os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+    with tracing.span('publish_render', destination=destination):
+        for source, target in ((timing_index.index_path(output), timing_index.index_path(destination)),
+                               (output, destination)):
+            if os.path.exists(source):
+                temp_path = target + '.tmp'
+                shutil.move(source, temp_path)
+                os.replace(temp_path, target)
+
+def chapter_file_name(position, title):
+    name = re.sub(r'[^\w.-]+', '_', f"{position + 1:03d} {title}").strip('_')
+    return f"{name}.wav"
+
+def write_document(path, voice, output_dir, params=None, merge=False, max_parallel=DOCUMENT_PARALLEL_CHAPTERS,
+                   executor=None, progress=None, running=None, job_id=None):
+    """Render a TXT, Markdown or EPUB file into one WAV (and timing index) per chapter.
+
+    Chapters are read from the file only when a render slot frees up, and up to
+    max_parallel of them render at once as batch jobs on executor (a VoiceScheduler of
+    their own by default), so memory does not grow with the size of the book. Like in a
+    single text, a voice or setting tag stays in effect across chapters until the next
+    tag. With merge the chapters are also joined into <document>.wav with subtitles.
+    progress(done, title) is called per finished chapter; running() returning False stops
+    the render. A chapter that fails does not stop the others: the rest are written and
+    a RuntimeError then names every failed chapter. Returns the written paths, the
+    chapters in order.
+    """
+    import document_reader
+    os.makedirs(output_dir, exist_ok=True)
+    job_id = job_id or random_string()
+    chapters = enumerate(document_reader.read_chapters(path))
+    own_executor = executor is None
+    if own_executor:
+        executor = VoiceScheduler()
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel)
+    rendering = {}
+    outputs = {}
+    failures = []
+    stopped = False
+    voices = available_voices()
+    # Voice and settings at the end of the chapter read last
+    state = None
+    try:
+        while True:
+            while not stopped and len(rendering) < max_parallel:
+                item = next(chapters, None)
+                if item is None:
+                    break
+                position, (title, text) = item
+                chapter_id = f"{job_id}_chapter{position + 1}"
+                # Compiled in reading order, so each chapter starts where the one before ended
+                try:
+                    plan = compile_plan(text, voice, chapter_id, voices, state)
+                except PlanError as e:
+                    failures.append((position, title, '; '.join(e.errors)))
+                    continue
+                state = plan.end_state()
+                converter = TextToSpeechConverter(chapter_id, executor, PRIORITY_BATCH)
+                future = pool.submit(converter.convert_text_to_speech, text, voice, params, plan)
+                rendering[future] = (position, title, converter)
+            if not rendering:
+                break
+            done, _ = concurrent.futures.wait(rendering, timeout=DOCUMENT_POLL_SECONDS,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            if not stopped and running and not running():
+                stopped = True
+                for _, _, converter in rendering.values():
+                    converter.stop()
+            for future in done:
+                position, title, converter = rendering.pop(future)
+                output = future.result()
+                if stopped:
+                    if output:
+                        os.remove(output)
+                        timing_index.remove_index(output)
+                    continue
+                if not output:
+                    failures.append((position, title, converter.error or 'no audio was produced'))
+                    continue
+                chapter_path = os.path.join(output_dir, chapter_file_name(position, title))
+                try:
+                    publish_render(output, chapter_path)
+                except OSError as e:
+                    failures.append((position, title, str(e)))
+                    continue
+                outputs[position] = chapter_path
+                if progress:
+                    progress(len(outputs), title)
+        paths = [outputs[position] for position in sorted(outputs)]
+        if failures and not stopped:
+            lines = [f"Chapter {position + 1} ({title or 'untitled'}): {reason}"
+                     for position, title, reason in sorted(failures)]
+            raise RuntimeError(f"{len(failures)} of {len(failures) + len(paths)} chapters of "
+                               f"{os.path.basename(path)} could not be rendered, the others are in "
+                               f"{output_dir}:\n" + '\n'.join(lines))
+        if merge and paths and not stopped:
+            merged_path = os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + '.wav')
+            timing_index.write_subtitles(merged_path, timing_index.join_wavs(paths, merged_path))
+            paths.append(merged_path)
+        return paths
+    finally:
+        for _, _, converter in rendering.values():
+            converter.stop()
+        pool.shutdown(wait=True)
+        # Chapters that finished while another one failed
+        for future in rendering:
+            output = None if future.exception() else future.result()
+            if output:
+                os.remove(output)
+                timing_index.remove_index(output)
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+MAX_RUNNING_JOBS = 2
+
+class ConversionJob:
+    def __init__(self, text, voice, params=None, priority=PRIORITY_NORMAL):
+        self.job_id = random_string()
+        self.text = text
+        self.voice = voice
+        self.params = params
+        self.priority = priority
+        self.state = 'queued'
+        self.output = None
+        self.audio_seconds = 0.0
+        self.duplicates = 0
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # Compiled text, when it was validated on submit
+        self.plan = None
+        # JobJournal to resume from, and its summary() when the job was resumed
+        self.journal = None
+        self.recovered = None
+
+    @classmethod
+    def from_journal(cls, journal):
+        job = cls(journal.text, journal.voice, journal.params, journal.priority)
+        job.job_id = journal.job_id
+        job.journal = journal
+        job.recovered = journal.summary()
+        return job
+
+    @property
+    def title(self):
+        text = ' '.join(self.text.split())
+        return text if len(text) <= 40 else text[:37] + '...'
+
+    @property
+    def wall_seconds(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def rtf(self):
+        # Audio recovered from a journal was not rendered by this run
+        rendered = self.audio_seconds - (self.recovered['audio_seconds'] if self.recovered else 0.0)
+        if rendered <= 0:
+            return None
+        return self.wall_seconds / rendered
+
+class JobQueue:
+    # Bookkeeping for queued, running and finished conversions. Up to max_running jobs
+    # run at once; a job that is more urgent than everything running starts right away
+    # and takes over the shared scheduler at the next sentence
+    def __init__(self, max_running=MAX_RUNNING_JOBS):
+        self.max_running = max_running
+        self.jobs = []
+
+    def submit(self, job):
+        self.jobs.append(job)
+        return job
+
+    def get(self, job_id):
+        for job in self.jobs:
+            if job.job_id == job_id:
+                return job
+        return None
+
+    def in_state(self, *states):
+        return [job for job in self.jobs if job.state in states]
+
+    def startable(self):
+        running = self.in_state('running')
+        starting = []
+        for job in sorted(self.in_state('queued'), key=lambda job: (job.priority, job.submitted)):
+            if len(running) < self.max_running or all(job.priority < other.priority for other in running):
+                running.append(job)
+                starting.append(job)
+        return starting
+
+    def mark_running(self, job):
+        job.state = 'running'
+        job.started = time.time()
+
+    def mark_finished(self, job, output, audio_seconds=0.0, duplicates=0):
+        if job.state == 'cancelled':
+            return
+        job.state = 'done' if output else 'failed'
+        job.output = output
+        job.audio_seconds = audio_seconds
+        job.duplicates = duplicates
+        job.finished = time.time()
+
+    def requeue(self, job, journal=None):
+        # Runs a stopped or failed job again, from where its journal stopped if it has one
+        job.state = 'queued'
+        job.journal = journal
+        job.recovered = journal.summary() if journal else None
+        job.output = None
+        job.submitted = time.time()
+        job.started = job.finished = None
+
+    def cancel(self, job):
+        if job.state in ('queued', 'running'):
+            job.state = 'cancelled'
+            job.finished = time.time()
+
+    def clear_finished(self):
+        removed = self.in_state('done', 'failed', 'cancelled')
+        self.jobs = [job for job in self.jobs if job not in removed]
+        return removed
+
+def random_string(length=8):
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
+
+def multiple_replace(text, replacements):
+    for old, new in replacements:
+        text = text.replace(old, new)
+    return text
+
+def filter_code_blocks(text):
+    return re.sub(r'```[^`\n]*\n.*?```', '', text, flags=re.DOTALL)
+
+def process_line_breaks(text):
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines:
+        return ''
+    processed = [lines[0]]
+    for line in lines[1:]:
+        prev_line = processed[-1]
+        if prev_line and prev_line[-1] in ('.', ','):
+            processed.append(' ' + line)
+        else:
+            if prev_line.endswith(')'):
+                processed.append(', ' + line)
+            else:
+                processed.append('. ' + line)
+    processed_text = ''.join(processed)
+    processed_text = re.sub(r'(\))(?![.,])(?=\s|\\\\$)', r'\1,', processed_text)
+    return processed_text
+
+def split_sentences(text):
+    sentences = re.split(r'(?<=[.!?])\s+', text)
+    return [s.strip() for s in sentences if s.strip()]
+
+def filter_text_segment(text_segment):
+    text = filter_code_blocks(text_segment)
+    text = process_line_breaks(text)
+    text = multiple_replace(text, global_replacements)
+    text = text.replace('\\', '\\\\').replace('"', '\\"')
+    return text[:100000]
+
+def download_file(url, destination, progress_callback):
+    import requests
+    response = requests.get(url, stream=True)
+    total_size = int(response.headers.get('content-length', 0))
+    downloaded_size = 0
+    with open(destination, 'wb') as file:
+        for data in response.iter_content(1024):
+            file.write(data)
+            downloaded_size += len(data)
+            progress_callback(downloaded_size, total_size)
+
+
+def load_voices_data(repos_url=voices_index_url):
+    import requests
+    voices_data = {}
+    try:
+        repos_response = requests.get(repos_url)
+        repos_response.raise_for_status()
+        repos = repos_response.json()
+        for repo in repos:
+            repo_base_url = repo['base_url']
+            repo_json_url = repo['json_url']
+            autor = repo['author_repo']
+            try:
+                repo_response = requests.get(repo_json_url)
+                repo_response.raise_for_status()
+                repo_voices = repo_response.json()
+                for model_key, model_info in repo_voices.items():
+                    updated_files = {}
+                    for file_path, file_details in model_info.get('files', {}).items():
+                        full_url = repo_base_url + file_path
+                        updated_files[file_path] = {
+                            'url': full_url,
+                            'size': file_details.get('size', 0)
+                        }
+                    voices_data[model_key] = {
+                        'files': updated_files,
+                        'Author': autor,
+                        'base_model_key': model_key
+                    }
+            except requests.RequestException as e:
+                logging.error(f"Error loading repository {repo_json_url}: {e}")
+    except requests.RequestException as e:
+        logging.error(f"Error loading repos.json: {e}")
+        voices_data = {}
+    return voices_data
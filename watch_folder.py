@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+# Renders every .txt and .jsonl file dropped into a folder, for hands-off batch work.
+#
+#   python watch_folder.py /shares/tts-inbox --voice es_MX-claude-high
+#
+# A .txt file becomes output/<name>.wav. Every line of a .jsonl file is an object with
+# "text" and optionally "id" (the file name), "voice" and synthesis params such as
+# "length_scale", and becomes output/<name>/<id>.wav. Files are picked up once their size
+# has not changed for SETTLE_SECONDS, so inputs still being copied are left alone. Inputs
+# that rendered move to done/, those that failed to errors/ with a .log next to them.
+# status.json is rewritten every few seconds with the backlog and throughput.
+#
+# Run one daemon per folder. Changes are seen through inotify on Linux, and the folder is
+# rescanned every RESCAN_SECONDS anyway, because inotify misses files written by other
+# machines on network shares; --poll skips inotify.
+import argparse
+import collections
+import concurrent.futures
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import signal
+import sys
+import threading
+import time
+
+import tts_core
+
+INPUT_EXTENSIONS = ('.txt', '.jsonl')
+SETTLE_SECONDS = 2.0
+RESCAN_SECONDS = 10.0
+# How often the loop looks at running renders and settling files while there are any
+BUSY_POLL_SECONDS = 0.5
+STATUS_SECONDS = 5.0
+# Throughput is averaged over this much of the recent past
+THROUGHPUT_WINDOW_SECONDS = 600.0
+DEFAULT_JOBS = 2
+OUTPUT_FOLDER = 'output'
+DONE_FOLDER = 'done'
+ERROR_FOLDER = 'errors'
+PROCESSING_FOLDER = '.processing'
+STATUS_FILE = 'status.json'
+# Params a .jsonl line can set for itself
+LINE_PARAM_NAMES = ('speaker', 'noise_scale', 'length_scale', 'noise_w', 'sentence_silence', 'postprocess')
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+
+
+class PollingWatcher:
+    # Sleeps until the next scan; wake() cuts the sleep short, also from a signal handler
+    name = 'polling'
+
+    def __init__(self):
+        self.wake_fd, self.wake_write_fd = os.pipe()
+        os.set_blocking(self.wake_fd, False)
+        os.set_blocking(self.wake_write_fd, False)
+        self.fds = [self.wake_fd]
+
+    def wait(self, timeout):
+        readable, _, _ = select.select(self.fds, [], [], timeout)
+        for fd in readable:
+            try:
+                # The events only say that something changed, the scan finds out what
+                while os.read(fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def wake(self):
+        try:
+            os.write(self.wake_write_fd, b'.')
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        for fd in self.fds + [self.wake_write_fd]:
+            os.close(fd)
+
+
+class InotifyWatcher(PollingWatcher):
+    # Wakes the loop as soon as something in the folder changes; the loop then rescans it
+    name = 'inotify'
+
+    def __init__(self, path):
+        super().__init__()
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            error = ctypes.get_errno()
+            self.close()
+            raise OSError(error, 'inotify_init1 failed')
+        self.fds.append(fd)
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(path), mask) < 0:
+            error = ctypes.get_errno()
+            self.close()
+            raise OSError(error, f"inotify_add_watch failed for {path}")
+
+
+def make_watcher(path, poll=False):
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(path)
+        except (OSError, AttributeError) as e:
+            logging.error(f"inotify is not available, polling {path} instead: {str(e)}")
+    return PollingWatcher()
+
+
+class SettleTracker:
+    # Input files whose size and modification time stayed the same for SETTLE_SECONDS
+    def __init__(self, path, settle_seconds=SETTLE_SECONDS):
+        self.path = path
+        self.settle_seconds = settle_seconds
+        # name -> ((size, mtime), when that state was first seen)
+        self.seen = {}
+
+    def scan(self):
+        # Returns (ready names oldest first, number of files still settling)
+        now = time.monotonic()
+        current = {}
+        try:
+            entries = list(os.scandir(self.path))
+        except OSError as e:
+            logging.error(f"Error reading {self.path}: {str(e)}")
+            return [], 0
+        for entry in entries:
+            name = entry.name
+            if name.startswith('.') or not name.lower().endswith(INPUT_EXTENSIONS):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            state = (stat.st_size, stat.st_mtime_ns)
+            previous = self.seen.get(name)
+            current[name] = previous if previous and previous[0] == state else (state, now)
+        self.seen = current
+        ready = [name for name, (state, since) in current.items() if now - since >= self.settle_seconds]
+        ready.sort(key=lambda name: current[name][0][1])
+        return ready, len(current) - len(ready)
+
+    def forget(self, name):
+        self.seen.pop(name, None)
+
+
+class LogCapture(logging.Handler):
+    # Log records emitted while a render runs, for its error log. Sentences are synthesized
+    # on shared threads, so lines of renders running at the same time can show up too
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.records = []
+        self.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(threadName)s: %(message)s'))
+
+    def emit(self, record):
+        self.records.append(self.format(record))
+
+
+def write_json(path, data):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(temp_path, path)
+
+
+def move_to_folder(path, folder):
+    # Moves path into folder, replacing a file of the same name from an earlier run
+    os.makedirs(folder, exist_ok=True)
+    destination = os.path.join(folder, os.path.basename(path))
+    os.replace(path, destination)
+    return destination
+
+
+class WatchFolder:
+    def __init__(self, input_dir, voice, params=None, output_dir=None, jobs=DEFAULT_JOBS, poll=False,
+                 status_path=None, once=False):
+        self.input_dir = os.path.abspath(input_dir)
+        self.output_dir = os.path.abspath(output_dir or os.path.join(self.input_dir, OUTPUT_FOLDER))
+        self.done_dir = os.path.join(self.input_dir, DONE_FOLDER)
+        self.error_dir = os.path.join(self.input_dir, ERROR_FOLDER)
+        self.processing_dir = os.path.join(self.input_dir, PROCESSING_FOLDER)
+        self.status_path = status_path or os.path.join(self.input_dir, STATUS_FILE)
+        self.voice = voice
+        self.params = params or {}
+        self.jobs = jobs
+        self.once = once
+        self.tracker = SettleTracker(self.input_dir)
+        self.watcher = make_watcher(self.input_dir, poll)
+        # One scheduler for every render, so its piper workers stay warm between files
+        self.scheduler = tts_core.VoiceScheduler()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='watch-job')
+        self.running = {}
+        self.converters = {}
+        self.lock = threading.Lock()
+        self.stopping = False
+        self.queued = 0
+        self.settling = 0
+        self.started = time.time()
+        self.files_done = 0
+        self.files_failed = 0
+        self.outputs = 0
+        self.audio_seconds = 0.0
+        # (finished at, audio seconds, characters) of recent files, for the throughput
+        self.recent = collections.deque()
+        self.last_status = 0.0
+
+    def warm_up(self):
+        model_path = tts_core.resolve_model_path(self.voice)
+        if tts_core.use_onnx_engine():
+            seconds = tts_core.warm_up_onnx_voice(model_path, self.params)
+        else:
+            worker = tts_core.PiperWorker(model_path, self.params)
+            seconds = worker.warm_up()
+            tts_core.worker_cache.checkin(worker)
+        logging.info(f"Voice {self.voice} ready (loaded in {seconds:.2f} s)")
+
+    def recover(self):
+        # Inputs a crashed or killed daemon was rendering go back to the inbox
+        if not os.path.isdir(self.processing_dir):
+            return
+        for name in os.listdir(self.processing_dir):
+            os.replace(os.path.join(self.processing_dir, name), os.path.join(self.input_dir, name))
+            logging.info(f"Queued {name} again, its last render did not finish")
+
+    def run(self):
+        for folder in (self.output_dir, self.processing_dir):
+            os.makedirs(folder, exist_ok=True)
+        self.recover()
+        self.warm_up()
+        logging.info(f"Watching {self.input_dir} ({self.watcher.name}), writing to {self.output_dir}")
+        try:
+            while not self.stopping:
+                self.collect_finished()
+                ready, self.settling = self.tracker.scan()
+                while ready and len(self.running) < self.jobs:
+                    self.start(ready.pop(0))
+                self.queued = len(ready)
+                if time.monotonic() - self.last_status >= STATUS_SECONDS:
+                    self.write_status()
+                if self.once and not self.running and not ready and not self.settling:
+                    break
+                busy = self.running or self.settling or ready
+                self.watcher.wait(BUSY_POLL_SECONDS if busy else RESCAN_SECONDS)
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        # Safe to call from a signal handler: the loop stops the renders once it wakes up
+        self.stopping = True
+        self.watcher.wake()
+
+    def stop_renders(self):
+        with self.lock:
+            for converter in self.converters.values():
+                converter.stop()
+
+    def shutdown(self):
+        self.stopping = True
+        self.stop_renders()
+        self.pool.shutdown(wait=True)
+        self.collect_finished()
+        self.scheduler.shutdown(wait=False, cancel_futures=True)
+        self.watcher.close()
+        self.write_status()
+
+    def start(self, name):
+        # Claims the input by moving it out of the inbox, then renders it on the pool
+        path = os.path.join(self.processing_dir, name)
+        try:
+            os.replace(os.path.join(self.input_dir, name), path)
+        except OSError as e:
+            logging.error(f"Error claiming {name}: {str(e)}")
+            return
+        self.tracker.forget(name)
+        self.running[name] = (self.pool.submit(self.render_file, path), time.time())
+        logging.info(f"Rendering {name}")
+
+    def collect_finished(self):
+        for name, (future, started) in list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[name]
+            path = os.path.join(self.processing_dir, name)
+            try:
+                outputs, audio_seconds, characters, errors, log_lines = future.result()
+            except Exception as e:
+                outputs, audio_seconds, characters, errors, log_lines = 0, 0.0, 0, [str(e)], []
+            if self.stopping and errors:
+                # Stopped, not failed: it renders again on the next start
+                os.replace(path, os.path.join(self.input_dir, name))
+                continue
+            self.outputs += outputs
+            self.audio_seconds += audio_seconds
+            self.recent.append((time.time(), audio_seconds, characters))
+            if errors:
+                self.files_failed += 1
+                self.write_error_log(name, started, errors, log_lines)
+                move_to_folder(path, self.error_dir)
+                logging.error(f"{name} failed, moved to {self.error_dir}")
+            else:
+                self.files_done += 1
+                move_to_folder(path, self.done_dir)
+                logging.info(f"{name} done: {outputs} file(s), {audio_seconds:.1f} s of audio")
+            self.write_status()
+
+    def render_file(self, path):
+        # Returns (outputs, audio seconds, characters, errors, log lines)
+        capture = LogCapture()
+        logging.getLogger().addHandler(capture)
+        try:
+            name = os.path.basename(path)
+            stem, extension = os.path.splitext(name)
+            outputs, audio_seconds, characters, errors = 0, 0.0, 0, []
+            try:
+                # .jsonl lines are read as they are rendered
+                for item_name, text, voice, params in self.read_items(path, stem, extension.lower()):
+                    if self.stopping:
+                        errors.append('Stopped')
+                        break
+                    if isinstance(item_name, Exception):
+                        errors.append(str(item_name))
+                        continue
+                    seconds = self.render_text(text, voice, params, os.path.join(self.output_dir, item_name))
+                    if seconds is None:
+                        errors.append(f"Could not render {item_name}")
+                        continue
+                    outputs += 1
+                    audio_seconds += seconds
+                    characters += len(text)
+            except (OSError, ValueError) as e:
+                errors.append(f"Error reading {name}: {str(e)}")
+            return outputs, audio_seconds, characters, errors, capture.records
+        finally:
+            logging.getLogger().removeHandler(capture)
+
+    def read_items(self, path, stem, extension):
+        # Yields (output name, text, voice, params); a bad .jsonl line yields its error as the name
+        if extension == '.txt':
+            with open(path, 'r', encoding='utf-8-sig') as f:
+                yield f"{stem}.wav", f.read(), self.voice, self.params
+            return
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                    text = item['text']
+                except (ValueError, KeyError, TypeError) as e:
+                    yield ValueError(f"Line {number}: not an object with a \"text\" ({str(e)})"), None, None, None
+                    continue
+                item_id = str(item.get('id') or f"{number:05d}")
+                params = {**self.params, **{key: item[key] for key in LINE_PARAM_NAMES if key in item}}
+                file_name = os.path.basename(item_id)
+                yield os.path.join(stem, file_name + '.wav'), text, item.get('voice') or self.voice, params
+
+    def render_text(self, text, voice, params, destination):
+        # Audio seconds of the published render, or None when it failed
+        if not os.path.exists(tts_core.resolve_model_path(voice)):
+            logging.error(f"Voice {voice} not found")
+            return None
+        converter = tts_core.TextToSpeechConverter(executor=self.scheduler, priority=tts_core.PRIORITY_BATCH)
+        with self.lock:
+            if self.stopping:
+                return None
+            self.converters[converter.job_id] = converter
+        try:
+            output = converter.convert_text_to_speech(text, voice, params)
+        finally:
+            with self.lock:
+                self.converters.pop(converter.job_id, None)
+        if not output:
+            return None
+        tts_core.publish_render(output, destination)
+        return converter.audio_seconds
+
+    def write_error_log(self, name, started, errors, log_lines):
+        os.makedirs(self.error_dir, exist_ok=True)
+        lines = [f"Input: {name}",
+                 f"Started: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))}",
+                 f"Failed: {time.strftime('%Y-%m-%d %H:%M:%S')}",
+                 f"Voice: {self.voice}", ''] + errors
+        if log_lines:
+            lines += ['', 'Log:'] + log_lines
+        with open(os.path.join(self.error_dir, name + '.log'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def write_status(self):
+        now = time.time()
+        while self.recent and now - self.recent[0][0] > THROUGHPUT_WINDOW_SECONDS:
+            self.recent.popleft()
+        window = min(THROUGHPUT_WINDOW_SECONDS, now - self.started) or 1.0
+        status = {
+            'updated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'watcher': self.watcher.name,
+            'voice': self.voice,
+            'backlog': {
+                'queued': self.queued,
+                'settling': self.settling,
+                'rendering': sorted(self.running),
+                'oldest_rendering_seconds': round(now - min(started for _, started in self.running.values()), 1)
+                                            if self.running else 0.0,
+            },
+            'totals': {
+                'files_done': self.files_done,
+                'files_failed': self.files_failed,
+                'outputs': self.outputs,
+                'audio_seconds': round(self.audio_seconds, 1),
+            },
+            'throughput': {
+                'window_seconds': round(window, 1),
+                'files_per_hour': round(len(self.recent) * 3600.0 / window, 2),
+                'characters_per_second': round(sum(item[2] for item in self.recent) / window, 1),
+                # Seconds of audio rendered per second of wall time
+                'audio_speed': round(sum(item[1] for item in self.recent) / window, 3),
+            },
+        }
+        try:
+            write_json(self.status_path, status)
+        except OSError as e:
+            logging.error(f"Error writing {self.status_path}: {str(e)}")
+        self.last_status = time.monotonic()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render .txt and .jsonl files dropped into a folder.')
+    parser.add_argument('folder', help='folder to watch')
+    parser.add_argument('--voice', required=True, help='voice for .txt files and .jsonl lines without one')
+    parser.add_argument('--params', default='{}', help='synthesis params as JSON, e.g. {"length_scale": 1.1}')
+    parser.add_argument('--output', help=f"folder for the audio (default: <folder>/{OUTPUT_FOLDER})")
+    parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS, help='files rendered at the same time')
+    parser.add_argument('--status', help=f"status file (default: <folder>/{STATUS_FILE})")
+    parser.add_argument('--poll', action='store_true', help='rescan the folder instead of using inotify')
+    parser.add_argument('--once', action='store_true', help='exit once the folder is empty')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if not os.path.isdir(args.folder):
+        print(f"{args.folder} is not a folder", file=sys.stderr)
+        return 1
+    if not os.path.exists(tts_core.resolve_model_path(args.voice)):
+        print(f"Voice {args.voice} not found in {tts_core.model_folder}", file=sys.stderr)
+        return 1
+    daemon = WatchFolder(args.folder, args.voice, json.loads(args.params), args.output, max(1, args.jobs),
+                         args.poll, args.status, args.once)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: daemon.stop())
+    daemon.run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
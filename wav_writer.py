@@ -0,0 +1,250 @@
+import os
+import struct
+import wave
+
+import tracing
+
+# RIFF header layout reserved up front (80 bytes):
+#   RIFF <size> WAVE | JUNK <28> (room for a ds64 chunk) | fmt <16> | data <size>
+# The JUNK chunk is rewritten as ds64 on close when the file outgrows 4 GB.
+RIFF_HEADER_SIZE = 12
+DS64_CHUNK_SIZE = 28
+FMT_CHUNK_SIZE = 16
+HEADER_SIZE = RIFF_HEADER_SIZE + (8 + DS64_CHUNK_SIZE) + (8 + FMT_CHUNK_SIZE) + 8
+MAX_RIFF_SIZE = 0xFFFFFFFF
+COPY_CHUNK_FRAMES = 65536
+FLUSH_INTERVAL_BYTES = 4 * 1024 * 1024
+
+
+class StreamingWavWriter:
+    def __init__(self, path, sample_rate=None, channels=1, sample_width=2,
+                 flush_interval=FLUSH_INTERVAL_BYTES, max_riff_size=MAX_RIFF_SIZE, resume_bytes=None):
+        # resume_bytes continues a file this class wrote, after its first resume_bytes of audio
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.flush_interval = flush_interval
+        self.max_riff_size = max_riff_size
+        self.data_bytes = 0
+        self.pending_silence = 0.0
+        self.is_rf64 = False
+        self.closed = False
+        self._unflushed = 0
+        if resume_bytes is not None:
+            self._resume(resume_bytes)
+            return
+        self.file = open(path, 'wb')
+        if sample_rate:
+            self._write_header()
+
+    def _resume(self, resume_bytes):
+        layout = read_layout(self.path)
+        if layout['data_offset'] != HEADER_SIZE:
+            raise ValueError(f"{self.path} was not written by StreamingWavWriter")
+        self.sample_rate = layout['sample_rate']
+        self.channels = layout['channels']
+        self.sample_width = layout['sample_width']
+        # The header may lag behind the data, the file size does not. Whatever follows
+        # resume_bytes was written after the caller's last record of it
+        self.data_bytes = min(resume_bytes, os.path.getsize(self.path) - HEADER_SIZE)
+        self.file = open(self.path, 'r+b')
+        self.file.truncate(HEADER_SIZE + self.data_bytes)
+        self.file.seek(0, os.SEEK_END)
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def frame_size(self):
+        return self.channels * self.sample_width
+
+    @property
+    def frames_written(self):
+        return self.data_bytes // self.frame_size
+
+    @property
+    def duration(self):
+        if not self.sample_rate:
+            return 0.0
+        return self.frames_written / self.sample_rate
+
+    def _set_format(self, sample_rate, channels, sample_width):
+        if self.file.tell() == 0:
+            self.sample_rate = sample_rate
+            self.channels = channels
+            self.sample_width = sample_width
+            self._write_header()
+            if self.pending_silence:
+                seconds, self.pending_silence = self.pending_silence, 0.0
+                self.write_silence(seconds)
+        elif (sample_rate, channels, sample_width) != (self.sample_rate, self.channels, self.sample_width):
+            raise ValueError(
+                f"Audio format {sample_rate} Hz/{channels} ch/{sample_width * 8} bit does not match "
+                f"output format {self.sample_rate} Hz/{self.channels} ch/{self.sample_width * 8} bit"
+            )
+
+    def _write_header(self):
+        self.file.seek(0)
+        self.file.write(self._build_header(0, 0))
+
+    def _build_header(self, riff_size, data_size):
+        block_align = self.frame_size
+        byte_rate = self.sample_rate * block_align
+        fmt = struct.pack('<HHIIHH', 1, self.channels, self.sample_rate, byte_rate,
+                          block_align, self.sample_width * 8)
+        if self.is_rf64:
+            ds64 = struct.pack('<QQQI', riff_size, data_size, data_size // block_align, 0)
+            return (b'RF64' + struct.pack('<I', MAX_RIFF_SIZE) + b'WAVE'
+                    + b'ds64' + struct.pack('<I', DS64_CHUNK_SIZE) + ds64
+                    + b'fmt ' + struct.pack('<I', FMT_CHUNK_SIZE) + fmt
+                    + b'data' + struct.pack('<I', MAX_RIFF_SIZE))
+        return (b'RIFF' + struct.pack('<I', riff_size) + b'WAVE'
+                + b'JUNK' + struct.pack('<I', DS64_CHUNK_SIZE) + bytes(DS64_CHUNK_SIZE)
+                + b'fmt ' + struct.pack('<I', FMT_CHUNK_SIZE) + fmt
+                + b'data' + struct.pack('<I', data_size))
+
+    def write_pcm(self, pcm, sample_rate=None, channels=None, sample_width=None):
+        self._set_format(sample_rate or self.sample_rate, channels or self.channels,
+                         sample_width or self.sample_width)
+        if not pcm:
+            return
+        self.file.write(pcm)
+        self.data_bytes += len(pcm)
+        self._unflushed += len(pcm)
+        if self._unflushed >= self.flush_interval:
+            self.flush()
+
+    def write_silence(self, seconds):
+        if seconds <= 0:
+            return
+        if not self.sample_rate:
+            # Format is only known once the first sentence arrives
+            self.pending_silence += seconds
+            return
+        with tracing.span('write_silence', seconds=seconds):
+            remaining = int(round(seconds * self.sample_rate)) * self.frame_size
+            chunk = bytes(min(remaining, COPY_CHUNK_FRAMES * self.frame_size))
+            while remaining > 0:
+                part = chunk[:remaining]
+                self.write_pcm(part)
+                remaining -= len(part)
+
+    def append_wav(self, wav_path):
+        with wave.open(wav_path, 'rb') as source:
+            self._set_format(source.getframerate(), source.getnchannels(), source.getsampwidth())
+            while True:
+                frames = source.readframes(COPY_CHUNK_FRAMES)
+                if not frames:
+                    break
+                self.write_pcm(frames)
+        return self.data_bytes
+
+    def flush(self):
+        # Keep the on-disk header consistent so a partial render is already playable
+        if self.file.tell() == 0:
+            return
+        # One span per batch of write_pcm calls that reaches the disk
+        with tracing.span('flush_wav', bytes=self._unflushed):
+            self._unflushed = 0
+            if self.is_rf64 or HEADER_SIZE - 8 + self.data_bytes > self.max_riff_size:
+                self.file.flush()
+                return
+            position = self.file.tell()
+            self.file.seek(4)
+            self.file.write(struct.pack('<I', HEADER_SIZE - 8 + self.data_bytes))
+            self.file.seek(HEADER_SIZE - 4)
+            self.file.write(struct.pack('<I', self.data_bytes))
+            self.file.seek(position)
+            self.file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        with tracing.span('close_wav', bytes=self.data_bytes):
+            try:
+                if self.file.tell() == 0:
+                    self.sample_rate = self.sample_rate or 22050
+                    self._write_header()
+                if self.data_bytes % 2:
+                    self.file.write(b'\x00')
+                riff_size = HEADER_SIZE - 8 + self.data_bytes + self.data_bytes % 2
+                self.is_rf64 = riff_size > self.max_riff_size
+                self.file.seek(0)
+                self.file.write(self._build_header(riff_size, self.data_bytes))
+            finally:
+                self.file.close()
+
+    def abort(self):
+        if not self.closed:
+            self.closed = True
+            self.file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def read_layout(path):
+    # Data offset and size and the format of a RIFF or RF64 WAV, found by walking its chunks
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if header[:4] not in (b'RIFF', b'RF64') or header[8:12] != b'WAVE':
+            raise ValueError(f"{path} is not a WAV file")
+        layout = {}
+        ds64_data_size = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+            if chunk_id == b'data':
+                if size == MAX_RIFF_SIZE and ds64_data_size is not None:
+                    size = ds64_data_size
+                layout['data_offset'] = f.tell()
+                layout['data_bytes'] = min(size, os.path.getsize(path) - f.tell())
+                return layout
+            body = f.read(size + size % 2)
+            if chunk_id == b'ds64':
+                ds64_data_size = struct.unpack('<Q', body[8:16])[0]
+            elif chunk_id == b'fmt ':
+                _, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', body[:16])
+                layout.update(channels=channels, sample_rate=sample_rate, sample_width=bits // 8)
+
+
+def splice_pcm(path, start, end, pcm, layout=None):
+    # Replaces data bytes [start, end) of path with pcm. The same length is patched in
+    # place; otherwise the rest of the data is copied as raw bytes into a new file
+    layout = layout or read_layout(path)
+    offset = layout['data_offset']
+    if len(pcm) == end - start:
+        with open(path, 'r+b') as f:
+            f.seek(offset + start)
+            f.write(pcm)
+        return
+    temp_path = path + '.splice'
+    writer = StreamingWavWriter(temp_path, layout['sample_rate'], layout['channels'], layout['sample_width'])
+    try:
+        with open(path, 'rb') as source:
+            chunk_size = COPY_CHUNK_FRAMES * writer.frame_size
+            for first, last in ((0, start), (end, layout['data_bytes'])):
+                source.seek(offset + first)
+                remaining = last - first
+                while remaining > 0:
+                    data = source.read(min(chunk_size, remaining))
+                    if not data:
+                        break
+                    writer.write_pcm(data)
+                    remaining -= len(data)
+                if first == 0:
+                    writer.write_pcm(pcm)
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    os.replace(temp_path, path)